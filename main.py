@@ -23,6 +23,40 @@ def parse_args():
         action="store_true",
         help="Khởi tạo vector database"
     )
+    parser.add_argument(
+        "--shard",
+        help="Tên shard cần khởi tạo (dùng với --setup-db), lưu vào VECTOR_DB_SHARDS_DIR/<tên shard>"
+    )
+    parser.add_argument(
+        "--data-path",
+        help="File CSV nguồn dùng để khởi tạo vector database (mặc định: data/military_psychology.csv)"
+    )
+    parser.add_argument(
+        "--batch",
+        nargs=2,
+        metavar=("IN_CSV", "OUT_JSONL"),
+        help="Trả lời hàng loạt câu hỏi trong IN_CSV (cột question, id tùy chọn) và ghi kết quả vào OUT_JSONL"
+    )
+    parser.add_argument(
+        "--concurrency",
+        type=int,
+        help="Số lời gọi LLM đồng thời trong chế độ batch"
+    )
+    parser.add_argument(
+        "--rate-limit",
+        type=float,
+        help="Số lời gọi LLM tối đa mỗi phút trong chế độ batch"
+    )
+    parser.add_argument(
+        "--compact-history",
+        action="store_true",
+        help="Nén lịch sử các ngày đã kết thúc thành Parquet và in thống kê"
+    )
+    parser.add_argument(
+        "--embedding-server",
+        action="store_true",
+        help="Chạy embedding server dùng chung (Unix domain socket tại EMBEDDING_SERVER_SOCKET)"
+    )
     parser.add_argument(
         "--run-app",
         action="store_true",
@@ -59,11 +93,14 @@ def main():
     args = parse_args()
     
     # Nếu không có tham số nào được cung cấp, hiển thị trợ giúp
-    if not (args.setup_db or args.run_app):
+    if not (args.setup_db or args.run_app or args.batch or args.embedding_server or args.compact_history):
         logger.info("Không có tham số nào được cung cấp, hiển thị trợ giúp")
-        print("Sử dụng: python main.py [--setup-db] [--run-app]")
+        print("Sử dụng: python main.py [--setup-db] [--run-app] [--batch IN_CSV OUT_JSONL] [--compact-history] [--embedding-server]")
         print("  --setup-db: Khởi tạo vector database")
         print("  --run-app: Khởi động ứng dụng Streamlit")
+        print("  --batch: Trả lời hàng loạt câu hỏi từ file CSV")
+        print("  --compact-history: Nén lịch sử các ngày đã kết thúc thành Parquet")
+        print("  --embedding-server: Chạy embedding server dùng chung cho nhiều worker")
         return
     
     # Khởi tạo vector database
@@ -71,19 +108,83 @@ def main():
         logger.info("Bắt đầu khởi tạo vector database")
         from src.database_setup import setup_database
         
-        success = setup_database()
+        vector_db_path = None
+        if args.shard:
+            from src.config import VECTOR_DB_SHARDS_DIR
+            if not VECTOR_DB_SHARDS_DIR:
+                print("Cần cấu hình VECTOR_DB_SHARDS_DIR để khởi tạo shard")
+                return
+            vector_db_path = os.path.join(VECTOR_DB_SHARDS_DIR, args.shard)
+        
+        success = setup_database(data_path=args.data_path, vector_db_path=vector_db_path)
         
         if success:
             print("Đã khởi tạo vector database thành công!")
         else:
             print("Khởi tạo vector database thất bại. Vui lòng kiểm tra logs để biết thêm chi tiết.")
     
+    # Trả lời hàng loạt câu hỏi
+    if args.batch:
+        logger.info(f"Bắt đầu chế độ batch: {args.batch[0]} -> {args.batch[1]}")
+        from src.batch_runner import run_batch
+        from src.config import BATCH_CONCURRENCY, BATCH_RATE_LIMIT
+        from src.settings import install_reload_signal
+        
+        # Chế độ batch xử lý câu hỏi ngay trong tiến trình này: tải lại cấu hình khi nhận SIGHUP
+        install_reload_signal()
+        
+        try:
+            run_batch(
+                args.batch[0],
+                args.batch[1],
+                concurrency=args.concurrency or BATCH_CONCURRENCY,
+                rate_limit=args.rate_limit if args.rate_limit is not None else BATCH_RATE_LIMIT
+            )
+        except Exception as e:
+            logger.error(f"Lỗi khi chạy chế độ batch: {e}")
+            print(f"Lỗi khi chạy chế độ batch: {e}")
+    
+    # Nén lịch sử hội thoại thành archive Parquet
+    if args.compact_history:
+        logger.info("Bắt đầu nén lịch sử hội thoại")
+        from src.history_archive import compact_history, HistoryArchive
+        
+        try:
+            compacted = compact_history()
+            print(f"Đã nén {len(compacted)} ngày ({sum(compacted.values())} tin nhắn)")
+            
+            sessions = HistoryArchive().sessions_per_day()
+            if sessions:
+                print(f"Tổng số session trong archive: {sum(sessions.values())} ({len(sessions)} ngày)")
+        except Exception as e:
+            logger.error(f"Lỗi khi nén lịch sử: {e}")
+            print(f"Lỗi khi nén lịch sử: {e}")
+    
+    # Chạy embedding server dùng chung (chặn cho tới khi bị dừng)
+    if args.embedding_server:
+        from src.config import EMBEDDING_SERVER_SOCKET
+        from src.embedding_server import run_server
+        
+        if not EMBEDDING_SERVER_SOCKET:
+            print("Cần cấu hình EMBEDDING_SERVER_SOCKET để chạy embedding server")
+            return
+        
+        logger.info("Bắt đầu chạy embedding server")
+        print(f"Embedding server lắng nghe tại {EMBEDDING_SERVER_SOCKET}")
+        try:
+            run_server(EMBEDDING_SERVER_SOCKET)
+        except Exception as e:
+            logger.error(f"Lỗi khi chạy embedding server: {e}")
+            print(f"Lỗi khi chạy embedding server: {e}")
+        return
+    
     # Khởi động ứng dụng Streamlit
     if args.run_app:
         logger.info("Bắt đầu khởi động ứng dụng Streamlit")
         
         try:
-            # Khởi động Streamlit
+            # Khởi động Streamlit (tiến trình con phục vụ câu hỏi, cấu hình runtime được tải lại
+            # theo thay đổi của file RUNTIME_SETTINGS_PATH, không qua SIGHUP)
             print("Đang khởi động ứng dụng Streamlit...")
             os.system("python -m streamlit run src/streamlit_app.py")
         
@@ -0,0 +1,265 @@
+"""
+Module trả lời hàng loạt câu hỏi từ file CSV (chế độ batch/offline)
+"""
+import json
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+
+import pandas as pd
+from loguru import logger
+
+from src.config import BATCH_CONCURRENCY, BATCH_RATE_LIMIT, BATCH_RETRIEVAL_SIZE
+from src.embedding_system import EmbeddingSystem
+from src.llm_system import LLMSystem, ERROR_RESPONSE
+from src.metrics import percentile
+from src.rag_system import NO_CONTEXT_RESPONSE
+from src.settings import get_settings
+
+# Lỗi có thể thành công khi chạy lại (vd: lỗi API LLM); câu hỏi không có ngữ cảnh thì không
+RETRYABLE_ERRORS = {"llm_error"}
+
+
+class RateLimiter:
+    """
+    Giới hạn số lần gọi mỗi phút theo thuật toán token bucket, an toàn khi dùng từ nhiều luồng
+    """
+
+    def __init__(self, per_minute):
+        """
+        Khởi tạo RateLimiter
+
+        Args:
+            per_minute (float): Số lần gọi tối đa mỗi phút (0 = không giới hạn)
+        """
+        self.rate = per_minute / 60.0
+        self.capacity = max(1.0, self.rate)
+        self.tokens = self.capacity
+        self.last = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        """
+        Chờ cho đến khi được phép thực hiện một lần gọi
+        """
+        if self.rate <= 0:
+            return
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.last) * self.rate)
+                self.last = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait_time = (1 - self.tokens) / self.rate
+            time.sleep(wait_time)
+
+
+class BatchRunner:
+    """
+    Trả lời một file CSV câu hỏi: tìm kiếm theo lô, gọi LLM song song có giới hạn tốc độ,
+    ghi kết quả dạng JSONL theo luồng và có thể tiếp tục sau khi bị gián đoạn
+    """
+
+    def __init__(self, concurrency=BATCH_CONCURRENCY, rate_limit=BATCH_RATE_LIMIT,
+                 retrieval_batch_size=BATCH_RETRIEVAL_SIZE, top_k=None):
+        """
+        Khởi tạo BatchRunner
+
+        Args:
+            concurrency (int): Số lời gọi LLM chạy đồng thời
+            rate_limit (float): Số lời gọi LLM tối đa mỗi phút (0 = không giới hạn)
+            retrieval_batch_size (int): Số câu hỏi được encode và tìm kiếm trong một lô
+            top_k (int, optional): Số document ngữ cảnh cho mỗi câu hỏi, mặc định lấy từ cấu hình
+                runtime (top_k) như khi phục vụ
+        """
+        self.concurrency = concurrency
+        self.retrieval_batch_size = retrieval_batch_size
+        self.top_k = top_k
+        self.rate_limiter = RateLimiter(rate_limit)
+        # Chế độ batch tự gom lô câu hỏi nên không cần bộ gom lô dùng chung
+        self.embedding_system = EmbeddingSystem(batching=False)
+        self.llm_system = LLMSystem()
+        self._write_lock = threading.Lock()
+
+        logger.info(f"Khởi tạo BatchRunner (concurrency={concurrency}, rate_limit={rate_limit}/phút)")
+
+    @staticmethod
+    def load_questions(input_path):
+        """
+        Đọc danh sách câu hỏi từ file CSV
+
+        File cần có cột `question`; cột `id` là tùy chọn, nếu không có sẽ dùng số thứ tự dòng.
+
+        Args:
+            input_path (str): Đường dẫn file CSV
+
+        Returns:
+            list: Danh sách dict gồm id và question
+        """
+        df = pd.read_csv(input_path, dtype=str, encoding="utf-8-sig")
+        if "question" not in df.columns:
+            raise ValueError(f"File {input_path} thiếu cột 'question'")
+        if "id" not in df.columns:
+            df["id"] = df.index.astype(str)
+        df = df.dropna(subset=["question"])
+        return df[["id", "question"]].to_dict("records")
+
+    @staticmethod
+    def load_checkpoint(output_path):
+        """
+        Lấy các id đã có kết quả trong file JSONL đầu ra
+
+        Các dòng lỗi có thể thử lại (RETRYABLE_ERRORS) không được tính là hoàn thành nên sẽ được
+        trả lời lại khi chạy tiếp; câu hỏi không có ngữ cảnh (no_context) được tính là hoàn thành.
+        Khi một id xuất hiện nhiều lần, dòng sau cùng là kết quả mới nhất.
+
+        Args:
+            output_path (str): Đường dẫn file JSONL
+
+        Returns:
+            set: Tập id đã hoàn thành
+        """
+        done = set()
+        if not os.path.exists(output_path):
+            return done
+        with open(output_path, encoding="utf-8") as f:
+            for line in f:
+                try:
+                    row = json.loads(line)
+                    if row.get("error") in RETRYABLE_ERRORS:
+                        done.discard(str(row["id"]))
+                    else:
+                        done.add(str(row["id"]))
+                except (ValueError, KeyError):
+                    # Dòng ghi dở khi bị gián đoạn, sẽ được trả lời lại
+                    continue
+        return done
+
+    def run(self, input_path, output_path):
+        """
+        Trả lời toàn bộ câu hỏi trong file CSV và ghi kết quả vào file JSONL
+
+        Args:
+            input_path (str): File CSV câu hỏi
+            output_path (str): File JSONL kết quả (được ghi nối, dùng làm checkpoint)
+
+        Returns:
+            dict: Tổng kết thông lượng
+        """
+        questions = self.load_questions(input_path)
+        done = self.load_checkpoint(output_path)
+        todo = [item for item in questions if str(item["id"]) not in done]
+        logger.info(f"Batch: {len(questions)} câu hỏi, {len(questions) - len(todo)} đã có kết quả, {len(todo)} cần trả lời")
+
+        start = time.perf_counter()
+        latencies = []
+        errors = 0
+        no_context = 0
+
+        with open(output_path, "a", encoding="utf-8") as out, \
+                ThreadPoolExecutor(max_workers=self.concurrency, thread_name_prefix="batch-llm") as executor:
+            pending = set()
+
+            def drain(futures):
+                nonlocal errors, no_context
+                for future in futures:
+                    row = future.result()
+                    latencies.append(row["latency_ms"])
+                    errors += row.get("error") in RETRYABLE_ERRORS
+                    no_context += row.get("error") == "no_context"
+                    with self._write_lock:
+                        out.write(json.dumps(row, ensure_ascii=False) + "\n")
+                        out.flush()
+
+            for offset in range(0, len(todo), self.retrieval_batch_size):
+                chunk = todo[offset:offset + self.retrieval_batch_size]
+                contexts = self.embedding_system.batch_similarity_search(
+                    [item["question"] for item in chunk], k=self.top_k or get_settings().top_k
+                )
+
+                for item, docs in zip(chunk, contexts):
+                    # Giới hạn số tác vụ đang chờ để không giữ toàn bộ ngữ cảnh trong bộ nhớ
+                    while len(pending) >= self.concurrency * 2:
+                        finished, pending = wait(pending, return_when=FIRST_COMPLETED)
+                        drain(finished)
+                    pending.add(executor.submit(self._answer, item, docs))
+
+                logger.info(f"Batch: đã tìm kiếm {min(offset + len(chunk), len(todo))}/{len(todo)} câu hỏi")
+
+            finished, _ = wait(pending)
+            drain(finished)
+
+        elapsed = time.perf_counter() - start
+        latencies.sort()
+        summary = {
+            "total": len(questions),
+            "skipped": len(questions) - len(todo),
+            "answered": len(latencies),
+            "errors": errors,
+            "no_context": no_context,
+            "elapsed_s": round(elapsed, 2),
+            "throughput_qps": round(len(latencies) / elapsed, 3) if elapsed > 0 else 0.0,
+            "latency_p50_ms": percentile(latencies, 50),
+            "latency_p95_ms": percentile(latencies, 95),
+        }
+        logger.info(f"Hoàn thành batch: {summary}")
+        return summary
+
+    def _answer(self, item, docs):
+        """
+        Gọi LLM cho một câu hỏi với ngữ cảnh đã tìm được
+
+        Args:
+            item (dict): Câu hỏi (id, question)
+            docs (list): Danh sách document ngữ cảnh
+
+        Returns:
+            dict: Dòng kết quả
+        """
+        start = time.perf_counter()
+        row = {
+            "id": item["id"],
+            "question": item["question"],
+            "sources": [doc.metadata.get("question") for doc in docs],
+        }
+
+        if not docs:
+            row["answer"] = NO_CONTEXT_RESPONSE
+            row["error"] = "no_context"
+        else:
+            context = "\n\n".join([doc.page_content for doc in docs])
+            self.rate_limiter.acquire()
+            row["answer"] = self.llm_system.generate_response(item["question"], context)
+            if row["answer"] == ERROR_RESPONSE:
+                row["error"] = "llm_error"
+
+        row["latency_ms"] = round((time.perf_counter() - start) * 1000, 1)
+        return row
+
+
+def run_batch(input_path, output_path, concurrency=BATCH_CONCURRENCY, rate_limit=BATCH_RATE_LIMIT):
+    """
+    Chạy chế độ batch và in tổng kết thông lượng
+
+    Args:
+        input_path (str): File CSV câu hỏi
+        output_path (str): File JSONL kết quả
+        concurrency (int): Số lời gọi LLM đồng thời
+        rate_limit (float): Số lời gọi LLM tối đa mỗi phút
+
+    Returns:
+        dict: Tổng kết thông lượng
+    """
+    runner = BatchRunner(concurrency=concurrency, rate_limit=rate_limit)
+    summary = runner.run(input_path, output_path)
+
+    print(f"Đã trả lời {summary['answered']} câu hỏi "
+          f"(bỏ qua {summary['skipped']} đã có, lỗi {summary['errors']}, "
+          f"không có ngữ cảnh {summary['no_context']}) "
+          f"trong {summary['elapsed_s']}s")
+    print(f"Thông lượng: {summary['throughput_qps']} câu/giây, "
+          f"độ trễ p50={summary['latency_p50_ms']}ms, p95={summary['latency_p95_ms']}ms")
+    return summary
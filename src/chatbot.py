@@ -1,24 +1,38 @@
 """
 Module quản lý chatbot
 """
+import time
+
 from loguru import logger
 
+from src.logger import hot_logger, redact_query
 from src.rag_system import RAGSystem
 from src.history_manager import HistoryManager
+from src.stream_buffer import ResponseBuffer
 
+# Câu trả lời khi xử lý tin nhắn bị lỗi
+MESSAGE_ERROR_RESPONSE = "Xin lỗi, đã xảy ra lỗi khi xử lý tin nhắn của bạn. Vui lòng thử lại sau."
 
 class Chatbot:
     """
     Chatbot tư vấn tâm lý cho quân nhân
     """
     
-    def __init__(self):
+    def __init__(self, history_folder=None, llm_system=None):
         """
         Khởi tạo Chatbot
+        
+        Args:
+            history_folder (str, optional): Thư mục lưu lịch sử hội thoại
+            llm_system (LLMSystem, optional): Hệ thống LLM thay thế (vd: LLM giả lập khi đo tải)
         """
-        self.rag_system = RAGSystem()
+        self.rag_system = RAGSystem(llm_system=llm_system)
         self.conversation_history = []
-        self.history_manager = HistoryManager()
+        self.history_manager = HistoryManager(history_folder)
+        self.ready = False
+        
+        # Memory hội thoại được lưu theo session_id để có thể tiếp tục trên worker khác
+        self.rag_system.memory_system.bind_session(self.history_manager.session_id)
         
         logger.info("Khởi tạo Chatbot")
     
@@ -27,15 +41,71 @@ class Chatbot:
         Thiết lập chatbot
         """
         logger.info("Thiết lập Chatbot")
-        return self.rag_system.setup()
+        self.ready = self.rag_system.setup()
+        return self.ready
+    
+    def close(self):
+        """
+        Giải phóng tài nguyên của chatbot khi phiên bị thu hồi
+        
+        Lịch sử đang chờ được ghi xuống file, memory hội thoại vẫn còn trong store
+        để có thể tiếp tục session sau này.
+        """
+        self.history_manager.flush()
+        self.rag_system.close()
+        self.conversation_history = []
+        logger.info(f"Đã giải phóng Chatbot của session {self.history_manager.session_id}")
+    
+    def new_session(self):
+        """
+        Bắt đầu cuộc trò chuyện mới: tạo session mới và xóa ngữ cảnh hội thoại hiện tại
+        
+        Returns:
+            str: ID của session mới
+        """
+        session_id = self.history_manager.create_new_session()
+        self.rag_system.memory_system.bind_session(session_id)
+        self.rag_system.reset_context()
+        self.conversation_history = []
+        return session_id
+    
+    def resume_session(self, session_id):
+        """
+        Tiếp tục một session đã có, memory hội thoại được tải lại từ store
+        
+        Args:
+            session_id (str): ID của session cần tiếp tục
+        
+        Returns:
+            str: ID của session
+        """
+        self.history_manager.resume_session(session_id)
+        self.rag_system.memory_system.bind_session(session_id)
+        self.rag_system.reset_context()
+        self.conversation_history = [
+            {"role": message["role"], "content": message["content"]}
+            for message in self.rag_system.memory_system.store.get(session_id)
+        ]
+        return session_id
+    
+    def prefetch(self, draft_message):
+        """
+        Bắt đầu tìm kiếm suy đoán cho tin nhắn đang soạn, kết quả được dùng lại nếu
+        tin nhắn gửi đi khớp với bản nháp
+        
+        Args:
+            draft_message (str): Bản nháp tin nhắn
+        """
+        self.rag_system.prefetch(draft_message)
     
-    def add_message(self, role, content):
+    def add_message(self, role, content, sources=None):
         """
         Thêm tin nhắn vào lịch sử hội thoại và lưu vào file CSV
         
         Args:
             role (str): Vai trò (user hoặc assistant)
             content (str): Nội dung tin nhắn
+            sources (list, optional): Câu hỏi của các document đã dùng làm ngữ cảnh
         """
         # Thêm vào conversation_history cho UI
         self.conversation_history.append({
@@ -44,7 +114,7 @@ class Chatbot:
         })
         
         # Lưu vào file CSV thông qua history_manager
-        self.history_manager.save_message(role, content)
+        self.history_manager.save_message(role, content, sources)
     
     def get_conversation_history(self):
         """
@@ -70,52 +140,58 @@ class Chatbot:
             self.add_message("user", message)
             
             # Xử lý câu hỏi
-            logger.info(f"Xử lý tin nhắn từ người dùng: {message}")
+            hot_logger.info(f"Xử lý tin nhắn từ người dùng: {redact_query(message)}")
             response = self.rag_system.process_query(message)
             
             # Thêm câu trả lời vào lịch sử conversation_history (cho UI)
-            self.add_message("assistant", response)
+            self.add_message("assistant", response, self.rag_system.last_sources)
             
-            logger.info("Đã xử lý tin nhắn thành công")
+            hot_logger.info("Đã xử lý tin nhắn thành công")
             return response
         except Exception as e:
             logger.error(f"Lỗi khi xử lý tin nhắn: {e}")
-            error_message = "Xin lỗi, đã xảy ra lỗi khi xử lý tin nhắn của bạn. Vui lòng thử lại sau."
+            error_message = MESSAGE_ERROR_RESPONSE
             self.add_message("assistant", error_message)
             return error_message
             
-    def process_message_stream(self, message):
+    def process_message_stream(self, message, buffer=None):
         """
         Xử lý tin nhắn từ người dùng và trả về kết quả theo kiểu streaming
         
         Args:
             message (str): Tin nhắn từ người dùng
+            buffer (ResponseBuffer, optional): Bộ đệm dùng chung với giao diện; câu trả lời
+                đầy đủ được đọc từ đây thay vì nối chuỗi sau mỗi phần
         
         Returns:
             generator: Generator trả về từng phần của câu trả lời
         """
+        # Thời điểm gửi tin nhắn, dùng để đo thời gian tới phần trả lời đầu tiên
+        submitted = time.perf_counter()
         try:
             # Thêm tin nhắn vào lịch sử conversation_history (cho UI)
             self.add_message("user", message)
             
             # Xử lý câu hỏi streaming
-            logger.info(f"Xử lý tin nhắn streaming từ người dùng: {message}")
+            hot_logger.info(f"Xử lý tin nhắn streaming từ người dùng: {redact_query(message)}")
             
-            # Tạo biến để lưu toàn bộ câu trả lời
-            full_response = ""
+            # Bộ đệm chứa toàn bộ câu trả lời, được RAGSystem thêm từng phần
+            if buffer is None:
+                buffer = ResponseBuffer()
             
             # Trả về từng phần của câu trả lời
             # Lưu ý: memory đã được cập nhật trong RAGSystem
-            for chunk in self.rag_system.process_query_stream(message):
-                full_response += chunk
-                yield chunk
+            yield from self.rag_system.process_query_stream(message, buffer, submitted)
             
             # Thêm câu trả lời đầy đủ vào lịch sử conversation_history (cho UI)
-            self.add_message("assistant", full_response)
+            self.add_message("assistant", buffer.text(), self.rag_system.last_sources)
             
-            logger.info("Đã xử lý tin nhắn streaming thành công")
+            hot_logger.info("Đã xử lý tin nhắn streaming thành công")
         except Exception as e:
             logger.error(f"Lỗi khi xử lý tin nhắn streaming: {e}")
-            error_message = "Xin lỗi, đã xảy ra lỗi khi xử lý tin nhắn của bạn. Vui lòng thử lại sau."
+            error_message = MESSAGE_ERROR_RESPONSE
             self.add_message("assistant", error_message)
+            if buffer is not None:
+                buffer.reset()
+                buffer.append(error_message)
             yield error_message
@@ -17,28 +17,163 @@ GROQ_API_KEY = os.getenv("GROQ_API_KEY", "")
 
 # Cấu hình mô hình
 LLM_MODEL = os.getenv("LLM_MODEL", "llama-3.3-70b-versatile")
+LLM_TEMPERATURE = float(os.getenv("LLM_TEMPERATURE", "0.7"))
+LLM_MAX_TOKENS = int(os.getenv("LLM_MAX_TOKENS", "1024"))
 EMBEDDING_MODEL = os.getenv("EMBEDDING_MODEL", "Alibaba-NLP/gte-multilingual-base")
 
 # Cấu hình vector database
 VECTOR_DB_PATH = os.getenv("VECTOR_DB_PATH", str(ROOT_DIR / "vector_db"))
+# Mỗi lần --setup-db tạo một phiên bản mới, con trỏ CURRENT trỏ tới phiên bản đang dùng
+VECTOR_DB_RELOAD_INTERVAL = float(os.getenv("VECTOR_DB_RELOAD_INTERVAL", "10"))
+VECTOR_DB_KEEP_VERSIONS = int(os.getenv("VECTOR_DB_KEEP_VERSIONS", "3"))
+
+# Cấu hình vector database phân mảnh (shard)
+# Mỗi thư mục con trong VECTOR_DB_SHARDS_DIR là một shard (vd: combat_stress, family, discipline)
+VECTOR_DB_SHARDS_DIR = os.getenv("VECTOR_DB_SHARDS_DIR", "")
+SHARD_SEARCH_WORKERS = int(os.getenv("SHARD_SEARCH_WORKERS", "4"))
+SHARD_RESCAN_INTERVAL = float(os.getenv("SHARD_RESCAN_INTERVAL", "30"))
+
+# Cấu hình embedding server dùng chung cho nhiều worker (Unix domain socket)
+# Để trống để mỗi tiến trình tự tải mô hình embedding và vector store
+EMBEDDING_SERVER_SOCKET = os.getenv("EMBEDDING_SERVER_SOCKET", "")
+EMBEDDING_SERVER_TIMEOUT = float(os.getenv("EMBEDDING_SERVER_TIMEOUT", "30"))
+# Số kết nối tối đa mỗi tiến trình mở tới embedding server (dùng chung cho mọi phiên / luồng)
+EMBEDDING_CLIENT_POOL_SIZE = int(os.getenv("EMBEDDING_CLIENT_POOL_SIZE", "4"))
+# Gom các câu hỏi tới trong EMBEDDING_BATCH_WINDOW_MS để encode và tìm kiếm một lần
+# EMBEDDING_BATCHING: các phiên trong cùng tiến trình dùng chung một mô hình và bộ gom lô
+EMBEDDING_BATCHING = os.getenv("EMBEDDING_BATCHING", "true").lower() == "true"
+EMBEDDING_BATCH_WINDOW_MS = float(os.getenv("EMBEDDING_BATCH_WINDOW_MS", "5"))
+EMBEDDING_BATCH_MAX_SIZE = int(os.getenv("EMBEDDING_BATCH_MAX_SIZE", "32"))
+# Số luồng torch / OpenMP khi encode: EMBEDDING_WORKERS là số tiến trình cùng chạy mô hình trên máy
+# (vd: số replica Streamlit), EMBEDDING_NUM_THREADS=0 để chia đều số CPU khả dụng cho các worker
+EMBEDDING_WORKERS = int(os.getenv("EMBEDDING_WORKERS", "1"))
+EMBEDDING_NUM_THREADS = int(os.getenv("EMBEDDING_NUM_THREADS", "0"))
+EMBEDDING_INTEROP_THREADS = int(os.getenv("EMBEDDING_INTEROP_THREADS", "1"))
+# Chạy thử một lô câu mẫu ngay sau khi tải mô hình để câu hỏi đầu tiên không chịu độ trễ khởi động
+EMBEDDING_WARMUP = os.getenv("EMBEDDING_WARMUP", "true").lower() == "true"
+EMBEDDING_WARMUP_BATCH = int(os.getenv("EMBEDDING_WARMUP_BATCH", "8"))
+EMBEDDING_WARMUP_ROUNDS = int(os.getenv("EMBEDDING_WARMUP_ROUNDS", "2"))
 
 # Cấu hình dữ liệu
 DATA_PATH = str(ROOT_DIR / "data" / "military_psychology.csv")
+# Bộ dữ liệu đã kiểm tra và chuẩn hóa được lưu dạng Parquet, vô hiệu khi file nguồn thay đổi
+DATA_CACHE = os.getenv("DATA_CACHE", "true").lower() == "true"
+DATA_CACHE_DIR = os.getenv("DATA_CACHE_DIR", str(ROOT_DIR / "data" / ".cache"))
 
 # Cấu hình logging
 LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO")
 LOG_FOLDER = os.getenv("LOG_FOLDER", str(ROOT_DIR / "logs"))
 LOG_FILENAME = f"{datetime.now().strftime('%Y-%m-%d')}.log"
 LOG_PATH = str(Path(LOG_FOLDER) / LOG_FILENAME)
+# Ghi log bất đồng bộ qua hàng đợi và xuất JSON có cấu trúc
+LOG_ASYNC = os.getenv("LOG_ASYNC", "true").lower() == "true"
+LOG_JSON = os.getenv("LOG_JSON", "false").lower() == "true"
+# Mức log theo module, vd: "src.embedding_system=WARNING,src.history_writer=DEBUG"
+LOG_MODULE_LEVELS = os.getenv("LOG_MODULE_LEVELS", "")
+# Lấy mẫu và giới hạn tần suất (bản ghi/giây cho mỗi vị trí gọi) log trên hot path
+LOG_HOT_SAMPLE_RATE = float(os.getenv("LOG_HOT_SAMPLE_RATE", "1.0"))
+LOG_HOT_RATE_LIMIT = float(os.getenv("LOG_HOT_RATE_LIMIT", "20"))
+# Cách ghi nội dung câu hỏi vào log: hash, truncate hoặc full
+LOG_QUERY_MODE = os.getenv("LOG_QUERY_MODE", "hash")
+LOG_QUERY_MAX_CHARS = int(os.getenv("LOG_QUERY_MAX_CHARS", "32"))
 
 # Cấu hình RAG
-CHUNK_SIZE = 1000
-CHUNK_OVERLAP = 200
-TOP_K = 3
+CHUNK_SIZE = int(os.getenv("CHUNK_SIZE", "1000"))
+CHUNK_OVERLAP = int(os.getenv("CHUNK_OVERLAP", "200"))
+TOP_K = int(os.getenv("TOP_K", "3"))
+# Số lượt hội thoại gần nhất (câu hỏi và câu trả lời) đưa vào prompt
+MEMORY_WINDOW_K = int(os.getenv("MEMORY_WINDOW_K", "5"))
+# Tạo thêm index theo đoạn (chunk) của câu trả lời khi chạy --setup-db
+CHUNK_INDEX = os.getenv("CHUNK_INDEX", "true").lower() == "true"
+# Đơn vị tìm kiếm: document (cả cặp hỏi-đáp), chunk (trả về đoạn khớp) hoặc parent (tìm theo đoạn, trả về cặp hỏi-đáp chứa đoạn)
+RETRIEVAL_GRANULARITY = os.getenv("RETRIEVAL_GRANULARITY", "document")
+# Chạy tìm kiếm song song với việc tải lịch sử hội thoại
+RETRIEVAL_PIPELINING = os.getenv("RETRIEVAL_PIPELINING", "true").lower() == "true"
+RETRIEVAL_WORKERS = int(os.getenv("RETRIEVAL_WORKERS", "4"))
+# Tìm kiếm suy đoán (prefetch) chạy trên thread pool riêng: tìm kiếm chính có thể chờ kết quả prefetch
+PREFETCH_WORKERS = int(os.getenv("PREFETCH_WORKERS", "2"))
+# Viết lại câu hỏi nối tiếp bằng cách trộn vector với các câu hỏi trước (không gọi LLM)
+QUERY_REWRITE = os.getenv("QUERY_REWRITE", "true").lower() == "true"
+QUERY_REWRITE_ALPHA = float(os.getenv("QUERY_REWRITE_ALPHA", "0.6"))
+QUERY_REWRITE_HISTORY_TURNS = int(os.getenv("QUERY_REWRITE_HISTORY_TURNS", "3"))
+QUERY_REWRITE_MAX_WORDS = int(os.getenv("QUERY_REWRITE_MAX_WORDS", "8"))
+# Trả lời trực tiếp bằng câu trả lời mẫu khi câu hỏi gần như trùng với câu hỏi trong dữ liệu
+FAQ_FAST_PATH = os.getenv("FAQ_FAST_PATH", "true").lower() == "true"
+FAQ_MATCH_THRESHOLD = float(os.getenv("FAQ_MATCH_THRESHOLD", "0.92"))
+# Phát hiện tin nhắn khủng hoảng (tự hại, tự sát) trước khi tìm kiếm: so khớp từ điển không dấu
+# và độ tương đồng embedding với các câu mẫu; trả ngay hướng dẫn liên hệ hỗ trợ khẩn cấp
+CRISIS_DETECTION = os.getenv("CRISIS_DETECTION", "true").lower() == "true"
+CRISIS_SEMANTIC = os.getenv("CRISIS_SEMANTIC", "true").lower() == "true"
+CRISIS_SIMILARITY_THRESHOLD = float(os.getenv("CRISIS_SIMILARITY_THRESHOLD", "0.8"))
+CRISIS_HOTLINE = os.getenv("CRISIS_HOTLINE", "115")
+# File bổ sung cụm từ cho từ điển (mỗi dòng một cụm từ)
+CRISIS_LEXICON_PATH = os.getenv("CRISIS_LEXICON_PATH", "")
+# Chọn số document theo khoảng cách điểm và chỉ giữ các câu liên quan nhất trong ngữ cảnh
+CONTEXT_COMPRESSION = os.getenv("CONTEXT_COMPRESSION", "true").lower() == "true"
+CONTEXT_MIN_K = int(os.getenv("CONTEXT_MIN_K", "1"))
+CONTEXT_SCORE_GAP = float(os.getenv("CONTEXT_SCORE_GAP", "0.1"))
+CONTEXT_MAX_SENTENCES = int(os.getenv("CONTEXT_MAX_SENTENCES", "4"))
+CONTEXT_MIN_SENTENCE_SCORE = float(os.getenv("CONTEXT_MIN_SENTENCE_SCORE", "0.3"))
+
+# Cấu hình chế độ batch (trả lời hàng loạt câu hỏi từ file CSV)
+BATCH_CONCURRENCY = int(os.getenv("BATCH_CONCURRENCY", "4"))
+BATCH_RATE_LIMIT = float(os.getenv("BATCH_RATE_LIMIT", "30"))  # Số lời gọi LLM mỗi phút
+BATCH_RETRIEVAL_SIZE = int(os.getenv("BATCH_RETRIEVAL_SIZE", "32"))
 
 # Cấu hình Streamlit
 STREAMLIT_TITLE = "Chatbot Tư Vấn Tâm Lý Quân Nhân"
 STREAMLIT_DESCRIPTION = "Hệ thống hỗ trợ tư vấn tâm lý cho quân nhân dựa trên công nghệ AI"
+# Chỉ vẽ lại câu trả lời streaming sau mỗi STREAM_RENDER_INTERVAL_MS hoặc khi có đủ STREAM_RENDER_CHARS ký tự mới
+STREAM_RENDER_INTERVAL_MS = float(os.getenv("STREAM_RENDER_INTERVAL_MS", "100"))
+STREAM_RENDER_CHARS = int(os.getenv("STREAM_RENDER_CHARS", "400"))
+# Gửi ngay một câu mở đầu trước khi tìm kiếm, LLM viết tiếp từ câu này (câu trả lời không do LLM viết thay thế câu mở đầu)
+STREAM_PREAMBLE = os.getenv("STREAM_PREAMBLE", "false").lower() == "true"
+STREAM_PREAMBLE_TEXT = os.getenv("STREAM_PREAMBLE_TEXT", "Cảm ơn bạn đã chia sẻ. ")
+
+# Cấu hình quản lý phiên: thu hồi phiên rảnh sau SESSION_IDLE_TTL giây, tối đa SESSION_MAX_ACTIVE phiên
+SESSION_IDLE_TTL = float(os.getenv("SESSION_IDLE_TTL", "1800"))
+SESSION_MAX_ACTIVE = int(os.getenv("SESSION_MAX_ACTIVE", "200"))
+SESSION_REAP_INTERVAL = float(os.getenv("SESSION_REAP_INTERVAL", "60"))
+
+# Cấu hình bộ nhớ hội thoại (memory, sqlite, redis hoặc fakeredis)
+MEMORY_BACKEND = os.getenv("MEMORY_BACKEND", "memory")
+MEMORY_SQLITE_PATH = os.getenv("MEMORY_SQLITE_PATH", str(ROOT_DIR / "history" / "memory.sqlite3"))
+MEMORY_REDIS_URL = os.getenv("MEMORY_REDIS_URL", "redis://localhost:6379/0")
+MEMORY_TTL_SECONDS = int(os.getenv("MEMORY_TTL_SECONDS", str(24 * 3600)))
+MEMORY_LRU_SIZE = int(os.getenv("MEMORY_LRU_SIZE", "256"))
+MEMORY_MAX_MESSAGES = int(os.getenv("MEMORY_MAX_MESSAGES", "100"))
 
 # Cấu hình lịch sử hội thoại
-HISTORY_FOLDER = str(ROOT_DIR / "history")
\ No newline at end of file
+HISTORY_FOLDER = str(ROOT_DIR / "history")
+# Ghi lịch sử ở luồng nền (write-behind) thay vì ghi đồng bộ trên luồng trả lời
+HISTORY_WRITE_BEHIND = os.getenv("HISTORY_WRITE_BEHIND", "true").lower() == "true"
+HISTORY_QUEUE_SIZE = int(os.getenv("HISTORY_QUEUE_SIZE", "1000"))
+HISTORY_BATCH_SIZE = int(os.getenv("HISTORY_BATCH_SIZE", "100"))
+HISTORY_FLUSH_INTERVAL = float(os.getenv("HISTORY_FLUSH_INTERVAL", "0.5"))
+# Hàng đợi đầy quá HISTORY_ENQUEUE_TIMEOUT giây thì người gọi tự ghi tin nhắn (metrics history_writer.sync_writes)
+HISTORY_ENQUEUE_TIMEOUT = float(os.getenv("HISTORY_ENQUEUE_TIMEOUT", "1.0"))
+# Số lần ghi lại một file lịch sử khi ghi lỗi (metrics history_writer.failed_rows nếu vẫn lỗi)
+HISTORY_WRITE_RETRIES = int(os.getenv("HISTORY_WRITE_RETRIES", "2"))
+# Lưu mỗi nội dung tin nhắn (từ HISTORY_DEDUP_MIN_CHARS ký tự) một lần, nén zstd; file CSV chỉ giữ mã nội dung
+HISTORY_DEDUP = os.getenv("HISTORY_DEDUP", "true").lower() == "true"
+HISTORY_DEDUP_MIN_CHARS = int(os.getenv("HISTORY_DEDUP_MIN_CHARS", "200"))
+HISTORY_BODY_ZSTD_LEVEL = int(os.getenv("HISTORY_BODY_ZSTD_LEVEL", "3"))
+
+# Archive Parquet (phân vùng theo ngày) của các ngày đã kết thúc, dùng cho thống kê
+HISTORY_ARCHIVE_FOLDER = os.getenv("HISTORY_ARCHIVE_FOLDER", str(Path(HISTORY_FOLDER) / "archive"))
+HISTORY_ARCHIVE_DELETE_CSV = os.getenv("HISTORY_ARCHIVE_DELETE_CSV", "false").lower() == "true"
+
+# Cấu hình runtime (src/settings.py): file JSON ghi đè các tham số có thể tinh chỉnh khi đang chạy
+# (top_k, memory_k, llm_temperature, llm_max_tokens, faq_match_threshold, ...), được tải lại khi file
+# thay đổi hoặc khi tiến trình nhận SIGHUP
+RUNTIME_SETTINGS_PATH = os.getenv("RUNTIME_SETTINGS_PATH", str(ROOT_DIR / "runtime_settings.json"))
+RUNTIME_SETTINGS_CHECK_INTERVAL = float(os.getenv("RUNTIME_SETTINGS_CHECK_INTERVAL", "5"))
+
+# Đánh giá tìm kiếm (src/retrieval_eval.py): baseline của lần đo trước và ngưỡng suy giảm cho phép
+# (chất lượng: giảm tuyệt đối của recall/MRR/nDCG; độ trễ p95 và bộ nhớ index: tỉ lệ tăng)
+RETRIEVAL_EVAL_BASELINE_PATH = os.getenv("RETRIEVAL_EVAL_BASELINE_PATH", str(ROOT_DIR / "data" / "retrieval_baseline.json"))
+RETRIEVAL_EVAL_HOLDOUT = float(os.getenv("RETRIEVAL_EVAL_HOLDOUT", "0.2"))
+RETRIEVAL_EVAL_MIN_RECALL = float(os.getenv("RETRIEVAL_EVAL_MIN_RECALL", "0"))
+RETRIEVAL_EVAL_MAX_QUALITY_DROP = float(os.getenv("RETRIEVAL_EVAL_MAX_QUALITY_DROP", "0.02"))
+RETRIEVAL_EVAL_MAX_LATENCY_INCREASE = float(os.getenv("RETRIEVAL_EVAL_MAX_LATENCY_INCREASE", "0.25"))
+RETRIEVAL_EVAL_MAX_MEMORY_INCREASE = float(os.getenv("RETRIEVAL_EVAL_MAX_MEMORY_INCREASE", "0.1"))
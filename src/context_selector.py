@@ -0,0 +1,323 @@
+"""
+Module chọn ngữ cảnh thích ứng: chọn số document theo khoảng cách điểm và chỉ giữ các câu
+liên quan nhất trong mỗi câu trả lời (dựa trên embedding câu tính sẵn khi tạo index)
+"""
+import json
+import os
+import re
+
+import numpy as np
+from loguru import logger
+
+from src.config import (
+    TOP_K, CONTEXT_MIN_K, CONTEXT_SCORE_GAP, CONTEXT_MAX_SENTENCES, CONTEXT_MIN_SENTENCE_SCORE
+)
+from src.metrics import metrics
+
+SENTENCE_VECTORS_FILE = "sentences.npy"
+SENTENCE_META_FILE = "sentences.json"
+
+_SENTENCE_SPLIT = re.compile(r"(?<=[.!?…])\s+")
+
+
+def split_sentences(text):
+    """
+    Tách đoạn văn thành các câu
+
+    Args:
+        text (str): Đoạn văn
+
+    Returns:
+        list: Danh sách câu (đã bỏ khoảng trắng thừa, bỏ câu rỗng)
+    """
+    return [sentence.strip() for sentence in _SENTENCE_SPLIT.split(text or "") if sentence.strip()]
+
+
+def estimate_tokens(text):
+    """
+    Ước lượng số token của văn bản tiếng Việt (khoảng 3 ký tự mỗi token với tokenizer của Llama)
+
+    Args:
+        text (str): Văn bản
+
+    Returns:
+        int: Số token ước lượng
+    """
+    return (len(text) + 2) // 3
+
+
+class SentenceStore:
+    """
+    Lưu embedding của từng câu trong câu trả lời, gắn với row_id của document cha
+    """
+
+    def __init__(self, vectors, texts, row_ids, questions):
+        """
+        Khởi tạo SentenceStore
+
+        Args:
+            vectors (np.ndarray): Ma trận embedding câu (đã chuẩn hóa), mỗi dòng một câu
+            texts (list): Nội dung từng câu
+            row_ids (list): row_id của document chứa từng câu
+            questions (dict): Câu hỏi của document theo row_id, dùng để kiểm tra document
+                tìm được thuộc cùng phiên bản index với store
+        """
+        self.vectors = np.asarray(vectors, dtype=np.float32)
+        self.texts = texts
+        self.row_ids = row_ids
+        self.questions = questions
+
+        # Các câu của cùng một document nằm liên tiếp nhau
+        self.offsets = {}
+        for i, row_id in enumerate(row_ids):
+            start, _ = self.offsets.get(row_id, (i, i))
+            self.offsets[row_id] = (start, i + 1)
+
+    @classmethod
+    def build(cls, documents, embeddings):
+        """
+        Tách câu trả lời của các document thành câu và encode toàn bộ câu
+
+        Args:
+            documents (list): Danh sách document (content, metadata có row_id và answer)
+            embeddings: Đối tượng embedding
+
+        Returns:
+            SentenceStore: Store đã tạo
+        """
+        texts = []
+        row_ids = []
+        questions = {}
+        for doc in documents:
+            metadata = doc["metadata"]
+            questions[metadata["row_id"]] = metadata.get("question", "")
+            for sentence in split_sentences(metadata.get("answer", "")):
+                texts.append(sentence)
+                row_ids.append(metadata["row_id"])
+
+        vectors = np.asarray(embeddings.embed_documents(texts), dtype=np.float32) if texts else np.zeros((0, 0))
+        logger.info(f"Đã tạo embedding cho {len(texts)} câu từ {len(documents)} documents")
+        return cls(vectors, texts, row_ids, questions)
+
+    def save(self, path):
+        """
+        Lưu store vào thư mục (cùng thư mục với index.faiss)
+
+        Args:
+            path (str): Thư mục đích
+        """
+        np.save(os.path.join(path, SENTENCE_VECTORS_FILE), self.vectors)
+        with open(os.path.join(path, SENTENCE_META_FILE), "w", encoding="utf-8") as f:
+            json.dump({
+                "texts": self.texts,
+                "row_ids": self.row_ids,
+                "questions": [[row_id, question] for row_id, question in self.questions.items()],
+            }, f, ensure_ascii=False)
+
+    @classmethod
+    def load(cls, path):
+        """
+        Tải store từ thư mục
+
+        Args:
+            path (str): Thư mục chứa store
+
+        Returns:
+            SentenceStore: Store đã tải, None nếu index được tạo trước khi có tính năng này
+        """
+        vectors_path = os.path.join(path, SENTENCE_VECTORS_FILE)
+        meta_path = os.path.join(path, SENTENCE_META_FILE)
+        if not (os.path.exists(vectors_path) and os.path.exists(meta_path)):
+            return None
+
+        with open(meta_path, encoding="utf-8") as f:
+            meta = json.load(f)
+        questions = {row_id: question for row_id, question in meta["questions"]}
+        return cls(np.load(vectors_path), meta["texts"], meta["row_ids"], questions)
+
+    def sentence_scores(self, metadata, query_vector):
+        """
+        Tính độ tương đồng cosine giữa câu hỏi và từng câu của một document
+
+        Args:
+            metadata (dict): Metadata của document (row_id, question)
+            query_vector (np.ndarray): Vector câu hỏi (đã chuẩn hóa)
+
+        Returns:
+            tuple: (chỉ số bắt đầu, mảng điểm), None nếu document không có trong store
+        """
+        if "chunk_id" in metadata:
+            # Đoạn trích từ index theo đoạn đã đủ ngắn, không cần nén thêm
+            return None
+        row_id = metadata.get("row_id")
+        span = self.offsets.get(row_id)
+        # Document thuộc phiên bản index khác (vd: đang tải lại vector store)
+        if span is None or self.questions.get(row_id) != metadata.get("question"):
+            return None
+        start, end = span
+        return start, self.vectors[start:end] @ query_vector
+
+
+class ContextSelector:
+    """
+    Chọn ngữ cảnh gửi tới LLM: số document thích ứng theo khoảng cách điểm và nén mỗi
+    câu trả lời còn các câu liên quan nhất
+    """
+
+    def __init__(self, min_k=CONTEXT_MIN_K, max_k=TOP_K, score_gap=CONTEXT_SCORE_GAP,
+                 max_sentences=CONTEXT_MAX_SENTENCES, min_sentence_score=CONTEXT_MIN_SENTENCE_SCORE):
+        """
+        Khởi tạo ContextSelector
+
+        Args:
+            min_k (int): Số document tối thiểu luôn được giữ
+            max_k (int): Số document tối đa
+            score_gap (float): Bỏ document có điểm thấp hơn điểm cao nhất quá khoảng này
+            max_sentences (int): Số câu tối đa giữ lại trong mỗi câu trả lời
+            min_sentence_score (float): Điểm tối thiểu để giữ một câu (ngoài câu tốt nhất)
+        """
+        self.min_k = min_k
+        self.max_k = max_k
+        self.score_gap = score_gap
+        self.max_sentences = max_sentences
+        self.min_sentence_score = min_sentence_score
+
+    def build_context(self, docs, query_vector, sentence_store):
+        """
+        Tạo ngữ cảnh đã chọn lọc từ các document tìm được
+
+        Args:
+            docs (list): Danh sách document theo thứ tự độ liên quan
+            query_vector (list): Vector dùng để tìm kiếm
+            sentence_store (SentenceStore): Embedding câu tính sẵn, None nếu không có
+
+        Returns:
+            str: Ngữ cảnh để đưa vào prompt
+        """
+        return self.select_context(docs, query_vector, sentence_store)[0]
+
+    def select_context(self, docs, query_vector, sentence_store):
+        """
+        Tạo ngữ cảnh đã chọn lọc và trả kèm các document thực sự có trong ngữ cảnh
+
+        Args:
+            docs (list): Danh sách document theo thứ tự độ liên quan
+            query_vector (list): Vector dùng để tìm kiếm
+            sentence_store (SentenceStore): Embedding câu tính sẵn, None nếu không có
+
+        Returns:
+            tuple: (ngữ cảnh, danh sách document đã đưa vào ngữ cảnh)
+        """
+        full_context = "\n\n".join([doc.page_content for doc in docs])
+        if sentence_store is None or query_vector is None or not docs:
+            return full_context, list(docs)
+
+        query_vector = np.asarray(query_vector, dtype=np.float32)
+        norm = np.linalg.norm(query_vector)
+        if norm == 0:
+            return full_context, list(docs)
+        query_vector = query_vector / norm
+
+        scored = []
+        for doc in docs[:self.max_k]:
+            result = sentence_store.sentence_scores(doc.metadata, query_vector)
+            if result is None or len(result[1]) == 0:
+                # Document không có embedding câu: luôn giữ nguyên
+                scored.append((doc, None, None, None))
+            else:
+                start, scores = result
+                scored.append((doc, start, scores, float(scores.max())))
+
+        # Chọn số document theo khoảng cách điểm so với document tốt nhất
+        best = max([score for *_, score in scored if score is not None], default=0.0)
+        selected = [
+            item for i, item in enumerate(scored)
+            if i < self.min_k or item[3] is None or item[3] >= best - self.score_gap
+        ]
+
+        blocks = []
+        for doc, start, scores, _ in selected:
+            if scores is None:
+                blocks.append(doc.page_content)
+                continue
+
+            ranked = np.argsort(-scores)[:self.max_sentences]
+            keep = sorted(
+                int(i) for rank, i in enumerate(ranked)
+                if rank == 0 or scores[i] >= self.min_sentence_score
+            )
+            answer = " ".join(sentence_store.texts[start + i] for i in keep)
+            blocks.append(f"Câu hỏi: {doc.metadata.get('question', '')}\nCâu trả lời: {answer}")
+
+        context = "\n\n".join(blocks)
+
+        full_tokens = estimate_tokens(full_context)
+        selected_tokens = estimate_tokens(context)
+        metrics.increment("context.tokens_full", full_tokens)
+        metrics.increment("context.tokens_selected", selected_tokens)
+        metrics.observe("context.docs_selected", len(selected))
+        if full_tokens:
+            metrics.observe("context.token_ratio", selected_tokens / full_tokens)
+
+        return context, [doc for doc, *_ in selected]
+
+
+def benchmark_context_selection(embedding_system, questions, selector=None):
+    """
+    So sánh ngữ cảnh đầy đủ (TOP_K document) với ngữ cảnh đã chọn lọc trên bộ câu hỏi
+
+    Chất lượng được đo gián tiếp: tỉ lệ câu hỏi mà document đúng vẫn còn trong ngữ cảnh
+    sau khi chọn lọc, so với khi dùng đầy đủ TOP_K document.
+
+    Args:
+        embedding_system (EmbeddingSystem): Hệ thống embedding đã tải vector store và sentence store
+        questions (list): Danh sách câu hỏi trong bộ dữ liệu
+        selector (ContextSelector, optional): Bộ chọn ngữ cảnh
+
+    Returns:
+        dict: Số token trung bình, tỉ lệ tiết kiệm và tỉ lệ giữ được document đúng
+    """
+    selector = selector or ContextSelector()
+    full_tokens = 0
+    selected_tokens = 0
+    full_hits = 0
+    selected_hits = 0
+
+    for question in questions:
+        query_vector = embedding_system.embed_query(question)
+        docs = embedding_system.similarity_search_by_vector(query_vector, k=selector.max_k)
+        full_context = "\n\n".join([doc.page_content for doc in docs])
+        context = selector.build_context(docs, query_vector, embedding_system.get_sentence_store())
+
+        full_tokens += estimate_tokens(full_context)
+        selected_tokens += estimate_tokens(context)
+        full_hits += any(doc.metadata.get("question") == question for doc in docs)
+        selected_hits += f"Câu hỏi: {question}\n" in context
+
+    total = len(questions) or 1
+    return {
+        "questions": len(questions),
+        "avg_tokens_full": full_tokens / total,
+        "avg_tokens_selected": selected_tokens / total,
+        "token_savings": 1 - selected_tokens / full_tokens if full_tokens else 0.0,
+        "expected_doc_recall_full": full_hits / total,
+        "expected_doc_recall_selected": selected_hits / total,
+    }
+
+
+if __name__ == "__main__":
+    from src.logger import setup_logger
+    from src.data_processor import DataProcessor
+    from src.embedding_system import EmbeddingSystem
+
+    setup_logger()
+
+    embedding_system = EmbeddingSystem()
+    if embedding_system.load_vector_store() is None or embedding_system.get_sentence_store() is None:
+        print("Cần khởi tạo lại vector database (python main.py --setup-db) để có embedding câu")
+    else:
+        questions = DataProcessor().preprocess_data()["question"].tolist()
+        result = benchmark_context_selection(embedding_system, questions)
+        logger.info(f"Kết quả benchmark chọn ngữ cảnh: {result}")
+        for key, value in result.items():
+            print(f"{key}: {value}")
@@ -0,0 +1,335 @@
+"""
+Module phát hiện tin nhắn có dấu hiệu khủng hoảng (tự hại, tự sát) trước khi tìm kiếm và gọi LLM
+"""
+import re
+import threading
+import time
+import unicodedata
+from collections import deque
+from pathlib import Path
+
+import numpy as np
+from loguru import logger
+
+from src.config import (
+    CRISIS_SEMANTIC, CRISIS_SIMILARITY_THRESHOLD, CRISIS_HOTLINE, CRISIS_LEXICON_PATH
+)
+from src.logger import redact_query
+from src.metrics import metrics, percentile
+
+# Từ điển cụm từ khủng hoảng (so khớp theo ranh giới từ, có dấu trước rồi không dấu)
+CRISIS_LEXICON = [
+    "tự tử", "tự sát", "tự vẫn", "tự kết liễu", "kết liễu bản thân", "kết liễu đời mình",
+    "muốn chết", "thà chết", "chỉ muốn chết", "không muốn sống", "không muốn sống nữa",
+    "chán sống", "sống không bằng chết", "không còn lý do để sống", "tìm đến cái chết",
+    "chấm dứt cuộc đời", "chấm dứt cuộc sống", "kết thúc cuộc đời", "kết thúc tất cả",
+    "tự làm hại bản thân", "tự hại bản thân", "làm đau bản thân", "rạch tay", "cắt cổ tay",
+    "nhảy lầu", "treo cổ tự", "muốn treo cổ", "uống hết thuốc ngủ", "uống cả lọ thuốc ngủ",
+    "uống cả vỉ thuốc ngủ", "uống quá liều thuốc ngủ", "uống thuốc ngủ để chết", "uống thuốc chuột",
+    "tự bắn", "bắn vào đầu mình", "dùng súng tự", "biến mất mãi mãi", "biến mất vĩnh viễn",
+    "không muốn thức dậy nữa", "viết thư tuyệt mệnh", "thư tuyệt mệnh",
+]
+
+# Dạng bỏ dấu trùng với cụm từ thông thường (vd: "tự vẫn" / "tư vấn", "tự tử" / "từ từ",
+# "tự bắn" / "tư bản", "chán sống" / "chắn sóng"): cụm từ có dạng này chỉ được so khớp khi có dấu
+FOLDED_COLLISIONS = {"tu van", "tu tu", "tu ban", "chan song"}
+
+# Các câu mẫu thể hiện ý định tự hại, dùng cho kiểm tra theo độ tương đồng embedding
+CRISIS_EXEMPLARS = [
+    "Tôi không muốn sống nữa",
+    "Tôi đang nghĩ đến việc tự tử",
+    "Tôi muốn kết thúc cuộc đời mình",
+    "Tôi đã nghĩ cách để tự làm hại bản thân",
+    "Tôi thấy mọi người sẽ tốt hơn nếu không có tôi",
+    "Tôi đang cầm súng và nghĩ đến việc tự bắn mình",
+    "Tối nay tôi sẽ uống hết chỗ thuốc này",
+    "Tôi không chịu nổi nữa, tôi muốn biến mất vĩnh viễn",
+    "Tôi đã viết thư từ biệt cho gia đình",
+    "Sống thế này chẳng còn ý nghĩa gì, chết đi cho xong",
+]
+
+ESCALATION_RESPONSE = (
+    "Tôi rất lo lắng khi nghe bạn chia sẻ điều này, và tôi cảm ơn bạn đã nói ra. "
+    "Sự an toàn của bạn lúc này là quan trọng nhất.\n\n"
+    "**Hãy liên hệ ngay** với chỉ huy trực tiếp, chính trị viên hoặc quân y của đơn vị, "
+    "hoặc gọi **{hotline}** nếu bạn đang gặp nguy hiểm. Nếu có thể, hãy ở cạnh một đồng đội "
+    "bạn tin tưởng và tránh xa vũ khí, thuốc hoặc những vật có thể gây hại.\n\n"
+    "Bạn không phải đối mặt với chuyện này một mình. Nếu bạn muốn, hãy kể cho tôi nghe "
+    "điều gì đang khiến bạn cảm thấy như vậy."
+)
+
+
+def fold_diacritics(text):
+    """
+    Chuẩn hóa văn bản tiếng Việt để so khớp không phân biệt dấu: bỏ dấu, đ -> d, viết thường,
+    thay dấu câu bằng khoảng trắng và thêm khoảng trắng ở hai đầu (ranh giới từ)
+
+    Args:
+        text (str): Văn bản cần chuẩn hóa
+
+    Returns:
+        str: Văn bản chỉ gồm chữ cái ASCII, chữ số và khoảng trắng đơn
+    """
+    text = unicodedata.normalize("NFD", text or "")
+    text = "".join(ch for ch in text if unicodedata.category(ch) != "Mn")
+    text = text.replace("đ", "d").replace("Đ", "D").lower()
+    return " " + re.sub(r"[^a-z0-9]+", " ", text).strip() + " "
+
+
+def normalize_accented(text):
+    """
+    Chuẩn hóa văn bản để so khớp có dấu: chuẩn hóa Unicode (NFC), viết thường, thay dấu câu
+    bằng khoảng trắng và thêm khoảng trắng ở hai đầu (ranh giới từ)
+
+    Args:
+        text (str): Văn bản cần chuẩn hóa
+
+    Returns:
+        str: Văn bản chỉ gồm chữ cái, chữ số và khoảng trắng đơn
+    """
+    text = unicodedata.normalize("NFC", text or "").lower()
+    return " " + re.sub(r"[\W_]+", " ", text).strip() + " "
+
+
+class AhoCorasick:
+    """
+    Automaton Aho–Corasick: tìm mọi cụm từ trong từ điển bằng một lần duyệt văn bản
+    """
+
+    def __init__(self, patterns):
+        """
+        Xây dựng automaton
+
+        Args:
+            patterns (iterable): Các cặp (chuỗi cần tìm, giá trị trả về khi khớp)
+        """
+        self._goto = [{}]
+        self._fail = [0]
+        self._output = [None]
+
+        for pattern, value in patterns:
+            state = 0
+            for ch in pattern:
+                next_state = self._goto[state].get(ch)
+                if next_state is None:
+                    next_state = len(self._goto)
+                    self._goto[state][ch] = next_state
+                    self._goto.append({})
+                    self._fail.append(0)
+                    self._output.append(None)
+                state = next_state
+            self._output[state] = value
+
+        # Liên kết thất bại theo thứ tự BFS; trạng thái không có kết quả riêng kế thừa
+        # kết quả của trạng thái thất bại (cụm từ ngắn hơn là hậu tố)
+        pending = deque(self._goto[0].values())
+        while pending:
+            state = pending.popleft()
+            for ch, next_state in self._goto[state].items():
+                pending.append(next_state)
+                fail = self._fail[state]
+                while fail and ch not in self._goto[fail]:
+                    fail = self._fail[fail]
+                self._fail[next_state] = self._goto[fail].get(ch, 0)
+                if self._output[next_state] is None:
+                    self._output[next_state] = self._output[self._fail[next_state]]
+
+    def search(self, text):
+        """
+        Tìm cụm từ đầu tiên (theo vị trí kết thúc) xuất hiện trong văn bản
+
+        Args:
+            text (str): Văn bản đã chuẩn hóa
+
+        Returns:
+            object: Giá trị của cụm từ khớp, None nếu không có
+        """
+        goto, fail, output = self._goto, self._fail, self._output
+        state = 0
+        for ch in text:
+            while state and ch not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(ch, 0)
+            if output[state] is not None:
+                return output[state]
+        return None
+
+
+class CrisisDetector:
+    """
+    Phát hiện tin nhắn khủng hoảng bằng hai lớp: so khớp từ điển (micro giây, chạy trước mọi bước)
+    và độ tương đồng embedding với các câu mẫu (dùng lại vector câu hỏi của bước tìm kiếm)
+    """
+
+    def __init__(self, lexicon=None, exemplars=None, threshold=CRISIS_SIMILARITY_THRESHOLD,
+                 semantic=CRISIS_SEMANTIC, hotline=CRISIS_HOTLINE):
+        """
+        Khởi tạo CrisisDetector
+
+        Args:
+            lexicon (list, optional): Từ điển cụm từ, mặc định CRISIS_LEXICON và các dòng trong
+                CRISIS_LEXICON_PATH
+            exemplars (list, optional): Các câu mẫu cho kiểm tra embedding
+            threshold (float): Độ tương đồng cosine tối thiểu với một câu mẫu để coi là khủng hoảng
+            semantic (bool): Bật kiểm tra theo độ tương đồng embedding
+            hotline (str): Số điện thoại hỗ trợ hiển thị trong câu trả lời
+        """
+        if lexicon is None:
+            lexicon = list(CRISIS_LEXICON)
+            if CRISIS_LEXICON_PATH and Path(CRISIS_LEXICON_PATH).exists():
+                lexicon += [
+                    line.strip() for line in Path(CRISIS_LEXICON_PATH).read_text(encoding="utf-8").splitlines()
+                    if line.strip() and not line.startswith("#")
+                ]
+
+        self.matcher = AhoCorasick((normalize_accented(term), term) for term in lexicon)
+        self.folded_matcher = AhoCorasick(
+            (fold_diacritics(term), term) for term in lexicon
+            if fold_diacritics(term).strip() not in FOLDED_COLLISIONS
+        )
+        self.exemplars = exemplars or CRISIS_EXEMPLARS
+        self.threshold = threshold
+        self.semantic = semantic
+        self.response = ESCALATION_RESPONSE.format(hotline=hotline)
+        self._exemplar_vectors = None
+        self._lock = threading.Lock()
+        logger.info(f"Khởi tạo CrisisDetector với {len(lexicon)} cụm từ, {len(self.exemplars)} câu mẫu")
+
+    def match_keywords(self, text):
+        """
+        So khớp từ điển: trước hết theo văn bản có dấu, sau đó theo dạng bỏ dấu (cho tin nhắn gõ
+        không dấu) với các cụm từ mà dạng bỏ dấu không trùng cụm từ thông thường
+
+        Args:
+            text (str): Tin nhắn của người dùng
+
+        Returns:
+            str: Cụm từ khớp, None nếu không có
+        """
+        term = self.matcher.search(normalize_accented(text))
+        if term is None:
+            term = self.folded_matcher.search(fold_diacritics(text))
+        return term
+
+    def _exemplar_matrix(self, embed_documents):
+        if self._exemplar_vectors is None:
+            with self._lock:
+                if self._exemplar_vectors is None:
+                    vectors = np.asarray(embed_documents(self.exemplars), dtype=np.float32)
+                    vectors /= np.linalg.norm(vectors, axis=1, keepdims=True) + 1e-12
+                    self._exemplar_vectors = vectors
+        return self._exemplar_vectors
+
+    def match_vector(self, query_vector, embed_documents):
+        """
+        So sánh vector câu hỏi với vector các câu mẫu
+
+        Args:
+            query_vector (list): Vector câu hỏi
+            embed_documents (callable): Hàm encode các câu mẫu (chỉ gọi ở lần đầu)
+
+        Returns:
+            float: Độ tương đồng lớn nhất nếu vượt ngưỡng, None nếu không
+        """
+        if not self.semantic or query_vector is None:
+            return None
+        vector = np.asarray(query_vector, dtype=np.float32)
+        vector = vector / (np.linalg.norm(vector) + 1e-12)
+        score = float(np.max(self._exemplar_matrix(embed_documents) @ vector))
+        return score if score >= self.threshold else None
+
+    def flag(self, query, source, detail):
+        """
+        Ghi nhận một tin nhắn bị gắn cờ khủng hoảng
+
+        Args:
+            query (str): Tin nhắn của người dùng
+            source (str): Lớp phát hiện (keyword hoặc semantic)
+            detail (str): Cụm từ khớp hoặc độ tương đồng
+        """
+        metrics.increment("crisis.flagged")
+        metrics.increment(f"crisis.flagged.{source}")
+        logger.warning(f"Phát hiện tin nhắn khủng hoảng ({source}: {detail}): {redact_query(query)}")
+
+
+_shared_detector = None
+_shared_detector_lock = threading.Lock()
+
+
+def get_crisis_detector():
+    """
+    Lấy CrisisDetector dùng chung cho toàn bộ tiến trình (automaton và vector câu mẫu chỉ
+    được tạo một lần)
+
+    Returns:
+        CrisisDetector: Bộ phát hiện dùng chung
+    """
+    global _shared_detector
+    if _shared_detector is None:
+        with _shared_detector_lock:
+            if _shared_detector is None:
+                _shared_detector = CrisisDetector()
+    return _shared_detector
+
+
+def benchmark_crisis_detection(detector, messages, embedding_system=None, repeat=20):
+    """
+    Đo chi phí của bộ phát hiện trên mỗi tin nhắn
+
+    Args:
+        detector (CrisisDetector): Bộ phát hiện
+        messages (list): Danh sách tin nhắn (vd: câu hỏi trong bộ dữ liệu)
+        embedding_system (EmbeddingSystem, optional): Dùng để đo kiểm tra embedding
+        repeat (int): Số lần lặp lại bộ tin nhắn khi đo so khớp từ điển
+
+    Returns:
+        dict: Thời gian (micro giây) của so khớp từ điển, kiểm tra embedding và số tin nhắn bị gắn cờ
+    """
+    keyword_us = []
+    for _ in range(repeat):
+        for message in messages:
+            start = time.perf_counter()
+            detector.match_keywords(message)
+            keyword_us.append((time.perf_counter() - start) * 1e6)
+    keyword_us.sort()
+
+    result = {
+        "messages": len(messages),
+        "keyword_flagged": sum(detector.match_keywords(message) is not None for message in messages),
+        "exemplars_flagged": sum(detector.match_keywords(text) is not None for text in detector.exemplars),
+        "keyword_us_mean": round(sum(keyword_us) / len(keyword_us), 2) if keyword_us else 0.0,
+        "keyword_us_p95": round(percentile(keyword_us, 95) or 0, 2),
+    }
+
+    if embedding_system is not None and detector.semantic:
+        vectors = embedding_system.embed_documents(messages)
+        detector.match_vector(vectors[0], embedding_system.embed_documents)
+        semantic_us = []
+        flagged = 0
+        for vector in vectors:
+            start = time.perf_counter()
+            flagged += detector.match_vector(vector, embedding_system.embed_documents) is not None
+            semantic_us.append((time.perf_counter() - start) * 1e6)
+        semantic_us.sort()
+        result.update({
+            "semantic_flagged": flagged,
+            "semantic_us_mean": round(sum(semantic_us) / len(semantic_us), 2),
+            "semantic_us_p95": round(percentile(semantic_us, 95) or 0, 2),
+        })
+
+    return result
+
+
+if __name__ == "__main__":
+    from src.logger import setup_logger
+    from src.data_processor import DataProcessor
+    from src.embedding_system import EmbeddingSystem
+
+    setup_logger()
+
+    embedding_system = EmbeddingSystem(server_socket="", batching=False)
+    questions = DataProcessor().preprocess_data()["question"].tolist()
+    result = benchmark_crisis_detection(get_crisis_detector(), questions, embedding_system)
+    logger.info(f"Kết quả benchmark phát hiện khủng hoảng: {result}")
+    for key, value in result.items():
+        print(f"{key}: {value}")
@@ -1,10 +1,96 @@
 """
 Module xử lý dữ liệu cho chatbot
 """
+import hashlib
+import os
+from pathlib import Path
+
 import pandas as pd
 from loguru import logger
+from langchain_text_splitters import RecursiveCharacterTextSplitter
+
+from src.config import DATA_PATH, DATA_CACHE, DATA_CACHE_DIR, CHUNK_SIZE, CHUNK_OVERLAP
+
+# Lược đồ của bộ dữ liệu: tên cột -> kiểu dữ liệu (tất cả đều bắt buộc)
+CORPUS_SCHEMA = {
+    'question': 'string',
+    'answer': 'string',
+}
+# Tăng khi thay đổi cách kiểm tra / chuẩn hóa để các cache cũ tự hết hiệu lực
+CORPUS_CACHE_VERSION = 1
+
+
+def file_digest(path):
+    """
+    Tính mã băm SHA-256 của một file (đọc theo khối)
+
+    Args:
+        path (str): Đường dẫn file
+
+    Returns:
+        str: Mã băm dạng hex
+    """
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def normalize_text(series):
+    """
+    Chuẩn hóa văn bản tiếng Việt: Unicode NFC (dấu dựng sẵn), gộp khoảng trắng trong dòng,
+    bỏ khoảng trắng thừa ở đầu / cuối dòng
+
+    Args:
+        series (pd.Series): Cột văn bản
+
+    Returns:
+        pd.Series: Cột đã chuẩn hóa
+    """
+    return (
+        series.str.normalize('NFC')
+        .str.replace(r'\r\n?', '\n', regex=True)
+        .str.replace(r'[^\S\n]+', ' ', regex=True)
+        .str.replace(r' *\n *', '\n', regex=True)
+        .str.strip()
+    )
+
+
+def validate_corpus(df):
+    """
+    Kiểm tra và chuẩn hóa bộ dữ liệu theo CORPUS_SCHEMA
+
+    Thiếu cột bắt buộc sẽ báo lỗi; các bản ghi rỗng bị loại bỏ và câu hỏi trùng lặp
+    (sau khi chuẩn hóa) chỉ giữ lại bản ghi đầu tiên.
+
+    Args:
+        df (pd.DataFrame): Dữ liệu thô
+
+    Returns:
+        pd.DataFrame: Dữ liệu chỉ gồm các cột trong lược đồ, đúng kiểu, đã chuẩn hóa
+    """
+    missing = [column for column in CORPUS_SCHEMA if column not in df.columns]
+    if missing:
+        raise ValueError(f"Dữ liệu thiếu cột bắt buộc: {', '.join(missing)}")
+
+    total = len(df)
+    df = df[list(CORPUS_SCHEMA)].astype(CORPUS_SCHEMA)
+    for column in CORPUS_SCHEMA:
+        df[column] = normalize_text(df[column])
 
-from src.config import DATA_PATH, CHUNK_SIZE, CHUNK_OVERLAP
+    df = df.replace('', pd.NA).dropna()
+    empty = total - len(df)
+    if empty:
+        logger.warning(f"Đã loại bỏ {empty} bản ghi thiếu câu hỏi hoặc câu trả lời")
+
+    before = len(df)
+    df = df.drop_duplicates(subset='question', keep='first')
+    duplicates = before - len(df)
+    if duplicates:
+        logger.warning(f"Đã loại bỏ {duplicates} câu hỏi trùng lặp")
+
+    return df.reset_index(drop=True)
 
 
 class DataProcessor:
@@ -12,27 +98,71 @@ class DataProcessor:
     Xử lý dữ liệu câu hỏi và câu trả lời cho chatbot
     """
     
-    def __init__(self, data_path=DATA_PATH):
+    def __init__(self, data_path=DATA_PATH, cache_dir=DATA_CACHE_DIR if DATA_CACHE else None):
         """
         Khởi tạo DataProcessor
         
         Args:
             data_path (str): Đường dẫn đến file dữ liệu CSV
+            cache_dir (str, optional): Thư mục lưu cache dữ liệu đã chuẩn hóa, None để tắt cache
         """
         self.data_path = data_path
+        self.cache_dir = cache_dir
         logger.info(f"Khởi tạo DataProcessor với dữ liệu từ {data_path}")
     
+    def _cache_path(self, digest):
+        stem = Path(self.data_path).stem
+        return Path(self.cache_dir) / f"{stem}-v{CORPUS_CACHE_VERSION}-{digest[:16]}.parquet"
+    
+    def _write_cache(self, df, cache_path):
+        """
+        Ghi cache (file tạm rồi đổi tên) và xóa các cache cũ của cùng file nguồn
+        """
+        try:
+            cache_path.parent.mkdir(parents=True, exist_ok=True)
+            tmp_path = cache_path.with_suffix('.tmp')
+            df.to_parquet(tmp_path, index=False)
+            os.replace(tmp_path, cache_path)
+            for old in cache_path.parent.glob(f"{Path(self.data_path).stem}-v*.parquet"):
+                if old != cache_path:
+                    old.unlink(missing_ok=True)
+        except Exception as e:
+            logger.warning(f"Không thể ghi cache dữ liệu {cache_path}: {e}")
+    
     def load_data(self):
         """
-        Đọc dữ liệu từ file CSV
+        Đọc dữ liệu từ file CSV, kiểm tra và chuẩn hóa theo CORPUS_SCHEMA
+        
+        Nếu bật cache, dữ liệu đã chuẩn hóa được đọc từ file Parquet ứng với mã băm
+        của file nguồn; file nguồn thay đổi thì cache tự hết hiệu lực.
         
         Returns:
             pd.DataFrame: DataFrame chứa dữ liệu câu hỏi và câu trả lời
         """
         try:
+            cache_path = None
+            if self.cache_dir:
+                cache_path = self._cache_path(file_digest(self.data_path))
+                if cache_path.exists():
+                    try:
+                        df = pd.read_parquet(cache_path).astype(CORPUS_SCHEMA)
+                        logger.info(f"Đã đọc {len(df)} bản ghi từ cache {cache_path.name}")
+                        return df
+                    except Exception as e:
+                        logger.warning(f"Cache dữ liệu {cache_path} không hợp lệ, đọc lại từ CSV: {e}")
+            
             logger.info(f"Đang đọc dữ liệu từ {self.data_path}")
-            df = pd.read_csv(self.data_path)
+            df = pd.read_csv(
+                self.data_path,
+                encoding='utf-8-sig',
+                dtype=CORPUS_SCHEMA,
+                keep_default_na=False,
+            )
+            df = validate_corpus(df)
             logger.info(f"Đã đọc thành công {len(df)} bản ghi")
+            
+            if cache_path is not None:
+                self._write_cache(df, cache_path)
             return df
         except Exception as e:
             logger.error(f"Lỗi khi đọc dữ liệu: {e}")
@@ -50,17 +180,13 @@ class DataProcessor:
         """
         if df is None:
             df = self.load_data()
+        else:
+            df = validate_corpus(df)
         
         logger.info("Bắt đầu tiền xử lý dữ liệu")
         
-        # Kiểm tra và xử lý dữ liệu thiếu
-        if df['question'].isna().sum() > 0 or df['answer'].isna().sum() > 0:
-            logger.warning(f"Phát hiện {df['question'].isna().sum()} câu hỏi và {df['answer'].isna().sum()} câu trả lời bị thiếu")
-            df = df.dropna(subset=['question', 'answer'])
-            logger.info(f"Đã loại bỏ các bản ghi thiếu dữ liệu, còn lại {len(df)} bản ghi")
-        
         # Tạo trường context để sử dụng cho embedding
-        df['context'] = "Câu hỏi: " + df['question'] + "\nCâu trả lời: " + df['answer']
+        df = df.assign(context="Câu hỏi: " + df['question'].str.cat(df['answer'], sep="\nCâu trả lời: "))
         
         logger.info("Hoàn thành tiền xử lý dữ liệu")
         return df
@@ -74,15 +200,55 @@ class DataProcessor:
         """
         df = self.preprocess_data()
         
-        documents = []
-        for _, row in df.iterrows():
-            documents.append({
-                'content': row['context'],
+        documents = [
+            {
+                'content': context,
                 'metadata': {
-                    'question': row['question'],
-                    'answer': row['answer']
+                    'row_id': row_id,
+                    'question': question,
+                    'answer': answer
                 }
-            })
+            }
+            for row_id, (context, question, answer) in enumerate(zip(
+                df['context'].tolist(), df['question'].tolist(), df['answer'].tolist()
+            ))
+        ]
         
         logger.info(f"Đã tạo {len(documents)} documents cho embedding")
         return documents
+    
+    def get_chunks(self, documents, chunk_size=CHUNK_SIZE, chunk_overlap=CHUNK_OVERLAP):
+        """
+        Chia câu trả lời của mỗi document thành các đoạn nhỏ để tạo index theo đoạn
+        
+        Mỗi đoạn giữ liên kết tới document cha qua `row_id` trong metadata.
+        
+        Args:
+            documents (list): Danh sách documents (kết quả của get_documents)
+            chunk_size (int): Độ dài tối đa của một đoạn (ký tự)
+            chunk_overlap (int): Số ký tự chồng lấn giữa hai đoạn liên tiếp
+        
+        Returns:
+            list: Danh sách các đoạn (cùng định dạng với document)
+        """
+        splitter = RecursiveCharacterTextSplitter(
+            chunk_size=chunk_size,
+            chunk_overlap=chunk_overlap,
+            separators=["\n\n", "\n", ". ", "! ", "? ", "; ", ", ", " ", ""]
+        )
+        
+        chunks = []
+        for doc in documents:
+            metadata = doc['metadata']
+            for chunk_id, text in enumerate(splitter.split_text(metadata['answer'])):
+                chunks.append({
+                    'content': f"Câu hỏi: {metadata['question']}\nĐoạn trích: {text}",
+                    'metadata': {
+                        'row_id': metadata['row_id'],
+                        'chunk_id': chunk_id,
+                        'question': metadata['question']
+                    }
+                })
+        
+        logger.info(f"Đã chia {len(documents)} documents thành {len(chunks)} đoạn (chunk_size={chunk_size}, overlap={chunk_overlap})")
+        return chunks
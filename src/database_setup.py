@@ -6,17 +6,23 @@ from loguru import logger
 from src.logger import setup_logger
 from src.data_processor import DataProcessor
 from src.embedding_system import EmbeddingSystem
+from src.config import CHUNK_INDEX
 
 
-def setup_database():
+def setup_database(data_path=None, vector_db_path=None):
     """
     Khởi tạo vector database từ dữ liệu
+    
+    Args:
+        data_path (str, optional): File CSV nguồn. Nếu None, dùng DATA_PATH trong config.
+        vector_db_path (str, optional): Thư mục lưu vector database (vd: một shard trong
+            VECTOR_DB_SHARDS_DIR). Nếu None, dùng VECTOR_DB_PATH trong config.
     """
     logger.info("Bắt đầu khởi tạo vector database")
     
     try:
         # Tải và xử lý dữ liệu
-        data_processor = DataProcessor()
+        data_processor = DataProcessor(data_path) if data_path else DataProcessor()
         documents = data_processor.get_documents()
         
         if not documents:
@@ -24,10 +30,15 @@ def setup_database():
             return False
         
         # Tạo vector database
-        embedding_system = EmbeddingSystem()
-        embedding_system.load_embeddings()
+        embedding_system = EmbeddingSystem(vector_db_path=vector_db_path) if vector_db_path else EmbeddingSystem()
+        # Encode toàn bộ dữ liệu ngay sau đó nên không cần khởi động riêng
+        embedding_system.load_embeddings(warmup=False)
         embedding_system.create_vector_store(documents)
         
+        # Tạo index theo đoạn (liên kết với document cha) để tìm kiếm chi tiết hơn
+        if CHUNK_INDEX:
+            embedding_system.create_chunk_store(data_processor.get_chunks(documents))
+        
         # Lưu vector database
         result = embedding_system.save_vector_store()
         
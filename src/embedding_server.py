@@ -0,0 +1,349 @@
+"""
+Module tiến trình phụ (sidecar) giữ mô hình embedding và FAISS index, phục vụ encode và
+tìm kiếm cho nhiều worker qua Unix domain socket
+"""
+import json
+import os
+import socket
+import socketserver
+import struct
+import threading
+
+from loguru import logger
+from langchain_core.documents import Document
+
+from src.config import (
+    EMBEDDING_SERVER_SOCKET, EMBEDDING_SERVER_TIMEOUT, EMBEDDING_CLIENT_POOL_SIZE, VECTOR_DB_SHARDS_DIR
+)
+from src.metrics import metrics
+
+# Mỗi thông điệp gồm 4 byte độ dài (big-endian) và nội dung JSON UTF-8
+_HEADER = struct.Struct(">I")
+
+
+def send_message(sock, payload):
+    """
+    Gửi một thông điệp JSON qua socket
+
+    Args:
+        sock (socket.socket): Socket đã kết nối
+        payload (dict): Nội dung thông điệp
+    """
+    data = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+    sock.sendall(_HEADER.pack(len(data)) + data)
+
+
+def recv_message(sock):
+    """
+    Nhận một thông điệp JSON từ socket
+
+    Args:
+        sock (socket.socket): Socket đã kết nối
+
+    Returns:
+        dict: Nội dung thông điệp, None nếu phía bên kia đã đóng kết nối
+    """
+    header = _recv_exact(sock, _HEADER.size)
+    if header is None:
+        return None
+    data = _recv_exact(sock, _HEADER.unpack(header)[0])
+    if data is None:
+        return None
+    return json.loads(data.decode("utf-8"))
+
+
+def _recv_exact(sock, size):
+    """
+    Đọc đúng `size` byte từ socket, None nếu kết nối bị đóng giữa chừng
+    """
+    chunks = []
+    while size > 0:
+        chunk = sock.recv(min(size, 1 << 20))
+        if not chunk:
+            return None
+        chunks.append(chunk)
+        size -= len(chunk)
+    return b"".join(chunks)
+
+
+def _serialize_docs(docs):
+    return [{"page_content": doc.page_content, "metadata": doc.metadata} for doc in docs]
+
+
+def _deserialize_docs(items):
+    return [Document(page_content=item["page_content"], metadata=item["metadata"]) for item in items]
+
+
+class _RequestHandler(socketserver.StreamRequestHandler):
+    """
+    Xử lý các yêu cầu trên một kết nối (mỗi kết nối chạy trên một luồng riêng)
+    """
+
+    def handle(self):
+        batcher = self.server.batcher
+        while True:
+            try:
+                request = recv_message(self.request)
+            except (OSError, ValueError):
+                return
+            if request is None:
+                return
+
+            try:
+                op = request.get("op")
+                if op == "ping":
+                    response = {"ok": True, "version": self.server.embedding_system.current_version}
+                elif op == "embed":
+                    vector = batcher.embed(request["query"])
+                    response = {"ok": True, "vector": vector.tolist()}
+                elif op == "search":
+                    docs, vector = batcher.search(
+                        query=request.get("query"), vector=request.get("vector"), k=request.get("k", 3)
+                    )
+                    response = {"ok": True, "docs": _serialize_docs(docs), "vector": vector.tolist()}
+                elif op == "search_batch":
+                    results = batcher.search_batch(request["queries"], k=request.get("k", 3))
+                    response = {"ok": True, "results": [_serialize_docs(docs) for docs in results]}
+                else:
+                    response = {"ok": False, "error": f"Không hỗ trợ thao tác {op}"}
+            except Exception as e:
+                logger.error(f"Lỗi khi xử lý yêu cầu {request.get('op')}: {e}")
+                response = {"ok": False, "error": str(e)}
+
+            try:
+                send_message(self.request, response)
+            except OSError:
+                return
+
+
+class EmbeddingServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    """
+    Máy chủ encode + tìm kiếm trên Unix domain socket, các yêu cầu đồng thời được gom lô
+    """
+
+    daemon_threads = True
+
+    def __init__(self, socket_path=EMBEDDING_SERVER_SOCKET, embedding_system=None):
+        """
+        Khởi tạo EmbeddingServer và tải mô hình, vector store
+
+        Args:
+            socket_path (str): Đường dẫn Unix domain socket
+            embedding_system (EmbeddingSystem, optional): Hệ thống embedding dùng để phục vụ
+        """
+        from src.embedding_system import EmbeddingSystem
+        from src.query_batcher import QueryBatcher
+
+        self.socket_path = socket_path
+        self.embedding_system = embedding_system or EmbeddingSystem(server_socket="", batching=False)
+        if not (VECTOR_DB_SHARDS_DIR and self.embedding_system.load_shards() is not None):
+            if self.embedding_system.load_vector_store() is None:
+                raise RuntimeError("Không thể khởi động embedding server vì vector store chưa được tạo")
+            self.embedding_system.start_watcher()
+        self.batcher = QueryBatcher(self.embedding_system)
+
+        # Xóa socket cũ còn sót lại từ lần chạy trước
+        if os.path.exists(socket_path):
+            os.unlink(socket_path)
+        super().__init__(socket_path, _RequestHandler)
+        os.chmod(socket_path, 0o660)
+        logger.info(f"Embedding server lắng nghe tại {socket_path}")
+
+    def server_close(self):
+        """
+        Đóng socket, dừng bộ gom lô và giải phóng vector store
+        """
+        super().server_close()
+        self.batcher.close()
+        self.embedding_system.close()
+        if os.path.exists(self.socket_path):
+            os.unlink(self.socket_path)
+
+
+class EmbeddingClient:
+    """
+    Client kết nối tới EmbeddingServer qua một pool kết nối có giới hạn, dùng chung cho mọi luồng
+    """
+
+    def __init__(self, socket_path=EMBEDDING_SERVER_SOCKET, timeout=EMBEDDING_SERVER_TIMEOUT,
+                 pool_size=EMBEDDING_CLIENT_POOL_SIZE):
+        """
+        Khởi tạo EmbeddingClient
+
+        Args:
+            socket_path (str): Đường dẫn Unix domain socket của server
+            timeout (float): Thời gian chờ tối đa cho mỗi yêu cầu (giây)
+            pool_size (int): Số kết nối tối đa tới server; luồng khác chờ tới khi có kết nối rảnh
+        """
+        self.socket_path = socket_path
+        self.timeout = timeout
+        self.pool_size = max(1, pool_size)
+        self._slots = threading.BoundedSemaphore(self.pool_size)
+        self._idle = []
+        self._open = 0
+        self._lock = threading.Lock()
+
+    def _acquire(self):
+        if not self._slots.acquire(timeout=self.timeout):
+            metrics.increment("embedding_client.pool_timeouts")
+            raise TimeoutError(f"Không có kết nối rảnh tới embedding server sau {self.timeout}s")
+        with self._lock:
+            if self._idle:
+                return self._idle.pop()
+        try:
+            sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            sock.settimeout(self.timeout)
+            sock.connect(self.socket_path)
+        except OSError:
+            self._slots.release()
+            raise
+        with self._lock:
+            self._open += 1
+            metrics.set_gauge("embedding_client.connections", self._open)
+        return sock
+
+    def _release(self, sock, broken=False):
+        with self._lock:
+            if broken:
+                self._open -= 1
+                metrics.set_gauge("embedding_client.connections", self._open)
+            else:
+                self._idle.append(sock)
+        if broken:
+            try:
+                sock.close()
+            except OSError:
+                pass
+        self._slots.release()
+
+    def call(self, op, **payload):
+        """
+        Gửi một yêu cầu tới server, kết nối lại một lần nếu kết nối cũ đã bị đóng
+
+        Args:
+            op (str): Tên thao tác (ping, embed, search, search_batch)
+            **payload: Tham số của thao tác
+
+        Returns:
+            dict: Phản hồi của server
+        """
+        for attempt in range(2):
+            sock = self._acquire()
+            try:
+                send_message(sock, {"op": op, **payload})
+                response = recv_message(sock)
+                if response is None:
+                    raise ConnectionError("Embedding server đã đóng kết nối")
+            except OSError:
+                self._release(sock, broken=True)
+                if attempt == 1:
+                    raise
+                continue
+            self._release(sock)
+            break
+        if not response.get("ok"):
+            raise RuntimeError(f"Embedding server trả lỗi: {response.get('error')}")
+        return response
+
+    def ping(self):
+        """
+        Kiểm tra server còn hoạt động
+
+        Returns:
+            str: Phiên bản vector store mà server đang phục vụ
+        """
+        return self.call("ping").get("version")
+
+    def embed(self, query):
+        """
+        Encode một câu hỏi
+
+        Returns:
+            list: Vector câu hỏi
+        """
+        return self.call("embed", query=query)["vector"]
+
+    def search(self, query=None, vector=None, k=3):
+        """
+        Tìm kiếm theo câu hỏi hoặc theo vector đã encode
+
+        Returns:
+            tuple: (docs, vector câu hỏi)
+        """
+        response = self.call("search", query=query, vector=None if vector is None else list(map(float, vector)), k=k)
+        return _deserialize_docs(response["docs"]), response["vector"]
+
+    def search_batch(self, queries, k=3):
+        """
+        Tìm kiếm cho nhiều câu hỏi
+
+        Returns:
+            list: Danh sách (theo thứ tự câu hỏi) các danh sách document
+        """
+        response = self.call("search_batch", queries=list(queries), k=k)
+        return [_deserialize_docs(items) for items in response["results"]]
+
+    def close(self):
+        """
+        Đóng các kết nối đang rảnh tới server (kết nối đang dùng được đóng khi trả về pool bị lỗi
+        hoặc khi tiến trình kết thúc)
+        """
+        with self._lock:
+            connections, self._idle = self._idle, []
+            self._open -= len(connections)
+        for sock in connections:
+            try:
+                sock.close()
+            except OSError:
+                pass
+
+
+_clients = {}
+_clients_lock = threading.Lock()
+
+
+def get_embedding_client(socket_path=EMBEDDING_SERVER_SOCKET):
+    """
+    Lấy EmbeddingClient dùng chung của tiến trình cho một socket, để mọi phiên dùng chung
+    một pool kết nối thay vì mỗi phiên / mỗi luồng mở kết nối riêng
+
+    Args:
+        socket_path (str): Đường dẫn Unix domain socket của server
+
+    Returns:
+        EmbeddingClient: Client dùng chung
+    """
+    client = _clients.get(socket_path)
+    if client is None:
+        with _clients_lock:
+            client = _clients.get(socket_path)
+            if client is None:
+                client = _clients[socket_path] = EmbeddingClient(socket_path)
+    return client
+
+
+def run_server(socket_path=EMBEDDING_SERVER_SOCKET):
+    """
+    Chạy embedding server cho tới khi bị dừng (Ctrl+C)
+
+    Args:
+        socket_path (str): Đường dẫn Unix domain socket
+    """
+    if not socket_path:
+        raise ValueError("Cần cấu hình EMBEDDING_SERVER_SOCKET để chạy embedding server")
+    from src.settings import install_reload_signal
+    install_reload_signal()
+    server = EmbeddingServer(socket_path)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        logger.info("Dừng embedding server")
+    finally:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    from src.logger import setup_logger
+
+    setup_logger()
+    run_server()
@@ -2,6 +2,9 @@
 Module xử lý embedding và vector database
 """
 import os
+import shutil
+import threading
+from datetime import datetime
 from pathlib import Path
 
 import faiss
@@ -11,7 +14,52 @@ from sentence_transformers import SentenceTransformer
 from langchain_community.vectorstores import FAISS as LangchainFAISS
 from langchain_huggingface import HuggingFaceEmbeddings
 
-from src.config import EMBEDDING_MODEL, VECTOR_DB_PATH
+from src.logger import hot_logger, redact_query
+from src.config import (
+    EMBEDDING_MODEL, VECTOR_DB_PATH, VECTOR_DB_SHARDS_DIR,
+    VECTOR_DB_RELOAD_INTERVAL, VECTOR_DB_KEEP_VERSIONS, RETRIEVAL_GRANULARITY,
+    EMBEDDING_SERVER_SOCKET, EMBEDDING_BATCHING, EMBEDDING_WARMUP, SHARD_RESCAN_INTERVAL
+)
+from src.warmup import configure_threads, warm_up_once
+
+# Tên file con trỏ và thư mục chứa các phiên bản vector store
+CURRENT_POINTER = "CURRENT"
+VERSIONS_DIR = "versions"
+# Thư mục con (trong mỗi phiên bản) chứa index theo đoạn
+CHUNKS_DIR = "chunks"
+
+
+def read_current_version(vector_db_path):
+    """
+    Đọc phiên bản vector store hiện hành từ con trỏ CURRENT
+    
+    Args:
+        vector_db_path (str): Thư mục gốc của vector database
+    
+    Returns:
+        str: Tên phiên bản, None nếu vector database chưa được phiên bản hóa
+    """
+    try:
+        with open(os.path.join(vector_db_path, CURRENT_POINTER), encoding="utf-8") as f:
+            return f.read().strip() or None
+    except FileNotFoundError:
+        return None
+
+
+def resolve_vector_db_path(vector_db_path):
+    """
+    Lấy thư mục chứa index.faiss của phiên bản hiện hành
+    
+    Args:
+        vector_db_path (str): Thư mục gốc của vector database
+    
+    Returns:
+        str: Thư mục phiên bản hiện hành, hoặc chính thư mục gốc nếu chưa phiên bản hóa
+    """
+    version = read_current_version(vector_db_path)
+    if version is None:
+        return vector_db_path
+    return os.path.join(vector_db_path, VERSIONS_DIR, version)
 
 
 class EmbeddingSystem:
@@ -19,33 +67,64 @@ class EmbeddingSystem:
     Hệ thống quản lý embedding và vector database
     """
     
-    def __init__(self, model_name=EMBEDDING_MODEL, vector_db_path=VECTOR_DB_PATH):
+    def __init__(self, model_name=EMBEDDING_MODEL, vector_db_path=VECTOR_DB_PATH,
+                 granularity=RETRIEVAL_GRANULARITY, server_socket=EMBEDDING_SERVER_SOCKET,
+                 batching=EMBEDDING_BATCHING):
         """
         Khởi tạo EmbeddingSystem
         
         Args:
             model_name (str): Tên mô hình embedding
             vector_db_path (str): Đường dẫn lưu vector database
+            granularity (str): Đơn vị tìm kiếm: document, chunk hoặc parent
+            server_socket (str): Socket của embedding server; nếu có, encode và tìm kiếm
+                được chuyển cho server thay vì tải mô hình trong tiến trình này
+            batching (bool): Dùng bộ gom lô dùng chung của tiến trình (gắn khi gọi
+                load_vector_store) thay vì tải mô hình và vector store riêng
         """
         self.model_name = model_name
         self.vector_db_path = vector_db_path
+        self.granularity = granularity
         self.embeddings = None
         self.vector_store = None
+        self.sentence_store = None
+        # (index theo đoạn, ánh xạ row_id -> document cha), thay thế cùng lúc khi tải lại
+        self.chunk_index = None
+        self.shard_manager = None
+        self.current_version = None
+        self._watcher = None
+        self._stop_event = threading.Event()
+        
+        # Chế độ client: mô hình và FAISS index nằm ở embedding server hoặc bộ gom lô dùng chung
+        self.client = None
+        self.batching = batching and not server_socket
+        # Dung lượng tham số mô hình embedding (tính một lần khi cần)
+        self._model_bytes = None
+        if server_socket:
+            from src.embedding_server import get_embedding_client
+            self.client = get_embedding_client(server_socket)
+            logger.info(f"Khởi tạo EmbeddingSystem ở chế độ client (server: {server_socket})")
+            return
         
         logger.info(f"Khởi tạo EmbeddingSystem với mô hình {model_name}")
         
         # Tạo thư mục vector_db nếu chưa tồn tại
         Path(vector_db_path).mkdir(exist_ok=True, parents=True)
     
-    def load_embeddings(self):
+    def load_embeddings(self, warmup=EMBEDDING_WARMUP):
         """
         Tải mô hình embedding
         
+        Args:
+            warmup (bool): Encode thử một lô câu mẫu sau khi tải để câu hỏi đầu tiên không
+                chịu độ trễ khởi động
+        
         Returns:
             HuggingFaceEmbeddings: Đối tượng embedding
         """
         try:
             logger.info(f"Đang tải mô hình embedding {self.model_name}")
+            configure_threads()
             
             model_kwargs = {'device': 'cpu',
                             'trust_remote_code': True}
@@ -58,10 +137,13 @@ class EmbeddingSystem:
             )
             
             logger.info(f"Đã tải thành công mô hình embedding {self.model_name}")
-            return self.embeddings
         except Exception as e:
             logger.error(f"Lỗi khi tải mô hình embedding: {e}")
             raise
+        
+        if warmup:
+            warm_up_once(self.embeddings)
+        return self.embeddings
     
     def create_vector_store(self, documents):
         """
@@ -89,11 +171,43 @@ class EmbeddingSystem:
             )
             
             logger.info(f"Đã tạo thành công vector store với {len(texts)} documents")
+            
+            # Encode sẵn từng câu trong câu trả lời để nén ngữ cảnh khi trả lời
+            from src.context_selector import SentenceStore
+            self.sentence_store = SentenceStore.build(documents, self.embeddings)
+            
             return self.vector_store
         except Exception as e:
             logger.error(f"Lỗi khi tạo vector store: {e}")
             raise
     
+    def create_chunk_store(self, chunks):
+        """
+        Tạo index theo đoạn, mỗi đoạn liên kết với document cha qua row_id
+        
+        Args:
+            chunks (list): Danh sách đoạn (kết quả của DataProcessor.get_chunks)
+        
+        Returns:
+            LangchainFAISS: Vector store của các đoạn
+        """
+        if self.embeddings is None:
+            self.load_embeddings()
+        
+        try:
+            logger.info(f"Bắt đầu tạo index theo đoạn với {len(chunks)} đoạn")
+            chunk_store = LangchainFAISS.from_texts(
+                texts=[chunk['content'] for chunk in chunks],
+                embedding=self.embeddings,
+                metadatas=[chunk['metadata'] for chunk in chunks]
+            )
+            self.chunk_index = (chunk_store, self._build_parent_map(self.vector_store))
+            logger.info("Đã tạo thành công index theo đoạn")
+            return chunk_store
+        except Exception as e:
+            logger.error(f"Lỗi khi tạo index theo đoạn: {e}")
+            raise
+    
     def save_vector_store(self):
         """
         Lưu vector store
@@ -103,9 +217,28 @@ class EmbeddingSystem:
             return False
         
         try:
-            logger.info(f"Đang lưu vector store vào {self.vector_db_path}")
-            self.vector_store.save_local(self.vector_db_path)
-            logger.info("Đã lưu vector store thành công")
+            # Ghi vào một thư mục phiên bản mới, tiến trình đang phục vụ không bao giờ đọc file ghi dở
+            version = datetime.now().strftime("%Y%m%d-%H%M%S-%f")
+            version_path = os.path.join(self.vector_db_path, VERSIONS_DIR, version)
+            logger.info(f"Đang lưu vector store vào {version_path}")
+            self.vector_store.save_local(version_path)
+            if self.sentence_store is not None:
+                self.sentence_store.save(version_path)
+            if self.chunk_index is not None:
+                self.chunk_index[0].save_local(os.path.join(version_path, CHUNKS_DIR))
+            
+            # Chuyển con trỏ CURRENT một cách nguyên tử
+            pointer_path = os.path.join(self.vector_db_path, CURRENT_POINTER)
+            tmp_path = pointer_path + ".tmp"
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                f.write(version)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_path, pointer_path)
+            self.current_version = version
+            
+            self._prune_versions()
+            logger.info(f"Đã lưu vector store thành công (phiên bản {version})")
             return True
         except Exception as e:
             logger.error(f"Lỗi khi lưu vector store: {e}")
@@ -116,28 +249,330 @@ class EmbeddingSystem:
         Tải vector store từ đĩa
         
         Returns:
-            LangchainFAISS: Vector store đã tải
+            LangchainFAISS: Vector store đã tải (hoặc client của embedding server / bộ gom lô
+                dùng chung ở chế độ client)
         """
+        if self.client is None and self.batching:
+            from src.query_batcher import get_query_batcher
+            self.client = get_query_batcher()
+            if self.client is not None:
+                logger.info("Dùng bộ gom lô encode/tìm kiếm dùng chung của tiến trình")
+        
+        if self.client is not None:
+            try:
+                version = self.client.ping()
+            except Exception as e:
+                logger.error(f"Không kết nối được embedding server: {e}")
+                return None
+            self.current_version = version
+            logger.info(f"Đã kết nối embedding server (phiên bản vector store {version or 'không phiên bản'})")
+            return self.client
+        
         if self.embeddings is None:
             self.load_embeddings()
         
         try:
-            if not os.path.exists(os.path.join(self.vector_db_path, "index.faiss")):
+            version = read_current_version(self.vector_db_path)
+            current_path = resolve_vector_db_path(self.vector_db_path)
+            if not os.path.exists(os.path.join(current_path, "index.faiss")):
                 logger.warning("Không tìm thấy vector store, cần tạo mới trước khi sử dụng")
                 return None
             
-            logger.info(f"Đang tải vector store từ {self.vector_db_path}")
+            logger.info(f"Đang tải vector store từ {current_path}")
             self.vector_store = LangchainFAISS.load_local(
-                self.vector_db_path,
+                current_path,
                 self.embeddings,
                 allow_dangerous_deserialization=True
             )
-            logger.info("Đã tải vector store thành công")
+            self.sentence_store = self._load_sentence_store(current_path)
+            self.chunk_index = self._load_chunk_index(current_path, self.vector_store)
+            self.current_version = version
+            logger.info(f"Đã tải vector store thành công (phiên bản {version or 'không phiên bản'})")
             return self.vector_store
         except Exception as e:
             logger.error(f"Lỗi khi tải vector store: {e}")
             return None
     
+    def reload_if_changed(self):
+        """
+        Tải lại vector store nếu con trỏ CURRENT đã trỏ sang phiên bản mới
+        
+        Vector store mới được tải xong hoàn toàn rồi mới thay thế tham chiếu cũ, nên các
+        câu hỏi đang xử lý vẫn chạy trên bản cũ, còn câu hỏi mới dùng bản mới. Bản cũ được
+        giải phóng khi không còn câu hỏi nào giữ tham chiếu.
+        
+        Returns:
+            bool: True nếu đã chuyển sang phiên bản mới
+        """
+        version = read_current_version(self.vector_db_path)
+        if version is None or version == self.current_version:
+            return False
+        
+        version_path = os.path.join(self.vector_db_path, VERSIONS_DIR, version)
+        logger.info(f"Phát hiện phiên bản vector store mới {version}, đang tải")
+        new_store = LangchainFAISS.load_local(
+            version_path,
+            self.embeddings,
+            allow_dangerous_deserialization=True
+        )
+        new_sentence_store = self._load_sentence_store(version_path)
+        new_chunk_index = self._load_chunk_index(version_path, new_store)
+        
+        old_version = self.current_version
+        self.vector_store = new_store
+        self.sentence_store = new_sentence_store
+        self.chunk_index = new_chunk_index
+        self.current_version = version
+        logger.info(f"Đã chuyển vector store từ phiên bản {old_version} sang {version}")
+        return True
+    
+    def start_watcher(self, interval=VECTOR_DB_RELOAD_INTERVAL):
+        """
+        Khởi động luồng nền theo dõi con trỏ CURRENT để tải lại vector store không gián đoạn
+        
+        Args:
+            interval (float): Khoảng thời gian (giây) giữa hai lần kiểm tra
+        """
+        # Ở chế độ client, embedding server tự theo dõi và tải lại vector store
+        if self._watcher is not None or interval <= 0 or self.client is not None:
+            return
+        
+        self._stop_event.clear()
+        self._watcher = threading.Thread(
+            target=self._watch_loop,
+            args=(interval,),
+            name="vector-db-watcher",
+            daemon=True
+        )
+        self._watcher.start()
+        logger.info(f"Đã khởi động luồng theo dõi vector store (chu kỳ {interval}s)")
+    
+    def stop_watcher(self):
+        """
+        Dừng luồng theo dõi vector store
+        """
+        if self._watcher is None:
+            return
+        self._stop_event.set()
+        self._watcher.join(timeout=5)
+        self._watcher = None
+        logger.info("Đã dừng luồng theo dõi vector store")
+    
+    def close(self):
+        """
+        Dừng luồng theo dõi và giải phóng vector store
+        """
+        self.stop_watcher()
+        if self.shard_manager is not None:
+            self.shard_manager.close()
+            self.shard_manager = None
+        # Client của embedding server / bộ gom lô dùng chung cho cả tiến trình, không đóng ở đây
+        self.client = None
+        self.vector_store = None
+        self.sentence_store = None
+        self.chunk_index = None
+    
+    def memory_bytes(self):
+        """
+        Ước lượng bộ nhớ do riêng EmbeddingSystem này giữ: tham số mô hình embedding, các FAISS
+        index (xấp xỉ bằng số vector x số chiều x 4 byte) và vector câu của sentence store
+        
+        Ở chế độ client (embedding server hoặc bộ gom lô dùng chung), mô hình và index được dùng
+        chung cho cả tiến trình / máy nên không tính vào đây.
+        
+        Returns:
+            int: Số byte ước lượng
+        """
+        if self.client is not None:
+            return 0
+        
+        total = 0
+        if self.embeddings is not None:
+            if self._model_bytes is None:
+                model = getattr(self.embeddings, "_client", None)
+                self._model_bytes = sum(
+                    param.numel() * param.element_size() for param in model.parameters()
+                ) if model is not None else 0
+            total += self._model_bytes
+        
+        stores = [self.vector_store]
+        if self.chunk_index is not None:
+            stores.append(self.chunk_index[0])
+        if self.shard_manager is not None:
+            stores.extend(shard["vector_store"] for shard in self.shard_manager.shards.values())
+        for store in stores:
+            if store is not None:
+                total += store.index.ntotal * store.index.d * 4
+        if self.sentence_store is not None:
+            total += self.sentence_store.vectors.nbytes
+        return total
+    
+    @staticmethod
+    def _load_sentence_store(path):
+        """
+        Tải embedding câu đi kèm vector store (nếu có)
+        
+        Args:
+            path (str): Thư mục phiên bản vector store
+        
+        Returns:
+            SentenceStore: Store đã tải, None nếu không có hoặc bị lỗi
+        """
+        from src.context_selector import SentenceStore
+        try:
+            sentence_store = SentenceStore.load(path)
+        except Exception as e:
+            logger.error(f"Lỗi khi tải embedding câu: {e}")
+            return None
+        if sentence_store is None:
+            logger.info("Vector store không có embedding câu, ngữ cảnh sẽ không được nén")
+        return sentence_store
+    
+    @staticmethod
+    def _build_parent_map(vector_store):
+        """
+        Tạo ánh xạ row_id -> document cha từ vector store theo document
+        
+        Args:
+            vector_store (LangchainFAISS): Vector store theo document
+        
+        Returns:
+            dict: Ánh xạ row_id -> Document
+        """
+        parents = {}
+        if vector_store is None:
+            return parents
+        for docstore_id in vector_store.index_to_docstore_id.values():
+            doc = vector_store.docstore.search(docstore_id)
+            row_id = getattr(doc, "metadata", {}).get("row_id")
+            if row_id is not None:
+                parents[row_id] = doc
+        return parents
+    
+    def _load_chunk_index(self, path, vector_store):
+        """
+        Tải index theo đoạn đi kèm vector store (nếu có)
+        
+        Args:
+            path (str): Thư mục phiên bản vector store
+            vector_store (LangchainFAISS): Vector store theo document cùng phiên bản
+        
+        Returns:
+            tuple: (index theo đoạn, ánh xạ row_id -> document cha), None nếu không có
+        """
+        chunks_path = os.path.join(path, CHUNKS_DIR)
+        if not os.path.exists(os.path.join(chunks_path, "index.faiss")):
+            if self.granularity != "document":
+                logger.warning(f"Vector store không có index theo đoạn, tìm kiếm theo document thay cho {self.granularity}")
+            return None
+        
+        try:
+            chunk_store = LangchainFAISS.load_local(
+                chunks_path,
+                self.embeddings,
+                allow_dangerous_deserialization=True
+            )
+        except Exception as e:
+            logger.error(f"Lỗi khi tải index theo đoạn: {e}")
+            return None
+        logger.info(f"Đã tải index theo đoạn ({chunk_store.index.ntotal} đoạn)")
+        return chunk_store, self._build_parent_map(vector_store)
+    
+    def _search_chunks(self, chunk_index, query_vector, k):
+        """
+        Tìm kiếm trên index theo đoạn
+        
+        Với granularity=chunk, trả về các đoạn khớp nhất; với granularity=parent, trả về
+        các document cha (không trùng lặp) theo thứ tự đoạn khớp nhất của mỗi document.
+        
+        Args:
+            chunk_index (tuple): (index theo đoạn, ánh xạ row_id -> document cha)
+            query_vector (list): Vector câu hỏi
+            k (int): Số lượng kết quả trả về
+        
+        Returns:
+            list: Danh sách đoạn hoặc document cha
+        """
+        chunk_store, parents = chunk_index
+        if self.granularity == "chunk":
+            return chunk_store.similarity_search_by_vector(query_vector, k=k)
+        
+        # Lấy dư để còn đủ k document cha sau khi gộp các đoạn cùng document
+        results = []
+        seen = set()
+        for chunk in chunk_store.similarity_search_by_vector(query_vector, k=k * 4):
+            row_id = chunk.metadata.get("row_id")
+            if row_id in seen:
+                continue
+            seen.add(row_id)
+            results.append(parents.get(row_id, chunk))
+            if len(results) == k:
+                break
+        return results
+    
+    def _watch_loop(self, interval):
+        """
+        Vòng lặp của luồng theo dõi vector store
+        """
+        while not self._stop_event.wait(interval):
+            try:
+                if self.shard_manager is not None:
+                    self.shard_manager.sync_with_directory()
+                else:
+                    self.reload_if_changed()
+            except Exception as e:
+                logger.error(f"Lỗi khi tải lại vector store: {e}")
+    
+    def _prune_versions(self, keep=VECTOR_DB_KEEP_VERSIONS):
+        """
+        Xóa các phiên bản vector store cũ, giữ lại `keep` phiên bản mới nhất
+        
+        Args:
+            keep (int): Số phiên bản được giữ lại
+        """
+        versions_root = os.path.join(self.vector_db_path, VERSIONS_DIR)
+        versions = sorted(os.listdir(versions_root))
+        for version in versions[:-keep] if keep > 0 else []:
+            if version == self.current_version:
+                continue
+            shutil.rmtree(os.path.join(versions_root, version), ignore_errors=True)
+            logger.info(f"Đã xóa phiên bản vector store cũ {version}")
+    
+    def load_shards(self, shards_dir=VECTOR_DB_SHARDS_DIR):
+        """
+        Tải các shard vector store để tìm kiếm song song trên nhiều kho dữ liệu
+        
+        Args:
+            shards_dir (str): Thư mục chứa các shard, mỗi thư mục con là một shard
+        
+        Returns:
+            ShardedIndexManager: Bộ quản lý shard, None nếu không có shard nào
+        """
+        if self.client is not None or self.batching:
+            # Shard được tải ở phía embedding server / bộ gom lô dùng chung
+            return None
+        
+        if self.embeddings is None:
+            self.load_embeddings()
+        
+        from src.sharded_index import ShardedIndexManager
+        self.shard_manager = ShardedIndexManager(self.embeddings, shards_dir=shards_dir)
+        self.shard_manager.sync_with_directory()
+        
+        # Vector store mặc định (nếu có) cũng được phục vụ như một shard
+        if os.path.exists(os.path.join(resolve_vector_db_path(self.vector_db_path), "index.faiss")):
+            self.shard_manager.add_shard("default", self.vector_db_path)
+        
+        if not self.shard_manager.list_shards():
+            logger.warning(f"Không tìm thấy shard nào trong {shards_dir}")
+            self.shard_manager = None
+            return None
+        
+        logger.info(f"Đã tải {len(self.shard_manager.list_shards())} shard: {self.shard_manager.list_shards()}")
+        # Quét lại thư mục shard ở luồng nền thay vì trên luồng trả lời
+        self.start_watcher(SHARD_RESCAN_INTERVAL)
+        return self.shard_manager
+    
     def similarity_search(self, query, k=3):
         """
         Tìm kiếm các document tương tự với câu hỏi
@@ -149,17 +584,204 @@ class EmbeddingSystem:
         Returns:
             list: Danh sách các document tương tự
         """
+        if self.client is not None:
+            try:
+                return self.client.search(query=query, k=k)[0]
+            except Exception as e:
+                logger.error(f"Lỗi khi tìm kiếm qua embedding server: {e}")
+                return []
+        
+        if self.shard_manager is not None:
+            return self.shard_manager.similarity_search(query, k=k)
+        
         if self.vector_store is None:
             self.load_vector_store()
             if self.vector_store is None:
                 logger.error("Không thể thực hiện tìm kiếm vì vector store chưa được tạo")
                 return []
         
+        # Giữ tham chiếu cục bộ để câu hỏi đang xử lý không bị ảnh hưởng khi vector store được thay thế
+        vector_store = self.vector_store
+        chunk_index = self.chunk_index if self.granularity != "document" else None
+        
         try:
-            logger.info(f"Tìm kiếm {k} documents tương tự cho câu hỏi: {query}")
-            results = self.vector_store.similarity_search(query, k=k)
-            logger.info(f"Đã tìm thấy {len(results)} kết quả")
+            hot_logger.info(f"Tìm kiếm {k} documents tương tự cho câu hỏi: {redact_query(query)}")
+            if chunk_index is not None:
+                results = self._search_chunks(chunk_index, self.embed_query(query), k)
+            else:
+                results = vector_store.similarity_search(query, k=k)
+            hot_logger.info(f"Đã tìm thấy {len(results)} kết quả")
             return results
         except Exception as e:
             logger.error(f"Lỗi khi tìm kiếm: {e}")
             return []
+    
+    def embed_query(self, query):
+        """
+        Encode một câu hỏi thành vector
+        
+        Args:
+            query (str): Câu hỏi
+        
+        Returns:
+            list: Vector embedding đã chuẩn hóa
+        """
+        if self.client is not None:
+            return self.client.embed(query)
+        if self.embeddings is None:
+            self.load_embeddings()
+        return self.embeddings.embed_query(query)
+    
+    def search_with_vector(self, query, k=3):
+        """
+        Encode câu hỏi và tìm kiếm, trả về cả vector để dùng lại ở các bước sau
+        
+        Ở chế độ client, cả hai bước được thực hiện trong một yêu cầu.
+        
+        Args:
+            query (str): Câu hỏi
+            k (int): Số lượng kết quả trả về
+        
+        Returns:
+            tuple: (docs, vector câu hỏi)
+        """
+        if self.client is not None:
+            return self.client.search(query=query, k=k)
+        query_vector = self.embed_query(query)
+        return self.similarity_search_by_vector(query_vector, k=k), query_vector
+    
+    def get_sentence_store(self):
+        """
+        Lấy embedding câu của vector store đang phục vụ
+        
+        Returns:
+            SentenceStore: Store hiện hành (của bộ gom lô dùng chung nếu đang dùng), có thể None
+        """
+        shared = getattr(self.client, "embedding_system", None)
+        if shared is not None:
+            return shared.sentence_store
+        return self.sentence_store
+    
+    def embed_documents(self, texts):
+        """
+        Encode nhiều câu trong một lần gọi mô hình
+        
+        Args:
+            texts (list): Danh sách câu
+        
+        Returns:
+            list: Danh sách vector embedding đã chuẩn hóa
+        """
+        if self.client is not None:
+            return [self.client.embed(text) for text in texts]
+        if self.embeddings is None:
+            self.load_embeddings()
+        return self.embeddings.embed_documents(list(texts))
+    
+    def similarity_search_by_vector(self, query_vector, k=3):
+        """
+        Tìm kiếm các document tương tự bằng vector đã encode sẵn
+        
+        Args:
+            query_vector (list): Vector câu hỏi
+            k (int): Số lượng kết quả trả về
+        
+        Returns:
+            list: Danh sách các document tương tự
+        """
+        if self.client is not None:
+            try:
+                return self.client.search(vector=query_vector, k=k)[0]
+            except Exception as e:
+                logger.error(f"Lỗi khi tìm kiếm theo vector qua embedding server: {e}")
+                return []
+        
+        if self.shard_manager is not None:
+            return self.shard_manager.similarity_search_by_vector(query_vector, k=k)
+        
+        if self.vector_store is None:
+            self.load_vector_store()
+            if self.vector_store is None:
+                logger.error("Không thể thực hiện tìm kiếm vì vector store chưa được tạo")
+                return []
+        
+        vector_store = self.vector_store
+        chunk_index = self.chunk_index if self.granularity != "document" else None
+        
+        try:
+            if chunk_index is not None:
+                results = self._search_chunks(chunk_index, query_vector, k)
+            else:
+                results = vector_store.similarity_search_by_vector(query_vector, k=k)
+            hot_logger.info(f"Đã tìm thấy {len(results)} kết quả theo vector")
+            return results
+        except Exception as e:
+            logger.error(f"Lỗi khi tìm kiếm theo vector: {e}")
+            return []
+    
+    def search_by_vectors(self, vectors, k=3):
+        """
+        Tìm kiếm cho nhiều vector đã encode sẵn bằng một lần gọi FAISS
+        
+        Lỗi không được bắt ở đây để nơi gọi (vd: bộ gom lô) trả lỗi về cho từng câu hỏi.
+        
+        Args:
+            vectors (np.ndarray): Ma trận vector câu hỏi, mỗi dòng một câu hỏi
+            k (int): Số lượng kết quả trả về cho mỗi vector
+        
+        Returns:
+            list: Danh sách (theo thứ tự vector) các danh sách document tương tự
+        """
+        if self.client is not None:
+            return [self.client.search(vector=vector, k=k)[0] for vector in vectors]
+        
+        vectors = np.asarray(vectors, dtype=np.float32)
+        
+        if self.shard_manager is not None:
+            return [self.shard_manager.similarity_search_by_vector(vector, k=k) for vector in vectors]
+        
+        if self.vector_store is None:
+            self.load_vector_store()
+            if self.vector_store is None:
+                raise RuntimeError("Vector store chưa được tạo")
+        
+        vector_store = self.vector_store
+        chunk_index = self.chunk_index if self.granularity != "document" else None
+        if chunk_index is not None:
+            return [self._search_chunks(chunk_index, vector, k) for vector in vectors]
+        
+        _, indices = vector_store.index.search(vectors, k)
+        results = []
+        for row in indices:
+            docs = []
+            for i in row:
+                if i == -1:
+                    continue
+                docs.append(vector_store.docstore.search(vector_store.index_to_docstore_id[i]))
+            results.append(docs)
+        return results
+    
+    def batch_similarity_search(self, queries, k=3):
+        """
+        Tìm kiếm cho nhiều câu hỏi cùng lúc: encode cả lô trong một lần gọi mô hình
+        và tìm kiếm bằng một lần gọi FAISS
+        
+        Args:
+            queries (list): Danh sách câu hỏi
+            k (int): Số lượng kết quả trả về cho mỗi câu hỏi
+        
+        Returns:
+            list: Danh sách (theo thứ tự câu hỏi) các danh sách document tương tự
+        """
+        if not queries:
+            return []
+        
+        try:
+            hot_logger.info(f"Tìm kiếm theo lô {len(queries)} câu hỏi, {k} documents mỗi câu")
+            if self.client is not None:
+                return self.client.search_batch(queries, k=k)
+            vectors = self.embed_documents(queries)
+            return self.search_by_vectors(vectors, k=k)
+        except Exception as e:
+            logger.error(f"Lỗi khi tìm kiếm theo lô: {e}")
+            return [[] for _ in queries]
@@ -0,0 +1,104 @@
+"""
+Module nhận diện câu hỏi trùng (gần như nguyên văn) với câu hỏi mẫu để trả lời trực tiếp không qua LLM
+"""
+import re
+import unicodedata
+from collections import Counter
+from difflib import SequenceMatcher
+
+from src.settings import get_settings
+
+# Từ phủ định / tình thái: câu hỏi khác nhau ở các từ này có nghĩa khác (vd: "có nên" / "không nên")
+POLARITY_TOKENS = {"không", "chưa", "đừng", "nên", "chẳng", "chả", "cấm", "phải"}
+# Từ xưng hô, từ đệm có thể thêm / bớt mà không đổi nghĩa câu hỏi
+FILLER_TOKENS = {
+    "tôi", "mình", "em", "anh", "bạn", "ạ", "à", "ơi", "nhé", "vậy", "thì", "là", "có", "thể",
+    "được", "rất", "lắm", "cho", "hỏi", "xin",
+}
+
+
+def normalize_text(text):
+    """
+    Chuẩn hóa văn bản để so khớp: NFC, viết thường, bỏ dấu câu và gộp khoảng trắng
+
+    Args:
+        text (str): Văn bản cần chuẩn hóa
+
+    Returns:
+        str: Văn bản đã chuẩn hóa
+    """
+    text = unicodedata.normalize("NFC", text or "").lower()
+    text = re.sub(r"[^\w\s]", " ", text)
+    return re.sub(r"\s+", " ", text).strip()
+
+
+class FAQMatcher:
+    """
+    So khớp câu hỏi của người dùng với trường `question` của document tìm được
+    """
+
+    def __init__(self, threshold=None):
+        """
+        Khởi tạo FAQMatcher
+
+        Args:
+            threshold (float, optional): Độ tương đồng tối thiểu (0-1) để coi là trùng câu hỏi mẫu,
+                mặc định lấy từ cấu hình runtime (faq_match_threshold)
+        """
+        self.threshold = threshold
+
+    def similarity(self, query, question):
+        """
+        Tính độ tương đồng giữa câu hỏi của người dùng và câu hỏi mẫu
+
+        So khớp theo từ (không theo ký tự). Độ tương đồng bằng 0 nếu hai câu khác nhau ở từ
+        phủ định / tình thái (POLARITY_TOKENS) hoặc có từ nội dung chỉ xuất hiện ở một bên,
+        vì câu trả lời mẫu được trả nguyên văn.
+
+        Args:
+            query (str): Câu hỏi của người dùng
+            question (str): Câu hỏi mẫu trong dữ liệu
+
+        Returns:
+            float: Độ tương đồng trong khoảng 0-1
+        """
+        a = normalize_text(query).split()
+        b = normalize_text(question).split()
+        if not a or not b:
+            return 0.0
+        if a == b:
+            return 1.0
+
+        polarity_a = Counter(token for token in a if token in POLARITY_TOKENS)
+        polarity_b = Counter(token for token in b if token in POLARITY_TOKENS)
+        if polarity_a != polarity_b:
+            return 0.0
+        if (set(a) ^ set(b)) - FILLER_TOKENS:
+            return 0.0
+        return SequenceMatcher(None, a, b, autojunk=False).ratio()
+
+    def match(self, query, docs):
+        """
+        Tìm câu trả lời mẫu nếu document đứng đầu có câu hỏi trùng với câu hỏi của người dùng
+
+        Args:
+            query (str): Câu hỏi của người dùng
+            docs (list): Danh sách document tìm được (đã sắp xếp theo độ liên quan)
+
+        Returns:
+            tuple: (câu trả lời mẫu, độ tương đồng), hoặc (None, độ tương đồng) nếu không khớp
+        """
+        if not docs:
+            return None, 0.0
+
+        metadata = docs[0].metadata
+        question = metadata.get("question")
+        answer = metadata.get("answer")
+        if not question or not answer:
+            return None, 0.0
+
+        score = self.similarity(query, question)
+        threshold = self.threshold if self.threshold is not None else get_settings().faq_match_threshold
+        if score >= threshold:
+            return answer, score
+        return None, score
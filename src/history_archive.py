@@ -0,0 +1,246 @@
+"""
+Module nén lịch sử hội thoại các ngày đã kết thúc thành Parquet phân vùng theo ngày và
+các truy vấn thống kê chỉ đọc những cột / phân vùng cần thiết
+"""
+import json
+import os
+import re
+import shutil
+from collections import Counter
+from datetime import datetime
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+from loguru import logger
+
+from src.config import HISTORY_FOLDER, HISTORY_ARCHIVE_FOLDER, HISTORY_ARCHIVE_DELETE_CSV
+
+_DAY_FILE = re.compile(r"^(\d{4}-\d{2}-\d{2})\.csv$")
+
+# Lược đồ của archive; session_id và role lặp lại nhiều nên được mã hóa từ điển
+ARCHIVE_SCHEMA = pa.schema([
+    ("timestamp", pa.timestamp("s")),
+    ("session_id", pa.dictionary(pa.int32(), pa.string())),
+    ("role", pa.dictionary(pa.int32(), pa.string())),
+    ("content", pa.string()),
+    ("sources", pa.list_(pa.string())),
+])
+PARTITIONING = ds.partitioning(pa.schema([("date", pa.string())]), flavor="hive")
+
+
+def _parse_sources(value):
+    if not isinstance(value, str) or not value:
+        return []
+    try:
+        return [str(item) for item in json.loads(value) if item]
+    except ValueError:
+        return []
+
+
+def _partition_path(archive_folder, date):
+    return os.path.join(archive_folder, f"date={date}")
+
+
+def compact_day(csv_path, date, archive_folder=HISTORY_ARCHIVE_FOLDER):
+    """
+    Chuyển file lịch sử CSV của một ngày thành một phân vùng Parquet
+
+    Phân vùng được ghi vào thư mục tạm rồi đổi tên, nên truy vấn đang chạy không bao giờ
+    đọc phải file ghi dở.
+
+    Args:
+        csv_path (str): File CSV của ngày
+        date (str): Ngày (YYYY-MM-DD)
+        archive_folder (str): Thư mục gốc của archive
+
+    Returns:
+        int: Số tin nhắn đã được nén
+    """
+    df = pd.read_csv(csv_path, dtype=str, keep_default_na=False)
+    if "body_id" in df.columns and (df["body_id"] != "").any():
+        from src.history_store import resolve_bodies
+        df = resolve_bodies(df, os.path.dirname(csv_path) or ".")
+    if "sources" not in df.columns:
+        df["sources"] = ""
+
+    table = pa.table({
+        "timestamp": pa.Array.from_pandas(
+            pd.to_datetime(df["timestamp"], errors="coerce").dt.floor("s"), type=pa.timestamp("s")
+        ),
+        "session_id": pa.array(df["session_id"], pa.string()).dictionary_encode(),
+        "role": pa.array(df["role"], pa.string()).dictionary_encode(),
+        "content": pa.array(df["content"], pa.string()),
+        "sources": pa.array([_parse_sources(value) for value in df["sources"]], pa.list_(pa.string())),
+    }, schema=ARCHIVE_SCHEMA)
+
+    final_path = _partition_path(archive_folder, date)
+    # Thư mục tạm bắt đầu bằng "_" nên bị bỏ qua khi quét dataset
+    tmp_path = os.path.join(archive_folder, f"_tmp-date={date}")
+    shutil.rmtree(tmp_path, ignore_errors=True)
+    os.makedirs(tmp_path)
+    pq.write_table(
+        table,
+        os.path.join(tmp_path, "part-0.parquet"),
+        compression="zstd",
+        use_dictionary=["session_id", "role"],
+    )
+    shutil.rmtree(final_path, ignore_errors=True)
+    os.replace(tmp_path, final_path)
+    return table.num_rows
+
+
+def compact_history(history_folder=HISTORY_FOLDER, archive_folder=HISTORY_ARCHIVE_FOLDER,
+                    today=None, delete_csv=HISTORY_ARCHIVE_DELETE_CSV):
+    """
+    Nén mọi ngày đã kết thúc (trước hôm nay) chưa có trong archive hoặc có CSV mới hơn archive
+
+    Args:
+        history_folder (str): Thư mục chứa các file CSV theo ngày
+        archive_folder (str): Thư mục gốc của archive Parquet
+        today (str, optional): Ngày hiện tại (YYYY-MM-DD), mặc định theo đồng hồ hệ thống
+        delete_csv (bool): Xóa file CSV sau khi nén thành công
+
+    Returns:
+        dict: Ánh xạ ngày -> số tin nhắn đã nén
+    """
+    today = today or datetime.now().strftime("%Y-%m-%d")
+    os.makedirs(archive_folder, exist_ok=True)
+
+    compacted = {}
+    for name in sorted(os.listdir(history_folder)):
+        match = _DAY_FILE.match(name)
+        if not match or match.group(1) >= today:
+            continue
+
+        date = match.group(1)
+        csv_path = os.path.join(history_folder, name)
+        part_path = os.path.join(_partition_path(archive_folder, date), "part-0.parquet")
+        if os.path.exists(part_path) and os.path.getmtime(part_path) >= os.path.getmtime(csv_path):
+            continue
+
+        try:
+            compacted[date] = compact_day(csv_path, date, archive_folder)
+            logger.info(f"Đã nén lịch sử ngày {date}: {compacted[date]} tin nhắn")
+            if delete_csv:
+                os.remove(csv_path)
+        except Exception as e:
+            logger.error(f"Lỗi khi nén lịch sử ngày {date}: {e}")
+
+    logger.info(f"Hoàn thành nén lịch sử: {len(compacted)} ngày")
+    return compacted
+
+
+class HistoryArchive:
+    """
+    Truy vấn thống kê trên archive Parquet; điều kiện ngày được đẩy xuống mức phân vùng
+    và chỉ những cột cần thiết được đọc
+    """
+
+    def __init__(self, archive_folder=HISTORY_ARCHIVE_FOLDER):
+        """
+        Khởi tạo HistoryArchive
+
+        Args:
+            archive_folder (str): Thư mục gốc của archive Parquet
+        """
+        self.archive_folder = archive_folder
+
+    def _read(self, columns, start=None, end=None, role=None):
+        """
+        Đọc các cột cần thiết trong khoảng ngày [start, end]
+
+        Args:
+            columns (list): Các cột cần đọc
+            start (str, optional): Ngày bắt đầu (YYYY-MM-DD)
+            end (str, optional): Ngày kết thúc (YYYY-MM-DD)
+            role (str, optional): Chỉ lấy tin nhắn của vai trò này
+
+        Returns:
+            pa.Table: Bảng kết quả
+        """
+        if not os.path.isdir(self.archive_folder):
+            return pa.table({column: [] for column in columns})
+
+        dataset = ds.dataset(self.archive_folder, format="parquet", partitioning=PARTITIONING,
+                             exclude_invalid_files=True)
+        condition = None
+        for expression in (
+            ds.field("date") >= start if start else None,
+            ds.field("date") <= end if end else None,
+            ds.field("role") == role if role else None,
+        ):
+            if expression is not None:
+                condition = expression if condition is None else condition & expression
+        return dataset.to_table(columns=columns, filter=condition)
+
+    def sessions_per_day(self, start=None, end=None):
+        """
+        Số session khác nhau mỗi ngày
+
+        Returns:
+            dict: Ánh xạ ngày -> số session
+        """
+        table = self._read(["date", "session_id"], start, end)
+        if table.num_rows == 0:
+            return {}
+        table = pa.table({
+            "date": table.column("date"),
+            "session_id": table.column("session_id").cast(pa.string()),
+        })
+        result = table.group_by("date").aggregate([("session_id", "count_distinct")])
+        return dict(sorted(zip(
+            result.column("date").to_pylist(),
+            result.column("session_id_count_distinct").to_pylist(),
+        )))
+
+    def messages_per_session(self, start=None, end=None):
+        """
+        Số tin nhắn của mỗi session
+
+        Returns:
+            dict: Ánh xạ session_id -> số tin nhắn
+        """
+        table = self._read(["session_id"], start, end)
+        if table.num_rows == 0:
+            return {}
+        counts = pc.value_counts(table.column("session_id").cast(pa.string()).combine_chunks())
+        return {
+            item["values"].as_py(): item["counts"].as_py()
+            for item in counts
+        }
+
+    def top_retrieved_docs(self, start=None, end=None, n=10):
+        """
+        Các document được dùng làm ngữ cảnh nhiều nhất
+
+        Returns:
+            list: Danh sách (câu hỏi của document, số lần) giảm dần theo số lần
+        """
+        table = self._read(["sources"], start, end, role="assistant")
+        if table.num_rows == 0:
+            return []
+        flattened = pc.list_flatten(table.column("sources"))
+        return Counter(flattened.to_pylist()).most_common(n)
+
+
+if __name__ == "__main__":
+    from src.logger import setup_logger
+
+    setup_logger()
+    compact_history()
+
+    archive = HistoryArchive()
+    print("Số session mỗi ngày:")
+    for date, count in archive.sessions_per_day().items():
+        print(f"  {date}: {count}")
+
+    lengths = list(archive.messages_per_session().values())
+    if lengths:
+        print(f"Số tin nhắn mỗi session: trung bình {sum(lengths) / len(lengths):.1f}, tối đa {max(lengths)}")
+
+    print("Các document được dùng nhiều nhất:")
+    for question, count in archive.top_retrieved_docs():
+        print(f"  {count:>5}  {question}")
@@ -1,6 +1,7 @@
 """
 Module quản lý lịch sử hội thoại
 """
+import json
 import os
 import uuid
 import pandas as pd
@@ -8,6 +9,10 @@ from datetime import datetime
 from pathlib import Path
 from loguru import logger
 
+from src.logger import hot_logger
+from src.history_writer import append_rows, get_history_writer
+
+
 class HistoryManager:
     """
     Quản lý lịch sử hội thoại và lưu trữ vào file CSV
@@ -20,8 +25,9 @@ class HistoryManager:
         Args:
             history_folder (str, optional): Thư mục lưu trữ lịch sử
         """
-        from src.config import HISTORY_FOLDER
+        from src.config import HISTORY_FOLDER, HISTORY_WRITE_BEHIND
         self.history_folder = history_folder or HISTORY_FOLDER
+        self.writer = get_history_writer() if HISTORY_WRITE_BEHIND else None
         self.session_id = str(uuid.uuid4())[:8]  # Tạo session ID ngắn
         # Sử dụng múi giờ hiện tại
         self.current_date = datetime.now().strftime("%Y-%m-%d")
@@ -32,38 +38,51 @@ class HistoryManager:
         
         logger.info(f"Khởi tạo HistoryManager với session ID: {self.session_id}")
     
-    def save_message(self, role, content):
+    def save_message(self, role, content, sources=None):
         """
         Lưu tin nhắn vào file CSV
         
+        Khi bật HISTORY_WRITE_BEHIND, tin nhắn chỉ được đưa vào hàng đợi và được
+        HistoryWriter ghi ở luồng nền, không chặn luồng trả lời.
+        
         Args:
             role (str): Vai trò (user hoặc assistant)
             content (str): Nội dung tin nhắn
+            sources (list, optional): Câu hỏi của các document đã dùng làm ngữ cảnh
         """
-        # Tạo DataFrame cho tin nhắn mới với múi giờ hiện tại
-        new_data = pd.DataFrame({
-            'timestamp': [datetime.now().strftime("%Y-%m-%d %H:%M:%S")],
-            'session_id': [self.session_id],
-            'role': [role],
-            'content': [content]
-        })
+        # Tạo dòng dữ liệu cho tin nhắn mới với múi giờ hiện tại
+        row = {
+            'timestamp': datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+            'session_id': self.session_id,
+            'role': role,
+            'content': content,
+            'sources': json.dumps(sources, ensure_ascii=False) if sources else '',
+            # Được điền khi ghi nếu nội dung được chuyển vào BodyStore (HISTORY_DEDUP)
+            'body_id': ''
+        }
         
         try:
-            # Kiểm tra file đã tồn tại chưa
-            if os.path.exists(self.history_file):
-                # Đọc file hiện tại và thêm dữ liệu mới
-                existing_data = pd.read_csv(self.history_file)
-                updated_data = pd.concat([existing_data, new_data], ignore_index=True)
+            if self.writer is not None:
+                self.writer.submit(self.history_file, row)
+                hot_logger.debug(f"Đã đưa tin nhắn của {role} vào hàng đợi ghi lịch sử")
             else:
-                updated_data = new_data
-            
-            # Lưu vào file CSV
-            updated_data.to_csv(self.history_file, index=False)
-            logger.info(f"Đã lưu tin nhắn của {role} vào {self.history_file}")
+                # Ghi nối vào cuối file CSV
+                append_rows(self.history_file, [row])
+                hot_logger.info(f"Đã lưu tin nhắn của {role} vào {self.history_file}")
         
         except Exception as e:
             logger.error(f"Lỗi khi lưu tin nhắn vào file CSV: {e}")
     
+    def flush(self, history_file=None):
+        """
+        Chờ các tin nhắn đã đưa vào hàng đợi của một file lịch sử được ghi xuống file CSV
+        
+        Args:
+            history_file (str, optional): File lịch sử cần đọc, mặc định file của ngày hiện tại
+        """
+        if self.writer is not None:
+            self.writer.flush(history_file or self.history_file)
+    
     def get_session_history(self, session_id=None):
         """
         Lấy lịch sử hội thoại của một session
@@ -77,21 +96,21 @@ class HistoryManager:
         if session_id is None:
             session_id = self.session_id
         
+        # Đảm bảo đọc được cả những tin nhắn vừa ghi
+        self.flush()
+        
         try:
             if os.path.exists(self.history_file):
-                data = pd.read_csv(self.history_file)
+                data = pd.read_csv(self.history_file, dtype=str, keep_default_na=False)
                 session_data = data[data['session_id'] == session_id]
                 
-                # Chuyển đổi thành danh sách tin nhắn
-                messages = []
-                for _, row in session_data.iterrows():
-                    messages.append({
-                        'timestamp': row['timestamp'],
-                        'role': row['role'],
-                        'content': row['content']
-                    })
+                # Nội dung được lưu theo mã trong BodyStore được điền lại
+                if 'body_id' in session_data.columns and (session_data['body_id'] != '').any():
+                    from src.history_store import resolve_bodies
+                    session_data = resolve_bodies(session_data, self.history_folder)
                 
-                return messages
+                # Chuyển đổi thành danh sách tin nhắn
+                return session_data[['timestamp', 'role', 'content']].to_dict('records')
             else:
                 return []
         
@@ -113,6 +132,7 @@ class HistoryManager:
             date = self.current_date
         
         history_file = os.path.join(self.history_folder, f"{date}.csv")
+        self.flush(history_file)
         
         try:
             if os.path.exists(history_file):
@@ -135,3 +155,17 @@ class HistoryManager:
         self.session_id = str(uuid.uuid4())[:8]
         logger.info(f"Đã tạo session mới với ID: {self.session_id}")
         return self.session_id
+    
+    def resume_session(self, session_id):
+        """
+        Tiếp tục một session đã có (vd: sau khi khởi động lại hoặc chuyển worker)
+        
+        Args:
+            session_id (str): ID của session cần tiếp tục
+        
+        Returns:
+            str: ID của session
+        """
+        self.session_id = session_id
+        logger.info(f"Tiếp tục session với ID: {self.session_id}")
+        return self.session_id
@@ -0,0 +1,289 @@
+"""
+Module lưu nội dung tin nhắn theo địa chỉ nội dung (content-addressed): mỗi nội dung chỉ được lưu
+một lần (nén zstd) và các dòng lịch sử chỉ giữ mã của nội dung
+"""
+import hashlib
+import os
+import re
+import sqlite3
+import threading
+from pathlib import Path
+
+import pandas as pd
+import zstandard
+from loguru import logger
+
+from src.config import HISTORY_FOLDER, HISTORY_DEDUP_MIN_CHARS, HISTORY_BODY_ZSTD_LEVEL
+
+BODY_STORE_FILENAME = "bodies.sqlite3"
+
+_DAY_FILE = re.compile(r"^\d{4}-\d{2}-\d{2}\.csv$")
+_stores = {}
+_stores_lock = threading.Lock()
+
+
+def body_id(text):
+    """
+    Mã của một nội dung (SHA-256 rút gọn của văn bản UTF-8)
+
+    Args:
+        text (str): Nội dung tin nhắn
+
+    Returns:
+        str: Mã nội dung (32 ký tự hex)
+    """
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()[:32]
+
+
+class BodyStore:
+    """
+    Bảng băm các nội dung tin nhắn duy nhất trong SQLite, nội dung được nén zstd
+    """
+
+    def __init__(self, db_path, level=HISTORY_BODY_ZSTD_LEVEL):
+        """
+        Khởi tạo BodyStore
+
+        Args:
+            db_path (str): Đường dẫn file SQLite
+            level (int): Mức nén zstd
+        """
+        Path(db_path).parent.mkdir(exist_ok=True, parents=True)
+        self.db_path = db_path
+        self.level = level
+        self._local = threading.local()
+        # Các mã đã có trong store, tránh nén lại nội dung lặp lại
+        self._known = set()
+
+        conn = self._connect()
+        conn.executescript("""
+            CREATE TABLE IF NOT EXISTS history_bodies (
+                body_id TEXT PRIMARY KEY,
+                data BLOB NOT NULL,
+                raw_size INTEGER NOT NULL,
+                stored_size INTEGER NOT NULL,
+                refs INTEGER NOT NULL DEFAULT 0
+            );
+        """)
+        conn.commit()
+        logger.info(f"Khởi tạo BodyStore tại {db_path}")
+
+    def _connect(self):
+        """
+        Lấy kết nối SQLite và bộ nén / giải nén zstd riêng cho luồng hiện tại
+        """
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, timeout=10)
+            conn.execute("PRAGMA journal_mode=WAL")
+            self._local.conn = conn
+            self._local.compressor = zstandard.ZstdCompressor(level=self.level)
+            self._local.decompressor = zstandard.ZstdDecompressor()
+        return conn
+
+    def put_many(self, texts):
+        """
+        Lưu các nội dung (mỗi nội dung duy nhất chỉ được nén và lưu một lần)
+
+        Args:
+            texts (list): Danh sách nội dung
+
+        Returns:
+            list: Mã của từng nội dung, theo thứ tự đầu vào
+        """
+        conn = self._connect()
+        ids = [body_id(text) for text in texts]
+        new_rows = {}
+        refs = {}
+        for text, key in zip(texts, ids):
+            refs[key] = refs.get(key, 0) + 1
+            if key not in self._known and key not in new_rows:
+                raw = text.encode("utf-8")
+                data = self._local.compressor.compress(raw)
+                new_rows[key] = (key, data, len(raw), len(data))
+
+        with conn:
+            if new_rows:
+                conn.executemany(
+                    "INSERT OR IGNORE INTO history_bodies (body_id, data, raw_size, stored_size) "
+                    "VALUES (?, ?, ?, ?)",
+                    list(new_rows.values())
+                )
+            conn.executemany(
+                "UPDATE history_bodies SET refs = refs + ? WHERE body_id = ?",
+                [(count, key) for key, count in refs.items()]
+            )
+        self._known.update(new_rows)
+        return ids
+
+    def get_many(self, ids):
+        """
+        Lấy lại nội dung theo mã
+
+        Args:
+            ids (iterable): Các mã nội dung
+
+        Returns:
+            dict: Ánh xạ mã -> nội dung (bỏ qua mã không tồn tại)
+        """
+        conn = self._connect()
+        ids = list(dict.fromkeys(ids))
+        bodies = {}
+        for i in range(0, len(ids), 500):
+            part = ids[i:i + 500]
+            rows = conn.execute(
+                f"SELECT body_id, data FROM history_bodies WHERE body_id IN ({','.join('?' * len(part))})",
+                part
+            ).fetchall()
+            for key, data in rows:
+                bodies[key] = self._local.decompressor.decompress(data).decode("utf-8")
+        return bodies
+
+    def stats(self):
+        """
+        Thống kê của store
+
+        Returns:
+            dict: Số nội dung duy nhất, số lượt tham chiếu, tổng byte gốc / sau nén và
+                tổng byte nếu mỗi lượt tham chiếu lưu nguyên văn
+        """
+        row = self._connect().execute(
+            "SELECT COUNT(*), COALESCE(SUM(refs), 0), COALESCE(SUM(raw_size), 0), "
+            "COALESCE(SUM(stored_size), 0), COALESCE(SUM(raw_size * refs), 0) FROM history_bodies"
+        ).fetchone()
+        return {
+            "unique_bodies": row[0],
+            "references": row[1],
+            "unique_raw_bytes": row[2],
+            "stored_bytes": row[3],
+            "referenced_raw_bytes": row[4],
+        }
+
+
+def get_body_store(history_folder=HISTORY_FOLDER):
+    """
+    Lấy BodyStore dùng chung của một thư mục lịch sử
+
+    Args:
+        history_folder (str): Thư mục lịch sử
+
+    Returns:
+        BodyStore: Store của thư mục
+    """
+    db_path = os.path.abspath(os.path.join(history_folder, BODY_STORE_FILENAME))
+    store = _stores.get(db_path)
+    if store is None:
+        with _stores_lock:
+            store = _stores.get(db_path)
+            if store is None:
+                store = _stores[db_path] = BodyStore(db_path)
+    return store
+
+
+def externalize_bodies(rows, history_folder, min_chars=HISTORY_DEDUP_MIN_CHARS):
+    """
+    Chuyển nội dung đủ dài của các dòng lịch sử vào BodyStore, dòng chỉ giữ `body_id`
+
+    Args:
+        rows (list): Các dòng lịch sử (dict có content và body_id)
+        history_folder (str): Thư mục lịch sử chứa store
+        min_chars (int): Nội dung ngắn hơn được giữ nguyên trong dòng
+
+    Returns:
+        list: Các dòng sau khi chuyển (dòng gốc không bị sửa)
+    """
+    indices = [
+        i for i, row in enumerate(rows)
+        if not row.get("body_id") and len(row.get("content") or "") >= min_chars
+    ]
+    if not indices:
+        return rows
+
+    ids = get_body_store(history_folder).put_many([rows[i]["content"] for i in indices])
+    rows = list(rows)
+    for i, key in zip(indices, ids):
+        rows[i] = {**rows[i], "content": "", "body_id": key}
+    return rows
+
+
+def resolve_bodies(df, history_folder):
+    """
+    Điền lại nội dung cho các dòng lịch sử chỉ giữ `body_id`
+
+    Args:
+        df (pd.DataFrame): Dữ liệu lịch sử (đọc với dtype=str, keep_default_na=False)
+        history_folder (str): Thư mục lịch sử chứa store
+
+    Returns:
+        pd.DataFrame: Dữ liệu có cột content đầy đủ
+    """
+    if "body_id" not in df.columns:
+        return df
+    referenced = df["body_id"] != ""
+    if not referenced.any():
+        return df
+
+    bodies = get_body_store(history_folder).get_many(df.loc[referenced, "body_id"].unique())
+    df = df.copy()
+    df.loc[referenced, "content"] = df.loc[referenced, "body_id"].map(bodies).fillna("")
+    return df
+
+
+def space_report(history_folder=HISTORY_FOLDER):
+    """
+    Thống kê dung lượng tiết kiệm được nhờ lưu nội dung theo địa chỉ nội dung
+
+    Args:
+        history_folder (str): Thư mục lịch sử
+
+    Returns:
+        dict: Số tin nhắn, số dòng tham chiếu, số nội dung duy nhất, dung lượng hiện tại và
+            dung lượng ước tính nếu lưu nguyên văn mọi tin nhắn
+    """
+    csv_bytes = 0
+    messages = 0
+    referenced_rows = 0
+    for name in os.listdir(history_folder):
+        if not _DAY_FILE.match(name):
+            continue
+        path = os.path.join(history_folder, name)
+        csv_bytes += os.path.getsize(path)
+        df = pd.read_csv(path, dtype=str, keep_default_na=False)
+        messages += len(df)
+        if "body_id" in df.columns:
+            referenced_rows += int((df["body_id"] != "").sum())
+
+    db_path = os.path.join(history_folder, BODY_STORE_FILENAME)
+    stats = get_body_store(history_folder).stats() if os.path.exists(db_path) else {
+        "unique_bodies": 0, "references": 0, "unique_raw_bytes": 0, "stored_bytes": 0,
+        "referenced_raw_bytes": 0,
+    }
+    store_bytes = sum(
+        os.path.getsize(db_path + suffix)
+        for suffix in ("", "-wal") if os.path.exists(db_path + suffix)
+    )
+
+    # Nếu không dùng store, mỗi dòng tham chiếu chứa lại nội dung thay cho mã 32 ký tự
+    inline_bytes = csv_bytes + stats["referenced_raw_bytes"] - 32 * stats["references"]
+    current_bytes = csv_bytes + store_bytes
+    return {
+        "messages": messages,
+        "referenced_rows": referenced_rows,
+        **stats,
+        "csv_bytes": csv_bytes,
+        "store_bytes": store_bytes,
+        "inline_bytes": inline_bytes,
+        "current_bytes": current_bytes,
+        "saved_bytes": inline_bytes - current_bytes,
+        "saved_ratio": round(1 - current_bytes / inline_bytes, 3) if inline_bytes > 0 else 0.0,
+    }
+
+
+if __name__ == "__main__":
+    from src.logger import setup_logger
+
+    setup_logger()
+    report = space_report()
+    logger.info(f"Báo cáo dung lượng lịch sử: {report}")
+    for key, value in report.items():
+        print(f"{key}: {value}")
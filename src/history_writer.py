@@ -0,0 +1,285 @@
+"""
+Module ghi lịch sử hội thoại ở luồng nền (write-behind) để không chặn luồng trả lời
+"""
+import atexit
+import os
+import queue
+import threading
+import time
+
+import pandas as pd
+from loguru import logger
+
+from src.config import (
+    HISTORY_QUEUE_SIZE, HISTORY_BATCH_SIZE,
+    HISTORY_FLUSH_INTERVAL, HISTORY_ENQUEUE_TIMEOUT, HISTORY_WRITE_RETRIES, HISTORY_DEDUP
+)
+from src.metrics import metrics
+
+# Tránh hai luồng ghi nối xen kẽ vào cùng một file
+_append_lock = threading.Lock()
+# Các (file, cột) đã cảnh báo bị bỏ khi ghi vào file có header cũ
+_dropped_warned = set()
+
+
+def append_rows(history_file, rows):
+    """
+    Ghi nối các dòng lịch sử vào cuối file CSV (không đọc lại toàn bộ file)
+
+    Khi bật HISTORY_DEDUP, nội dung đủ dài được lưu một lần trong BodyStore của thư mục
+    lịch sử và dòng chỉ giữ `body_id` (trừ file tạo trước khi có cột này).
+
+    Args:
+        history_file (str): Đường dẫn file CSV
+        rows (list): Danh sách dict gồm timestamp, session_id, role, content, sources, body_id
+    """
+    with _append_lock:
+        write_header = not os.path.exists(history_file)
+        header = None
+        if not write_header:
+            with open(history_file, encoding="utf-8") as f:
+                header = f.readline().strip().split(",")
+
+        if HISTORY_DEDUP and (header is None or "body_id" in header):
+            from src.history_store import externalize_bodies
+            rows = externalize_bodies(rows, os.path.dirname(history_file) or ".")
+
+        df = pd.DataFrame(rows)
+        if header is not None:
+            # Giữ đúng thứ tự cột của file đã có (file tạo trước khi thêm cột mới không có cột đó)
+            dropped = [column for column in df.columns if column not in header and df[column].notna().any()]
+            if dropped:
+                metrics.increment("history_writer.dropped_columns", len(rows))
+                key = (history_file, tuple(dropped))
+                if key not in _dropped_warned:
+                    _dropped_warned.add(key)
+                    logger.warning(
+                        f"File lịch sử {history_file} có header cũ không có cột {dropped}, "
+                        f"dữ liệu các cột này không được ghi"
+                    )
+            df = df.reindex(columns=header)
+        df.to_csv(history_file, mode="a", header=write_header, index=False)
+
+
+class HistoryWriter:
+    """
+    Luồng nền nhận tin nhắn qua hàng đợi có giới hạn và ghi theo lô vào file CSV
+    """
+
+    def __init__(self, max_queue_size=HISTORY_QUEUE_SIZE, batch_size=HISTORY_BATCH_SIZE,
+                 flush_interval=HISTORY_FLUSH_INTERVAL, enqueue_timeout=HISTORY_ENQUEUE_TIMEOUT,
+                 write_retries=HISTORY_WRITE_RETRIES):
+        """
+        Khởi tạo HistoryWriter
+
+        Args:
+            max_queue_size (int): Số tin nhắn tối đa trong hàng đợi trước khi áp dụng backpressure
+            batch_size (int): Số tin nhắn tối đa trong một lần ghi
+            flush_interval (float): Thời gian (giây) tối đa chờ gom lô trước khi ghi
+            enqueue_timeout (float): Thời gian (giây) tối đa người gọi bị chặn khi hàng đợi đầy
+            write_retries (int): Số lần ghi lại một file khi ghi lỗi
+        """
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.enqueue_timeout = enqueue_timeout
+        self.write_retries = max(0, write_retries)
+        self.queue = queue.Queue(maxsize=max_queue_size)
+        # Số tin nhắn đã nhận / đã xử lý theo từng file, để flush chỉ chờ các tin nhắn của file
+        # cần đọc đã được đưa vào trước đó thay vì chờ cả hàng đợi trống
+        self._progress = threading.Condition()
+        self._submitted = {}
+        self._written = {}
+        self._failed = {}
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="history-writer", daemon=True)
+        self._thread.start()
+
+        logger.info(f"Khởi tạo HistoryWriter (queue={max_queue_size}, batch={batch_size})")
+
+    def submit(self, history_file, row):
+        """
+        Đưa một tin nhắn vào hàng đợi ghi
+
+        Khi hàng đợi đầy, người gọi bị chặn tối đa `enqueue_timeout` giây (backpressure).
+        Nếu vẫn đầy, người gọi chờ các tin nhắn đã đưa vào trước đó của cùng file được ghi
+        (giữ đúng thứ tự các dòng) rồi tự ghi tin nhắn này (metrics `history_writer.sync_writes`).
+
+        Args:
+            history_file (str): Đường dẫn file CSV
+            row (dict): Dòng lịch sử cần ghi
+        """
+        if self._stopped.is_set():
+            append_rows(history_file, [row])
+            return
+
+        try:
+            self.queue.put((history_file, row), timeout=self.enqueue_timeout)
+        except queue.Full:
+            metrics.increment("history_writer.sync_writes")
+            logger.warning(f"Hàng đợi ghi lịch sử đầy sau {self.enqueue_timeout}s, ghi trực tiếp vào {history_file}")
+            self.flush(history_file)
+            append_rows(history_file, [row])
+            return
+        with self._progress:
+            self._submitted[history_file] = self._submitted.get(history_file, 0) + 1
+        metrics.set_gauge("history_writer.queue_depth", self.queue.qsize())
+
+    def flush(self, history_file=None, timeout=None):
+        """
+        Chờ cho đến khi các tin nhắn đã đưa vào hàng đợi trước lời gọi này được ghi xuống đĩa
+
+        Tin nhắn được đưa vào sau khi bắt đầu chờ không làm người gọi phải chờ thêm.
+
+        Args:
+            history_file (str, optional): Chỉ chờ tin nhắn của file này, mặc định mọi file
+            timeout (float, optional): Thời gian chờ tối đa (giây)
+
+        Returns:
+            bool: True nếu các tin nhắn đó đã được ghi hết, False nếu hết thời gian chờ hoặc có
+                tin nhắn của file không ghi được
+        """
+        if not self._thread.is_alive():
+            self._drain()
+
+        with self._progress:
+            if history_file is None:
+                targets = dict(self._submitted)
+            else:
+                targets = {history_file: self._submitted.get(history_file, 0)}
+            self._progress.wait_for(
+                lambda: all(
+                    self._written.get(name, 0) + self._failed.get(name, 0) >= count
+                    for name, count in targets.items()
+                ),
+                timeout=timeout
+            )
+            return all(self._written.get(name, 0) >= count for name, count in targets.items())
+
+    def close(self, timeout=5):
+        """
+        Ghi nốt các tin nhắn còn lại và dừng luồng nền
+
+        Args:
+            timeout (float): Thời gian chờ tối đa (giây)
+        """
+        if self._stopped.is_set():
+            return
+        self.flush(timeout=timeout)
+        self._stopped.set()
+        self._thread.join(timeout=timeout)
+        # Ghi nốt những gì còn sót lại nếu luồng nền không kịp xử lý
+        self._drain()
+        logger.info("Đã dừng HistoryWriter")
+
+    def _run(self):
+        """
+        Vòng lặp của luồng nền: gom lô tin nhắn rồi ghi theo từng file
+        """
+        while not self._stopped.is_set():
+            try:
+                first = self.queue.get(timeout=self.flush_interval)
+            except queue.Empty:
+                continue
+
+            batch = [first]
+            deadline = time.monotonic() + self.flush_interval
+            while len(batch) < self.batch_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(self.queue.get(timeout=remaining))
+                except queue.Empty:
+                    break
+
+            self._write_batch(batch)
+
+    def _drain(self):
+        """
+        Ghi đồng bộ toàn bộ tin nhắn còn trong hàng đợi
+        """
+        batch = []
+        while True:
+            try:
+                batch.append(self.queue.get_nowait())
+            except queue.Empty:
+                break
+        if batch:
+            self._write_batch(batch)
+
+    def _write_batch(self, batch):
+        """
+        Ghi một lô tin nhắn, gom theo file đích; mỗi file được ghi (và ghi lại khi lỗi) riêng,
+        nên một file lỗi không làm mất tin nhắn của các file khác
+
+        Args:
+            batch (list): Danh sách tuple (history_file, row)
+        """
+        start = time.perf_counter()
+        rows_by_file = {}
+        for history_file, row in batch:
+            rows_by_file.setdefault(history_file, []).append(row)
+
+        written = {}
+        failed = {}
+        for history_file, rows in rows_by_file.items():
+            if self._write_file(history_file, rows):
+                written[history_file] = len(rows)
+            else:
+                failed[history_file] = len(rows)
+
+        for _ in batch:
+            self.queue.task_done()
+        with self._progress:
+            for history_file, count in written.items():
+                self._written[history_file] = self._written.get(history_file, 0) + count
+            for history_file, count in failed.items():
+                self._failed[history_file] = self._failed.get(history_file, 0) + count
+            self._progress.notify_all()
+
+        if written:
+            metrics.increment("history_writer.rows_written", sum(written.values()))
+            logger.debug(f"Đã ghi {sum(written.values())} tin nhắn vào {len(written)} file lịch sử")
+        metrics.observe("history_writer.flush_ms", (time.perf_counter() - start) * 1000)
+        metrics.set_gauge("history_writer.queue_depth", self.queue.qsize())
+
+    def _write_file(self, history_file, rows):
+        """
+        Ghi các tin nhắn của một file, thử lại tối đa `write_retries` lần khi lỗi
+
+        Returns:
+            bool: True nếu ghi thành công
+        """
+        for attempt in range(self.write_retries + 1):
+            try:
+                append_rows(history_file, rows)
+                return True
+            except Exception as e:
+                metrics.increment("history_writer.errors")
+                if attempt < self.write_retries:
+                    logger.warning(f"Lỗi khi ghi lịch sử vào {history_file} (lần {attempt + 1}), thử lại: {e}")
+                    time.sleep(0.05 * (attempt + 1))
+                else:
+                    metrics.increment("history_writer.failed_rows", len(rows))
+                    logger.error(f"Không ghi được {len(rows)} tin nhắn vào {history_file}: {e}")
+        return False
+
+
+_writer = None
+_writer_lock = threading.Lock()
+
+
+def get_history_writer():
+    """
+    Lấy HistoryWriter dùng chung cho toàn bộ tiến trình, khởi tạo khi cần
+
+    Returns:
+        HistoryWriter: Writer dùng chung
+    """
+    global _writer
+    if _writer is None:
+        with _writer_lock:
+            if _writer is None:
+                _writer = HistoryWriter()
+                atexit.register(_writer.close)
+    return _writer
@@ -7,9 +7,14 @@ from litellm import completion
 from langchain_core.prompts import PromptTemplate
 from langchain_core.output_parsers import StrOutputParser
 
+from src.logger import hot_logger, redact_query
 from src.config import GROQ_API_KEY, LLM_MODEL
+from src.settings import get_settings
 
 
+# Câu trả lời khi không gọi được LLM
+ERROR_RESPONSE = "Xin lỗi, tôi không thể trả lời câu hỏi của bạn lúc này. Vui lòng thử lại sau."
+
 # Thiết lập API key
 os.environ["GROQ_API_KEY"] = GROQ_API_KEY
 
@@ -27,6 +32,8 @@ class LLMSystem:
             model_name (str): Tên mô hình LLM
         """
         self.model_name = model_name
+        # Template được tạo một lần, không tạo lại cho mỗi câu hỏi
+        self.prompt_template = self.create_prompt_template()
         logger.info(f"Khởi tạo LLMSystem với mô hình {model_name}")
         
         # Kiểm tra API key
@@ -73,34 +80,34 @@ Trả lời:"""
             str: Câu trả lời từ LLM
         """
         try:
-            logger.info(f"Tạo câu trả lời cho câu hỏi: {question}")
+            hot_logger.info(f"Tạo câu trả lời cho câu hỏi: {redact_query(question)}")
             
             # Tạo prompt
-            prompt_template = self.create_prompt_template()
-            prompt = prompt_template.format(
+            prompt = self.prompt_template.format(
                 context=context,
                 question=question,
                 chat_history=chat_history
             )
             
             # Gọi API LLM
+            settings = get_settings()
             response = completion(
                 model="groq/" + self.model_name,
                 messages=[{"role": "user", "content": prompt}],
-                temperature=0.7,
-                max_tokens=1024
+                temperature=settings.llm_temperature,
+                max_tokens=settings.llm_max_tokens
             )
             
             # Xử lý kết quả
             answer = response.choices[0].message.content
-            logger.info("Đã tạo câu trả lời thành công")
+            hot_logger.info("Đã tạo câu trả lời thành công")
             
             return answer
         except Exception as e:
             logger.error(f"Lỗi khi tạo câu trả lời: {e}")
-            return "Xin lỗi, tôi không thể trả lời câu hỏi của bạn lúc này. Vui lòng thử lại sau."
+            return ERROR_RESPONSE
             
-    def generate_response_stream(self, question, context, chat_history=""):
+    def generate_response_stream(self, question, context, chat_history="", answer_prefix=""):
         """
         Tạo câu trả lời từ LLM theo kiểu streaming
         
@@ -108,27 +115,33 @@ Trả lời:"""
             question (str): Câu hỏi của người dùng
             context (str): Ngữ cảnh từ vector database
             chat_history (str, optional): Lịch sử hội thoại
+            answer_prefix (str, optional): Phần mở đầu đã gửi cho người dùng, LLM viết tiếp
+                từ phần này (không lặp lại trong kết quả)
         
         Returns:
             generator: Generator trả về từng phần của câu trả lời
         """
         try:
-            logger.info(f"Tạo câu trả lời streaming cho câu hỏi: {question}")
+            hot_logger.info(f"Tạo câu trả lời streaming cho câu hỏi: {redact_query(question)}")
             
             # Tạo prompt
-            prompt_template = self.create_prompt_template()
-            prompt = prompt_template.format(
+            prompt = self.prompt_template.format(
                 context=context,
                 question=question,
                 chat_history=chat_history
             )
+            messages = [{"role": "user", "content": prompt}]
+            if answer_prefix:
+                # Điền sẵn phần mở đầu của câu trả lời để LLM viết tiếp
+                messages.append({"role": "assistant", "content": answer_prefix})
             
             # Gọi API LLM với stream=True
+            settings = get_settings()
             response = completion(
                 model="groq/" + self.model_name,
-                messages=[{"role": "user", "content": prompt}],
-                temperature=0.7,
-                max_tokens=1024,
+                messages=messages,
+                temperature=settings.llm_temperature,
+                max_tokens=settings.llm_max_tokens,
                 stream=True
             )
             
@@ -140,7 +153,7 @@ Trả lời:"""
                         if content:
                             yield content
             
-            logger.info("Đã hoàn thành streaming câu trả lời")
+            hot_logger.info("Đã hoàn thành streaming câu trả lời")
         except Exception as e:
             logger.error(f"Lỗi khi tạo câu trả lời streaming: {e}")
-            yield "Xin lỗi, tôi không thể trả lời câu hỏi của bạn lúc này. Vui lòng thử lại sau."
+            yield ERROR_RESPONSE
@@ -0,0 +1,314 @@
+"""
+Module đo tải: mô phỏng nhiều quân nhân trò chuyện đồng thời với chatbot (LLM giả lập)
+để xác định số phiên một máy chủ phục vụ được trước khi thời gian tới token đầu tiên tăng
+"""
+import argparse
+import json
+import random
+import resource
+import tempfile
+import threading
+import time
+
+from loguru import logger
+
+from src.llm_system import LLMSystem, ERROR_RESPONSE
+from src.metrics import percentile
+from src.stream_buffer import ResponseBuffer
+
+# Câu hỏi nối tiếp dùng xen kẽ với câu hỏi trong bộ dữ liệu
+FOLLOW_UPS = [
+    "còn cách nào khác không?",
+    "vậy tôi nên làm gì tiếp theo?",
+    "điều đó có bình thường không?",
+    "bạn có thể nói cụ thể hơn không?",
+]
+
+
+class StubLLM(LLMSystem):
+    """
+    LLM giả lập chạy cục bộ: chờ một khoảng trước token đầu tiên rồi sinh token với tốc độ
+    cố định, không gọi API bên ngoài
+    """
+
+    def __init__(self, first_token_ms=300, tokens_per_second=50, reply_tokens=150):
+        """
+        Khởi tạo StubLLM
+
+        Args:
+            first_token_ms (float): Thời gian chờ trước token đầu tiên (ms)
+            tokens_per_second (float): Tốc độ sinh token sau token đầu tiên
+            reply_tokens (int): Số token của mỗi câu trả lời
+        """
+        self.model_name = "stub"
+        self.first_token_delay = first_token_ms / 1000.0
+        self.token_interval = 1.0 / tokens_per_second if tokens_per_second > 0 else 0.0
+        self.reply_tokens = reply_tokens
+
+    def _tokens(self, context):
+        words = context.split() or ["..."]
+        return [words[i % len(words)] + " " for i in range(self.reply_tokens)]
+
+    def generate_response(self, question, context, chat_history=""):
+        """
+        Sinh câu trả lời giả lập (chờ đủ thời gian của cả câu trả lời)
+        """
+        time.sleep(self.first_token_delay + self.token_interval * (self.reply_tokens - 1))
+        return "".join(self._tokens(context))
+
+    def generate_response_stream(self, question, context, chat_history="", answer_prefix=""):
+        """
+        Sinh câu trả lời giả lập theo kiểu streaming
+        """
+        time.sleep(self.first_token_delay)
+        for i, token in enumerate(self._tokens(context)):
+            if i:
+                time.sleep(self.token_interval)
+            yield token
+
+
+def is_error_reply(text):
+    """
+    Kiểm tra câu trả lời có phải câu xin lỗi thay cho lỗi không: RAGSystem, Chatbot và LLMSystem
+    bắt ngoại lệ và trả câu xin lỗi thay vì ném lỗi, nên lượt lỗi chỉ nhận ra được qua nội dung
+
+    Args:
+        text (str): Câu trả lời
+
+    Returns:
+        bool: True nếu lượt bị lỗi
+    """
+    from src.chatbot import MESSAGE_ERROR_RESPONSE
+    from src.rag_system import PROCESSING_ERROR_RESPONSE
+
+    return text in (ERROR_RESPONSE, PROCESSING_ERROR_RESPONSE, MESSAGE_ERROR_RESPONSE)
+
+
+def build_scripts(questions, users, turns, seed=0):
+    """
+    Tạo kịch bản hội thoại nhiều lượt cho từng người dùng ảo: lượt đầu là một câu hỏi trong
+    bộ dữ liệu, các lượt sau xen kẽ câu hỏi nối tiếp và câu hỏi mới
+
+    Args:
+        questions (list): Danh sách câu hỏi trong bộ dữ liệu
+        users (int): Số người dùng ảo
+        turns (int): Số lượt của mỗi hội thoại
+        seed (int): Hạt giống ngẫu nhiên để các lần chạy có cùng kịch bản
+
+    Returns:
+        list: Danh sách kịch bản (mỗi kịch bản là danh sách câu hỏi)
+    """
+    rng = random.Random(seed)
+    scripts = []
+    for _ in range(users):
+        script = [rng.choice(questions)]
+        for turn in range(1, turns):
+            script.append(rng.choice(FOLLOW_UPS) if turn % 2 else rng.choice(questions))
+        scripts.append(script)
+    return scripts
+
+
+def current_rss_mb():
+    """
+    Bộ nhớ RSS hiện tại của tiến trình (MB), dùng RSS lớn nhất nếu không đọc được /proc
+
+    Returns:
+        float: Dung lượng RSS (MB)
+    """
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return peak_rss_mb()
+
+
+def peak_rss_mb():
+    """
+    Bộ nhớ RSS lớn nhất từ lúc tiến trình khởi động (MB)
+
+    Returns:
+        float: Dung lượng RSS lớn nhất (MB)
+    """
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+class LoadTester:
+    """
+    Chạy các mức tải (số phiên đồng thời) và đo thông lượng, TTFT, độ trễ, RSS và CPU
+    """
+
+    def __init__(self, questions, llm_system=None, turns=4, think_time=0.5, seed=0, history_folder=None):
+        """
+        Khởi tạo LoadTester
+
+        Args:
+            questions (list): Danh sách câu hỏi dùng để tạo kịch bản
+            llm_system (LLMSystem, optional): LLM dùng khi đo, mặc định StubLLM
+            turns (int): Số lượt của mỗi hội thoại
+            think_time (float): Thời gian (giây) người dùng ảo nghỉ giữa hai lượt
+            seed (int): Hạt giống ngẫu nhiên của kịch bản
+            history_folder (str, optional): Thư mục ghi lịch sử khi đo, mặc định thư mục tạm
+                để không lẫn với lịch sử thật
+        """
+        self.questions = questions
+        self.llm_system = llm_system or StubLLM()
+        self.turns = turns
+        self.think_time = think_time
+        self.seed = seed
+        self.history_folder = history_folder or tempfile.mkdtemp(prefix="load-test-history-")
+
+    def _create_chatbot(self):
+        from src.chatbot import Chatbot
+
+        chatbot = Chatbot(history_folder=self.history_folder, llm_system=self.llm_system)
+        if not chatbot.setup():
+            raise RuntimeError("Không thể thiết lập chatbot, cần khởi tạo vector database trước")
+        return chatbot
+
+    def _run_user(self, chatbot, script, results, start_barrier):
+        """
+        Một người dùng ảo gửi lần lượt các câu hỏi trong kịch bản
+        """
+        start_barrier.wait()
+        for turn, message in enumerate(script):
+            if turn and self.think_time:
+                time.sleep(self.think_time)
+
+            buffer = ResponseBuffer()
+            submitted = time.perf_counter()
+            first_chunk = None
+            try:
+                for _ in chatbot.process_message_stream(message, buffer):
+                    if first_chunk is None:
+                        first_chunk = time.perf_counter()
+                error = is_error_reply(buffer.text())
+            except Exception as e:
+                logger.error(f"Lỗi của người dùng ảo ở lượt {turn}: {e}")
+                error = True
+            finished = time.perf_counter()
+
+            results.append({
+                "ttft_ms": ((first_chunk or finished) - submitted) * 1000,
+                "latency_ms": (finished - submitted) * 1000,
+                "chars": buffer.chars,
+                "error": error,
+            })
+
+    def run_level(self, sessions):
+        """
+        Chạy một mức tải: `sessions` người dùng ảo cùng bắt đầu hội thoại
+
+        Args:
+            sessions (int): Số phiên đồng thời
+
+        Returns:
+            dict: Thông lượng, phân vị TTFT / độ trễ, RSS và CPU của mức tải
+        """
+        rss_before = current_rss_mb()
+        chatbots = [self._create_chatbot() for _ in range(sessions)]
+        scripts = build_scripts(self.questions, sessions, self.turns, self.seed + sessions)
+
+        results = []
+        start_barrier = threading.Barrier(sessions + 1)
+        threads = [
+            threading.Thread(target=self._run_user, args=(chatbot, script, results, start_barrier),
+                             name=f"virtual-user-{i}", daemon=True)
+            for i, (chatbot, script) in enumerate(zip(chatbots, scripts))
+        ]
+        for thread in threads:
+            thread.start()
+
+        start_barrier.wait()
+        wall_start = time.perf_counter()
+        cpu_start = time.process_time()
+        for thread in threads:
+            thread.join()
+        wall = time.perf_counter() - wall_start
+        cpu = time.process_time() - cpu_start
+        rss_after = current_rss_mb()
+
+        for chatbot in chatbots:
+            chatbot.close()
+
+        ttft = sorted(result["ttft_ms"] for result in results)
+        latency = sorted(result["latency_ms"] for result in results)
+        report = {
+            "sessions": sessions,
+            "turns": len(results),
+            "errors": sum(result["error"] for result in results),
+            "throughput_tps": round(len(results) / wall, 2) if wall > 0 else 0.0,
+            "ttft_p50_ms": round(percentile(ttft, 50) or 0, 1),
+            "ttft_p95_ms": round(percentile(ttft, 95) or 0, 1),
+            "ttft_p99_ms": round(percentile(ttft, 99) or 0, 1),
+            "latency_p50_ms": round(percentile(latency, 50) or 0, 1),
+            "latency_p95_ms": round(percentile(latency, 95) or 0, 1),
+            "latency_p99_ms": round(percentile(latency, 99) or 0, 1),
+            "rss_mb": round(rss_after, 1),
+            "rss_per_session_mb": round((rss_after - rss_before) / sessions, 3),
+            "peak_rss_mb": round(peak_rss_mb(), 1),
+            "cpu_percent": round(cpu / wall * 100, 1) if wall > 0 else 0.0,
+        }
+        logger.info(f"Kết quả đo tải {sessions} phiên: {report}")
+        return report
+
+    def run(self, levels):
+        """
+        Chạy lần lượt các mức tải
+
+        Args:
+            levels (list): Danh sách số phiên đồng thời (vd: [1, 8, 32])
+
+        Returns:
+            list: Báo cáo của từng mức tải
+        """
+        return [self.run_level(sessions) for sessions in levels]
+
+
+def print_report(reports):
+    """
+    In bảng kết quả đo tải
+    """
+    columns = [
+        ("sessions", "phiên"), ("throughput_tps", "lượt/s"), ("ttft_p50_ms", "TTFT p50"),
+        ("ttft_p95_ms", "TTFT p95"), ("latency_p50_ms", "trễ p50"), ("latency_p95_ms", "trễ p95"),
+        ("rss_mb", "RSS MB"), ("rss_per_session_mb", "MB/phiên"), ("cpu_percent", "CPU %"),
+        ("errors", "lỗi"),
+    ]
+    print("  ".join(f"{title:>10}" for _, title in columns))
+    for report in reports:
+        print("  ".join(f"{report[key]:>10}" for key, _ in columns))
+
+
+if __name__ == "__main__":
+    from src.logger import setup_logger
+    from src.data_processor import DataProcessor
+
+    parser = argparse.ArgumentParser(description="Đo tải chatbot với nhiều phiên đồng thời (LLM giả lập)")
+    parser.add_argument("--sessions", default="1,4,16,32", help="Các mức số phiên đồng thời, cách nhau bởi dấu phẩy")
+    parser.add_argument("--turns", type=int, default=4, help="Số lượt của mỗi hội thoại")
+    parser.add_argument("--think-time", type=float, default=0.5, help="Thời gian nghỉ giữa hai lượt (giây)")
+    parser.add_argument("--first-token-ms", type=float, default=300, help="Độ trễ token đầu tiên của LLM giả lập (ms)")
+    parser.add_argument("--tokens-per-second", type=float, default=50, help="Tốc độ sinh token của LLM giả lập")
+    parser.add_argument("--reply-tokens", type=int, default=150, help="Số token mỗi câu trả lời của LLM giả lập")
+    parser.add_argument("--seed", type=int, default=0, help="Hạt giống ngẫu nhiên của kịch bản")
+    parser.add_argument("--output", help="Ghi kết quả ra file JSON")
+    args = parser.parse_args()
+
+    setup_logger()
+
+    tester = LoadTester(
+        DataProcessor().preprocess_data()["question"].tolist(),
+        llm_system=StubLLM(args.first_token_ms, args.tokens_per_second, args.reply_tokens),
+        turns=args.turns,
+        think_time=args.think_time,
+        seed=args.seed,
+    )
+    reports = tester.run([int(level) for level in args.sessions.split(",") if level.strip()])
+    print_report(reports)
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(reports, f, ensure_ascii=False, indent=2)
@@ -1,41 +1,189 @@
 """
 Cấu hình logging cho ứng dụng
 """
+import hashlib
+import random
 import sys
+import threading
+import time
 from pathlib import Path
 from loguru import logger
 
-from src.config import LOG_LEVEL, LOG_PATH
+from src.config import (
+    LOG_LEVEL, LOG_PATH, LOG_ASYNC, LOG_JSON, LOG_MODULE_LEVELS,
+    LOG_HOT_SAMPLE_RATE, LOG_HOT_RATE_LIMIT, LOG_QUERY_MODE, LOG_QUERY_MAX_CHARS
+)
+
+# Logger cho các thông báo trên luồng xử lý mỗi lượt hội thoại (hot path),
+# các bản ghi này bị lấy mẫu và giới hạn tần suất trước khi tới sink
+hot_logger = logger.bind(hot=True)
+
+# Streamlit gọi setup_logger ở mỗi lần rerun, chỉ cấu hình sink một lần cho mỗi tiến trình
+_configured = False
+
+
+def redact_query(text):
+    """
+    Che nội dung câu hỏi trước khi ghi log (tránh lộ thông tin cá nhân)
+
+    Args:
+        text (str): Nội dung câu hỏi
+
+    Returns:
+        str: Mã băm, bản rút gọn hoặc nội dung đầy đủ tùy theo LOG_QUERY_MODE
+    """
+    if text is None:
+        return ""
+    if LOG_QUERY_MODE == "full":
+        return text
+    if LOG_QUERY_MODE == "truncate":
+        suffix = "…" if len(text) > LOG_QUERY_MAX_CHARS else ""
+        return f"{text[:LOG_QUERY_MAX_CHARS]}{suffix} (len={len(text)})"
+    digest = hashlib.sha256(text.encode("utf-8")).hexdigest()[:12]
+    return f"sha256:{digest} (len={len(text)})"
+
+
+def parse_module_levels(spec):
+    """
+    Phân tích cấu hình mức log theo module
+
+    Args:
+        spec (str): Chuỗi dạng "src.embedding_system=WARNING,src.history_writer=DEBUG"
+
+    Returns:
+        dict: Ánh xạ tên module -> tên mức log
+    """
+    levels = {}
+    for item in spec.split(","):
+        if "=" not in item:
+            continue
+        name, level = item.split("=", 1)
+        levels[name.strip()] = level.strip().upper()
+    return levels
+
+
+class LogFilter:
+    """
+    Bộ lọc log: áp dụng mức log theo module, lấy mẫu và giới hạn tần suất bản ghi hot path
+    """
+
+    def __init__(self, default_level=LOG_LEVEL, module_levels=None,
+                 sample_rate=LOG_HOT_SAMPLE_RATE, rate_limit=LOG_HOT_RATE_LIMIT):
+        """
+        Khởi tạo LogFilter
+
+        Args:
+            default_level (str): Mức log mặc định
+            module_levels (dict, optional): Mức log riêng cho từng module (theo tiền tố tên)
+            sample_rate (float): Tỉ lệ bản ghi hot path được giữ lại (0-1)
+            rate_limit (float): Số bản ghi hot path tối đa mỗi giây cho mỗi vị trí gọi (0 = không giới hạn)
+        """
+        self.default_level = logger.level(default_level).no
+        self.module_levels = {
+            name: logger.level(level).no for name, level in (module_levels or {}).items()
+        }
+        self.sample_rate = sample_rate
+        self.rate_limit = rate_limit
+        self._warning_level = logger.level("WARNING").no
+        self._level_cache = {}
+        self._buckets = {}
+        self._lock = threading.Lock()
+
+    @property
+    def min_level(self):
+        """
+        Mức log thấp nhất cần chuyển tới sink
+        """
+        return min([self.default_level, *self.module_levels.values()])
+
+    def _level_for(self, name):
+        """
+        Lấy mức log cho module, khớp theo tiền tố dài nhất
+        """
+        level = self._level_cache.get(name)
+        if level is None:
+            level = self.default_level
+            best = -1
+            for prefix, prefix_level in self.module_levels.items():
+                if (name == prefix or name.startswith(prefix + ".")) and len(prefix) > best:
+                    level, best = prefix_level, len(prefix)
+            self._level_cache[name] = level
+        return level
+
+    def _allow_rate(self, key):
+        """
+        Giới hạn tần suất theo thuật toán token bucket
+        """
+        now = time.monotonic()
+        with self._lock:
+            tokens, last = self._buckets.get(key, (self.rate_limit, now))
+            tokens = min(self.rate_limit, tokens + (now - last) * self.rate_limit)
+            if tokens < 1:
+                self._buckets[key] = (tokens, now)
+                return False
+            self._buckets[key] = (tokens - 1, now)
+            return True
+
+    def __call__(self, record):
+        """
+        Quyết định có chuyển bản ghi tới sink hay không
+        """
+        if record["level"].no < self._level_for(record["name"]):
+            return False
+
+        # Cảnh báo và lỗi trên hot path luôn được giữ lại
+        if record["extra"].get("hot") and record["level"].no < self._warning_level:
+            if self.sample_rate < 1 and random.random() >= self.sample_rate:
+                return False
+            if self.rate_limit > 0 and not self._allow_rate((record["name"], record["function"])):
+                return False
+        return True
 
 
 def setup_logger():
     """
     Thiết lập cấu hình logger
+
+    Khi bật LOG_ASYNC, các sink dùng hàng đợi (enqueue) nên việc ghi stderr/file được thực hiện
+    ở luồng nền, không nằm trên luồng xử lý câu hỏi.
     """
+    global _configured
+    if _configured:
+        return logger
+    _configured = True
+
     # Tạo thư mục logs nếu chưa tồn tại
     log_path = Path(LOG_PATH)
     log_path.parent.mkdir(exist_ok=True)
-    
+
     # Xóa cấu hình mặc định
     logger.remove()
-    
+
+    log_filter = LogFilter(module_levels=parse_module_levels(LOG_MODULE_LEVELS))
+
     # Thêm cấu hình mới
     logger.add(
         sys.stderr,
-        level=LOG_LEVEL,
+        level=log_filter.min_level,
+        filter=log_filter,
+        enqueue=LOG_ASYNC,
+        serialize=LOG_JSON,
         format="<green>{time:YYYY-MM-DD HH:mm:ss}</green> | <level>{level: <8}</level> | <cyan>{name}</cyan>:<cyan>{function}</cyan>:<cyan>{line}</cyan> - <level>{message}</level>"
     )
-    
+
     # Thêm file log
     logger.add(
         LOG_PATH,
-        level=LOG_LEVEL,
+        level=log_filter.min_level,
+        filter=log_filter,
+        enqueue=LOG_ASYNC,
+        serialize=LOG_JSON,
         format="{time:YYYY-MM-DD HH:mm:ss} | {level: <8} | {name}:{function}:{line} - {message}",
         rotation="00:00",  # Tạo file log mới mỗi ngày
         retention="30 days"  # Giữ log trong 30 ngày
     )
-    
-    logger.info(f"Logger đã được thiết lập với mức {LOG_LEVEL}")
+
+    logger.info(f"Logger đã được thiết lập với mức {LOG_LEVEL} (async={LOG_ASYNC}, json={LOG_JSON})")
     logger.info(f"Log file: {LOG_PATH}")
-    
+
     return logger
@@ -0,0 +1,594 @@
+"""
+Module lưu trữ bộ nhớ hội thoại bền vững theo session (in-process, SQLite, Redis)
+"""
+import json
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from pathlib import Path
+
+from loguru import logger
+
+from src.config import (
+    MEMORY_BACKEND, MEMORY_SQLITE_PATH, MEMORY_REDIS_URL,
+    MEMORY_TTL_SECONDS, MEMORY_LRU_SIZE, MEMORY_MAX_MESSAGES
+)
+
+
+class InMemoryBackend:
+    """
+    Backend lưu bộ nhớ hội thoại trong tiến trình (không bền vững, dùng khi chạy một worker)
+    """
+
+    # Dữ liệu mất khi khởi động lại và không dùng chung giữa các worker
+    shared = False
+
+    def __init__(self):
+        """
+        Khởi tạo InMemoryBackend
+        """
+        self._sessions = {}
+        self._last_access = {}
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def load(self, session_id):
+        """
+        Lấy danh sách tin nhắn của một session
+
+        Args:
+            session_id (str): ID session
+
+        Returns:
+            list: Danh sách dict gồm role và content
+        """
+        with self._lock:
+            self._last_access[session_id] = time.time()
+            return list(self._sessions.get(session_id, []))
+
+    def append(self, session_id, role, content, max_messages=MEMORY_MAX_MESSAGES):
+        """
+        Ghi thêm một tin nhắn vào session
+
+        Args:
+            session_id (str): ID session
+            role (str): Vai trò (user hoặc assistant)
+            content (str): Nội dung tin nhắn
+            max_messages (int): Số tin nhắn tối đa được giữ cho mỗi session
+        """
+        with self._lock:
+            messages = self._sessions.setdefault(session_id, [])
+            messages.append({"role": role, "content": content})
+            del messages[:-max_messages]
+            self._last_access[session_id] = time.time()
+
+    def clear(self, session_id):
+        """
+        Xóa bộ nhớ của một session
+        """
+        with self._lock:
+            self._sessions.pop(session_id, None)
+            self._last_access.pop(session_id, None)
+
+    def expire_idle(self, ttl=MEMORY_TTL_SECONDS):
+        """
+        Xóa các session không hoạt động quá `ttl` giây
+
+        Returns:
+            int: Số session đã xóa
+        """
+        now = time.time()
+        cutoff = now - ttl
+        with self._lock:
+            expired = [sid for sid, ts in self._last_access.items() if ts < cutoff]
+            for session_id in expired:
+                self._sessions.pop(session_id, None)
+                self._last_access.pop(session_id, None)
+            for key in [key for key, (_, expires_at) in self._values.items() if expires_at <= now]:
+                del self._values[key]
+        return len(expired)
+
+    def get_value(self, key):
+        """
+        Lấy giá trị của một key (ngoài không gian key của các session)
+
+        Args:
+            key (str): Key
+
+        Returns:
+            str: Giá trị, None nếu không có hoặc đã hết hạn
+        """
+        with self._lock:
+            item = self._values.get(key)
+            if item is None or item[1] <= time.time():
+                return None
+            return item[0]
+
+    def set_value(self, key, value, ttl):
+        """
+        Ghi giá trị của một key, hết hạn sau `ttl` giây
+
+        Args:
+            key (str): Key
+            value (str): Giá trị
+            ttl (int): Thời gian sống (giây)
+        """
+        with self._lock:
+            self._values[key] = (value, time.time() + ttl)
+
+    def delete_value(self, key):
+        """
+        Xóa một key
+        """
+        with self._lock:
+            self._values.pop(key, None)
+
+
+class SQLiteBackend:
+    """
+    Backend lưu bộ nhớ hội thoại trong SQLite, dùng chung giữa các worker trên cùng máy
+    """
+
+    shared = True
+
+    def __init__(self, db_path=MEMORY_SQLITE_PATH):
+        """
+        Khởi tạo SQLiteBackend
+
+        Args:
+            db_path (str): Đường dẫn file SQLite
+        """
+        Path(db_path).parent.mkdir(exist_ok=True, parents=True)
+        self.db_path = db_path
+        self._local = threading.local()
+
+        conn = self._connect()
+        conn.executescript("""
+            CREATE TABLE IF NOT EXISTS memory_messages (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                session_id TEXT NOT NULL,
+                role TEXT NOT NULL,
+                content TEXT NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS idx_memory_messages_session ON memory_messages (session_id, id);
+            CREATE TABLE IF NOT EXISTS memory_sessions (
+                session_id TEXT PRIMARY KEY,
+                last_access REAL NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS memory_values (
+                key TEXT PRIMARY KEY,
+                value TEXT NOT NULL,
+                expires_at REAL NOT NULL
+            );
+        """)
+        conn.commit()
+        logger.info(f"Khởi tạo SQLiteBackend tại {db_path}")
+
+    def _connect(self):
+        """
+        Lấy kết nối SQLite riêng cho luồng hiện tại
+        """
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, timeout=10)
+            conn.execute("PRAGMA journal_mode=WAL")
+            self._local.conn = conn
+        return conn
+
+    def _touch(self, conn, session_id):
+        """
+        Cập nhật thời điểm truy cập cuối của session
+        """
+        conn.execute(
+            "INSERT INTO memory_sessions (session_id, last_access) VALUES (?, ?) "
+            "ON CONFLICT(session_id) DO UPDATE SET last_access = excluded.last_access",
+            (session_id, time.time())
+        )
+
+    def load(self, session_id):
+        """
+        Lấy danh sách tin nhắn của một session
+        """
+        conn = self._connect()
+        rows = conn.execute(
+            "SELECT role, content FROM memory_messages WHERE session_id = ? ORDER BY id",
+            (session_id,)
+        ).fetchall()
+        if rows:
+            self._touch(conn, session_id)
+            conn.commit()
+        return [{"role": role, "content": content} for role, content in rows]
+
+    def append(self, session_id, role, content, max_messages=MEMORY_MAX_MESSAGES):
+        """
+        Ghi thêm một tin nhắn và chỉ giữ lại `max_messages` tin nhắn gần nhất
+        """
+        conn = self._connect()
+        with conn:
+            conn.execute(
+                "INSERT INTO memory_messages (session_id, role, content) VALUES (?, ?, ?)",
+                (session_id, role, content)
+            )
+            conn.execute(
+                "DELETE FROM memory_messages WHERE session_id = ? AND id NOT IN ("
+                "SELECT id FROM memory_messages WHERE session_id = ? ORDER BY id DESC LIMIT ?)",
+                (session_id, session_id, max_messages)
+            )
+            self._touch(conn, session_id)
+
+    def clear(self, session_id):
+        """
+        Xóa bộ nhớ của một session
+        """
+        conn = self._connect()
+        with conn:
+            conn.execute("DELETE FROM memory_messages WHERE session_id = ?", (session_id,))
+            conn.execute("DELETE FROM memory_sessions WHERE session_id = ?", (session_id,))
+
+    def expire_idle(self, ttl=MEMORY_TTL_SECONDS):
+        """
+        Xóa các session không hoạt động quá `ttl` giây
+        """
+        conn = self._connect()
+        cutoff = time.time() - ttl
+        with conn:
+            conn.execute(
+                "DELETE FROM memory_messages WHERE session_id IN ("
+                "SELECT session_id FROM memory_sessions WHERE last_access < ?)",
+                (cutoff,)
+            )
+            cursor = conn.execute("DELETE FROM memory_sessions WHERE last_access < ?", (cutoff,))
+            expired = cursor.rowcount
+            conn.execute("DELETE FROM memory_values WHERE expires_at <= ?", (time.time(),))
+        return expired
+
+    def get_value(self, key):
+        """
+        Lấy giá trị của một key, None nếu không có hoặc đã hết hạn
+        """
+        row = self._connect().execute(
+            "SELECT value FROM memory_values WHERE key = ? AND expires_at > ?", (key, time.time())
+        ).fetchone()
+        return row[0] if row else None
+
+    def set_value(self, key, value, ttl):
+        """
+        Ghi giá trị của một key, hết hạn sau `ttl` giây
+        """
+        conn = self._connect()
+        with conn:
+            conn.execute(
+                "INSERT INTO memory_values (key, value, expires_at) VALUES (?, ?, ?) "
+                "ON CONFLICT(key) DO UPDATE SET value = excluded.value, expires_at = excluded.expires_at",
+                (key, value, time.time() + ttl)
+            )
+
+    def delete_value(self, key):
+        """
+        Xóa một key
+        """
+        conn = self._connect()
+        with conn:
+            conn.execute("DELETE FROM memory_values WHERE key = ?", (key,))
+
+
+class RedisBackend:
+    """
+    Backend lưu bộ nhớ hội thoại trong Redis (hoặc store tương thích Redis),
+    dùng chung giữa nhiều worker / nhiều máy
+    """
+
+    shared = True
+
+    def __init__(self, client, prefix="memory:", ttl=MEMORY_TTL_SECONDS, value_prefix="memory-kv:"):
+        """
+        Khởi tạo RedisBackend
+
+        Args:
+            client: Client tương thích redis-py (rpush, lrange, ltrim, expire, delete, get, set)
+            prefix (str): Tiền tố key của session
+            ttl (int): Thời gian (giây) giữ session không hoạt động, Redis tự xóa khi hết hạn
+            value_prefix (str): Tiền tố key của các giá trị đơn (get_value / set_value)
+        """
+        self.client = client
+        self.prefix = prefix
+        self.ttl = ttl
+        self.value_prefix = value_prefix
+
+    def _key(self, session_id):
+        """
+        Tạo key Redis cho session
+        """
+        return f"{self.prefix}{session_id}"
+
+    def load(self, session_id):
+        """
+        Lấy danh sách tin nhắn của một session và gia hạn TTL
+        """
+        key = self._key(session_id)
+        items = self.client.lrange(key, 0, -1)
+        if items:
+            self.client.expire(key, self.ttl)
+        return [json.loads(item) for item in items]
+
+    def append(self, session_id, role, content, max_messages=MEMORY_MAX_MESSAGES):
+        """
+        Ghi thêm một tin nhắn, cắt danh sách còn `max_messages` phần tử và gia hạn TTL
+        """
+        key = self._key(session_id)
+        self.client.rpush(key, json.dumps({"role": role, "content": content}, ensure_ascii=False))
+        self.client.ltrim(key, -max_messages, -1)
+        self.client.expire(key, self.ttl)
+
+    def clear(self, session_id):
+        """
+        Xóa bộ nhớ của một session
+        """
+        self.client.delete(self._key(session_id))
+
+    def expire_idle(self, ttl=MEMORY_TTL_SECONDS):
+        """
+        Không cần làm gì vì Redis tự xóa key hết hạn
+        """
+        return 0
+
+    def get_value(self, key):
+        """
+        Lấy giá trị của một key, None nếu không có hoặc đã hết hạn
+        """
+        return self.client.get(self.value_prefix + key)
+
+    def set_value(self, key, value, ttl):
+        """
+        Ghi giá trị của một key, Redis tự xóa sau `ttl` giây
+        """
+        self.client.set(self.value_prefix + key, value, ex=int(ttl))
+
+    def delete_value(self, key):
+        """
+        Xóa một key
+        """
+        self.client.delete(self.value_prefix + key)
+
+
+class FakeRedis:
+    """
+    Store giả lập một phần API Redis trong bộ nhớ, dùng cho kiểm thử và chạy cục bộ
+    """
+
+    def __init__(self):
+        """
+        Khởi tạo FakeRedis
+        """
+        self._data = {}
+        self._expires = {}
+        self._lock = threading.Lock()
+
+    def _purge(self, key):
+        """
+        Xóa key nếu đã hết hạn
+        """
+        expires_at = self._expires.get(key)
+        if expires_at is not None and expires_at <= time.time():
+            self._data.pop(key, None)
+            self._expires.pop(key, None)
+
+    def rpush(self, key, *values):
+        with self._lock:
+            self._purge(key)
+            items = self._data.setdefault(key, [])
+            items.extend(values)
+            return len(items)
+
+    def lrange(self, key, start, end):
+        with self._lock:
+            self._purge(key)
+            items = self._data.get(key, [])
+            end = len(items) if end == -1 else end + 1
+            return list(items[start:end])
+
+    def ltrim(self, key, start, end):
+        with self._lock:
+            self._purge(key)
+            if key in self._data:
+                items = self._data[key]
+                end = len(items) if end == -1 else end + 1
+                self._data[key] = items[start:end]
+            return True
+
+    def expire(self, key, seconds):
+        with self._lock:
+            if key not in self._data:
+                return False
+            self._expires[key] = time.time() + seconds
+            return True
+
+    def get(self, key):
+        with self._lock:
+            self._purge(key)
+            return self._data.get(key)
+
+    def set(self, key, value, ex=None):
+        with self._lock:
+            self._data[key] = value
+            if ex is None:
+                self._expires.pop(key, None)
+            else:
+                self._expires[key] = time.time() + ex
+            return True
+
+    def delete(self, *keys):
+        with self._lock:
+            removed = 0
+            for key in keys:
+                removed += self._data.pop(key, None) is not None
+                self._expires.pop(key, None)
+            return removed
+
+
+class SessionMemoryStore:
+    """
+    Lớp truy cập bộ nhớ hội thoại theo session: đọc lười (lazy load), ghi xuyên (write-through)
+    xuống backend và giữ một LRU giới hạn các session đang hoạt động trong tiến trình
+    """
+
+    def __init__(self, backend, lru_size=MEMORY_LRU_SIZE, ttl=MEMORY_TTL_SECONDS,
+                 max_messages=MEMORY_MAX_MESSAGES):
+        """
+        Khởi tạo SessionMemoryStore
+
+        Args:
+            backend: Backend lưu trữ (InMemoryBackend, SQLiteBackend, RedisBackend)
+            lru_size (int): Số session tối đa được giữ trong bộ nhớ tiến trình
+            ttl (int): Thời gian (giây) trước khi session không hoạt động bị xóa
+            max_messages (int): Số tin nhắn tối đa được giữ cho mỗi session
+        """
+        self.backend = backend
+        self.lru_size = lru_size
+        self.ttl = ttl
+        self.max_messages = max_messages
+        self._cache = OrderedDict()
+        self._lock = threading.Lock()
+        self._last_expire = time.time()
+
+        logger.info(f"Khởi tạo SessionMemoryStore với {type(backend).__name__} (lru={lru_size}, ttl={ttl}s)")
+
+    def get(self, session_id):
+        """
+        Lấy danh sách tin nhắn của session, ưu tiên bản trong LRU
+
+        Args:
+            session_id (str): ID session
+
+        Returns:
+            list: Danh sách dict gồm role và content
+        """
+        self._maybe_expire()
+        with self._lock:
+            if session_id in self._cache:
+                self._cache.move_to_end(session_id)
+                return list(self._cache[session_id])
+
+        messages = self.backend.load(session_id)
+        self._put_cache(session_id, messages)
+        return list(messages)
+
+    def append(self, session_id, role, content):
+        """
+        Ghi thêm một tin nhắn: cập nhật LRU và ghi ngay xuống backend
+
+        Args:
+            session_id (str): ID session
+            role (str): Vai trò (user hoặc assistant)
+            content (str): Nội dung tin nhắn
+        """
+        self.backend.append(session_id, role, content, max_messages=self.max_messages)
+        with self._lock:
+            if session_id in self._cache:
+                messages = self._cache[session_id]
+                messages.append({"role": role, "content": content})
+                del messages[:-self.max_messages]
+                self._cache.move_to_end(session_id)
+                return
+        self._put_cache(session_id, self.backend.load(session_id))
+
+    def clear(self, session_id):
+        """
+        Xóa bộ nhớ của session ở cả LRU và backend
+        """
+        with self._lock:
+            self._cache.pop(session_id, None)
+        self.backend.clear(session_id)
+
+    def evict(self, session_id):
+        """
+        Bỏ session khỏi LRU của tiến trình (dữ liệu vẫn còn trong backend)
+        """
+        with self._lock:
+            self._cache.pop(session_id, None)
+
+    def get_value(self, key):
+        """
+        Lấy giá trị đơn lưu trong backend (không qua LRU), None nếu không có hoặc đã hết hạn
+        """
+        return self.backend.get_value(key)
+
+    def set_value(self, key, value, ttl=None):
+        """
+        Ghi giá trị đơn vào backend, hết hạn sau `ttl` giây (mặc định TTL của session)
+        """
+        self.backend.set_value(key, value, self.ttl if ttl is None else ttl)
+
+    def delete_value(self, key):
+        """
+        Xóa giá trị đơn khỏi backend
+        """
+        self.backend.delete_value(key)
+
+    def _put_cache(self, session_id, messages):
+        """
+        Đưa session vào LRU, loại bỏ session ít dùng nhất khi vượt giới hạn
+        """
+        with self._lock:
+            self._cache[session_id] = list(messages)
+            self._cache.move_to_end(session_id)
+            while len(self._cache) > self.lru_size:
+                self._cache.popitem(last=False)
+
+    def _maybe_expire(self):
+        """
+        Định kỳ xóa các session không hoạt động trong backend
+        """
+        now = time.time()
+        if now - self._last_expire < min(self.ttl, 60):
+            return
+        self._last_expire = now
+        try:
+            expired = self.backend.expire_idle(self.ttl)
+            if expired:
+                logger.info(f"Đã xóa {expired} session bộ nhớ không hoạt động")
+        except Exception as e:
+            logger.error(f"Lỗi khi xóa session bộ nhớ hết hạn: {e}")
+
+
+def create_memory_backend(name=MEMORY_BACKEND):
+    """
+    Tạo backend bộ nhớ theo cấu hình
+
+    Args:
+        name (str): memory, sqlite, redis hoặc fakeredis
+
+    Returns:
+        Backend bộ nhớ tương ứng
+    """
+    name = name.lower()
+    if name == "sqlite":
+        return SQLiteBackend()
+    if name == "redis":
+        import redis
+        return RedisBackend(redis.Redis.from_url(MEMORY_REDIS_URL, decode_responses=True))
+    if name == "fakeredis":
+        return RedisBackend(FakeRedis())
+    if name != "memory":
+        logger.warning(f"Backend bộ nhớ không hợp lệ: {name}, dùng backend trong tiến trình")
+    return InMemoryBackend()
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def get_memory_store():
+    """
+    Lấy SessionMemoryStore dùng chung cho toàn bộ tiến trình, khởi tạo khi cần
+
+    Returns:
+        SessionMemoryStore: Store dùng chung
+    """
+    global _store
+    if _store is None:
+        with _store_lock:
+            if _store is None:
+                _store = SessionMemoryStore(create_memory_backend())
+    return _store
@@ -6,28 +6,96 @@ from langchain.memory import ConversationBufferWindowMemory
 from langchain.memory.chat_message_histories import ChatMessageHistory
 from langchain_core.messages import HumanMessage, AIMessage
 
+from src.logger import hot_logger
+from src.memory_backends import get_memory_store
+
+
 class MemorySystem:
     """
     Hệ thống quản lý memory cho chatbot sử dụng ConversationBufferWindowMemory
+    
+    Khi được gắn với một session, memory được tải lười từ SessionMemoryStore (in-process,
+    SQLite hoặc Redis) và mọi tin nhắn mới được ghi xuyên xuống store, nhờ đó ngữ cảnh
+    không bị mất khi khởi động lại tiến trình hoặc khi chuyển sang worker khác.
     """
     
-    def __init__(self, k=5):
+    def __init__(self, k=5, session_id=None, store=None):
         """
         Khởi tạo MemorySystem với ConversationBufferWindowMemory
         
         Args:
-            k (int): Số lượng tin nhắn gần nhất được lưu trữ
+            k (int): Số lượt hội thoại gần nhất (câu hỏi và câu trả lời) được đưa vào prompt
+            session_id (str, optional): ID session dùng làm khóa trong store
+            store (SessionMemoryStore, optional): Store lưu memory. Nếu None, dùng store chung của tiến trình.
         """
         self.chat_history = ChatMessageHistory()
         self.memory = ConversationBufferWindowMemory(
             chat_memory=self.chat_history,
             memory_key="chat_history",
             return_messages=True,
-            k=k  # Chỉ lưu k tin nhắn gần nhất
+            k=k  # Chỉ đưa k lượt hội thoại gần nhất vào prompt
         )
+        self.store = store or get_memory_store()
+        self.session_id = session_id
+        self._loaded = session_id is None
         
         logger.info(f"Khởi tạo MemorySystem với ConversationBufferWindowMemory (k={k})")
     
+    def set_window(self, k):
+        """
+        Đổi số lượt hội thoại gần nhất được đưa vào lịch sử hội thoại (tinh chỉnh khi đang chạy)
+        
+        Args:
+            k (int): Số lượt hội thoại gần nhất
+        """
+        if self.memory.k != k:
+            self.memory.k = k
+            logger.info(f"Đổi cửa sổ memory hội thoại thành k={k}")
+    
+    def bind_session(self, session_id):
+        """
+        Gắn memory với một session, dữ liệu của session sẽ được tải khi cần
+        
+        Args:
+            session_id (str): ID session (HistoryManager.session_id)
+        """
+        self.session_id = session_id
+        self.chat_history.clear()
+        self._loaded = False
+        # Session có thể đã được tiếp tục ở worker khác, bỏ bản trong LRU để tải lại từ backend
+        if session_id is not None:
+            self.store.evict(session_id)
+        logger.info(f"Đã gắn memory với session {session_id}")
+    
+    def _ensure_loaded(self):
+        """
+        Tải memory của session từ store ở lần truy cập đầu tiên
+        """
+        if self._loaded:
+            return
+        self._loaded = True
+        
+        try:
+            for message in self.store.get(self.session_id):
+                if message["role"] == "user":
+                    self.chat_history.add_user_message(message["content"])
+                else:
+                    self.chat_history.add_ai_message(message["content"])
+            logger.debug(f"Đã tải {len(self.chat_history.messages)} tin nhắn của session {self.session_id}")
+        except Exception as e:
+            logger.error(f"Lỗi khi tải memory của session {self.session_id}: {e}")
+    
+    def _persist(self, role, content):
+        """
+        Ghi xuyên tin nhắn xuống store
+        """
+        if self.session_id is None:
+            return
+        try:
+            self.store.append(self.session_id, role, content)
+        except Exception as e:
+            logger.error(f"Lỗi khi lưu memory của session {self.session_id}: {e}")
+    
     def add_user_message(self, message):
         """
         Thêm tin nhắn của người dùng vào memory
@@ -35,8 +103,10 @@ class MemorySystem:
         Args:
             message (str): Tin nhắn của người dùng
         """
+        self._ensure_loaded()
         self.chat_history.add_user_message(message)
-        logger.info(f"Đã thêm tin nhắn người dùng vào memory")
+        self._persist("user", message)
+        hot_logger.info("Đã thêm tin nhắn người dùng vào memory")
     
     def add_ai_message(self, message):
         """
@@ -45,17 +115,20 @@ class MemorySystem:
         Args:
             message (str): Tin nhắn của AI
         """
+        self._ensure_loaded()
         self.chat_history.add_ai_message(message)
-        logger.info(f"Đã thêm tin nhắn AI vào memory")
+        self._persist("assistant", message)
+        hot_logger.info("Đã thêm tin nhắn AI vào memory")
     
     def get_chat_history(self):
         """
-        Lấy lịch sử chat từ memory
+        Lấy lịch sử chat từ memory (chỉ k lượt gần nhất)
         
         Returns:
             str: Lịch sử chat được định dạng
         """
-        messages = self.chat_history.messages
+        self._ensure_loaded()
+        messages = self.memory.buffer_as_messages
         formatted_history = ""
         
         for message in messages:
@@ -73,6 +146,7 @@ class MemorySystem:
         Returns:
             dict: Biến memory
         """
+        self._ensure_loaded()
         return self.memory.load_memory_variables({})
     
     def clear(self):
@@ -80,4 +154,6 @@ class MemorySystem:
         Xóa toàn bộ memory
         """
         self.chat_history.clear()
+        if self.session_id is not None:
+            self.store.clear(self.session_id)
         logger.info("Đã xóa toàn bộ memory")
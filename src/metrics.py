@@ -0,0 +1,151 @@
+"""
+Module thu thập số liệu hiệu năng (metrics) trong tiến trình
+"""
+import math
+import threading
+from collections import deque
+
+
+class MetricsRegistry:
+    """
+    Kho lưu counter, gauge và phân phối thời gian dùng chung cho toàn bộ ứng dụng
+    """
+
+    def __init__(self, window=1000):
+        """
+        Khởi tạo MetricsRegistry
+
+        Args:
+            window (int): Số mẫu gần nhất được giữ lại cho mỗi phân phối
+        """
+        self.window = window
+        self._lock = threading.Lock()
+        self._counters = {}
+        self._gauges = {}
+        self._observations = {}
+
+    def increment(self, name, value=1):
+        """
+        Tăng giá trị một counter
+
+        Args:
+            name (str): Tên counter
+            value (int): Giá trị cộng thêm
+        """
+        with self._lock:
+            self._counters[name] = self._counters.get(name, 0) + value
+
+    def set_gauge(self, name, value):
+        """
+        Ghi nhận giá trị tức thời của một gauge
+
+        Args:
+            name (str): Tên gauge
+            value (float): Giá trị hiện tại
+        """
+        with self._lock:
+            self._gauges[name] = value
+
+    def observe(self, name, value):
+        """
+        Ghi nhận một mẫu cho phân phối (vd: độ trễ tính bằng ms)
+
+        Args:
+            name (str): Tên phân phối
+            value (float): Giá trị mẫu
+        """
+        with self._lock:
+            samples = self._observations.get(name)
+            if samples is None:
+                samples = self._observations[name] = deque(maxlen=self.window)
+            samples.append(value)
+
+    def get_counter(self, name):
+        """
+        Lấy giá trị counter
+
+        Returns:
+            int: Giá trị counter, 0 nếu chưa có
+        """
+        return self._counters.get(name, 0)
+
+    def get_gauge(self, name):
+        """
+        Lấy giá trị gauge
+
+        Returns:
+            float: Giá trị gauge, None nếu chưa có
+        """
+        return self._gauges.get(name)
+
+    def summary(self, name):
+        """
+        Tính thống kê cho một phân phối
+
+        Args:
+            name (str): Tên phân phối
+
+        Returns:
+            dict: count, mean, p50, p95, max (rỗng nếu chưa có mẫu)
+        """
+        with self._lock:
+            samples = sorted(self._observations.get(name, ()))
+
+        if not samples:
+            return {}
+
+        return {
+            "count": len(samples),
+            "mean": sum(samples) / len(samples),
+            "p50": percentile(samples, 50),
+            "p95": percentile(samples, 95),
+            "max": samples[-1],
+        }
+
+    def snapshot(self):
+        """
+        Lấy toàn bộ số liệu hiện tại
+
+        Returns:
+            dict: Gồm counters, gauges và thống kê của các phân phối
+        """
+        with self._lock:
+            counters = dict(self._counters)
+            gauges = dict(self._gauges)
+            names = list(self._observations)
+
+        return {
+            "counters": counters,
+            "gauges": gauges,
+            "timings": {name: self.summary(name) for name in names},
+        }
+
+    def reset(self):
+        """
+        Xóa toàn bộ số liệu
+        """
+        with self._lock:
+            self._counters.clear()
+            self._gauges.clear()
+            self._observations.clear()
+
+
+def percentile(sorted_values, q):
+    """
+    Tính phân vị theo phương pháp nearest-rank
+
+    Args:
+        sorted_values (list): Danh sách giá trị đã sắp xếp tăng dần
+        q (float): Phân vị cần tính (0-100)
+
+    Returns:
+        float: Giá trị phân vị, None nếu danh sách rỗng
+    """
+    if not sorted_values:
+        return None
+    index = max(0, min(len(sorted_values) - 1, math.ceil(q / 100 * len(sorted_values)) - 1))
+    return sorted_values[index]
+
+
+# Registry dùng chung cho toàn bộ tiến trình
+metrics = MetricsRegistry()
@@ -0,0 +1,339 @@
+"""
+Module gom các yêu cầu encode/tìm kiếm đồng thời thành lô (micro-batching)
+"""
+import queue
+import threading
+import time
+from concurrent.futures import Future
+
+import numpy as np
+from loguru import logger
+
+from src.config import VECTOR_DB_SHARDS_DIR
+from src.metrics import metrics
+from src.settings import get_settings
+
+_shared_batcher = None
+_shared_batcher_lock = threading.Lock()
+
+
+def batch_size_bucket(size):
+    """
+    Làm tròn kích thước lô lên lũy thừa của 2 gần nhất để gom metrics (1, 2, 4, 8, ...)
+
+    Args:
+        size (int): Số yêu cầu trong lô
+
+    Returns:
+        int: Nhóm kích thước lô
+    """
+    bucket = 1
+    while bucket < size:
+        bucket *= 2
+    return bucket
+
+
+def get_query_batcher():
+    """
+    Lấy QueryBatcher dùng chung cho toàn bộ tiến trình
+
+    Mô hình embedding và vector store chỉ được tải một lần; các phiên hội thoại gửi câu hỏi
+    vào cùng một bộ gom lô thay vì mỗi phiên tự encode và tìm kiếm riêng.
+
+    Returns:
+        QueryBatcher: Bộ gom lô dùng chung, None nếu chưa có vector store
+    """
+    global _shared_batcher
+    if _shared_batcher is None:
+        with _shared_batcher_lock:
+            if _shared_batcher is None:
+                from src.embedding_system import EmbeddingSystem
+
+                embedding_system = EmbeddingSystem(server_socket="", batching=False)
+                if not (VECTOR_DB_SHARDS_DIR and embedding_system.load_shards() is not None):
+                    if embedding_system.load_vector_store() is None:
+                        return None
+                    embedding_system.start_watcher()
+                _shared_batcher = QueryBatcher(embedding_system)
+    return _shared_batcher
+
+
+class QueryBatcher:
+    """
+    Gom các yêu cầu tới trong một khoảng thời gian ngắn để encode bằng một lần gọi mô hình
+    và tìm kiếm bằng một lần gọi FAISS, sau đó trả kết quả về cho từng nơi gọi
+    """
+
+    def __init__(self, embedding_system, window_ms=None, max_batch=None):
+        """
+        Khởi tạo QueryBatcher
+
+        Args:
+            embedding_system (EmbeddingSystem): Hệ thống embedding đã tải vector store
+            window_ms (float, optional): Thời gian chờ gom lô (ms) tính từ yêu cầu đầu tiên,
+                mặc định lấy từ cấu hình runtime (embedding_batch_window_ms)
+            max_batch (int, optional): Số yêu cầu tối đa trong một lô, mặc định lấy từ cấu hình
+                runtime (embedding_batch_max_size)
+        """
+        self.embedding_system = embedding_system
+        self._window_ms = window_ms
+        self._max_batch = max_batch
+        self._queue = queue.Queue()
+        self._stopped = False
+        self._thread = threading.Thread(target=self._run, name="query-batcher", daemon=True)
+        self._thread.start()
+        logger.info(f"Khởi động QueryBatcher (cửa sổ {self.window * 1000:g}ms, tối đa {self.max_batch} yêu cầu/lô)")
+
+    @property
+    def window(self):
+        """
+        Thời gian chờ gom lô (giây)
+        """
+        window_ms = self._window_ms if self._window_ms is not None else get_settings().embedding_batch_window_ms
+        return window_ms / 1000.0
+
+    @property
+    def max_batch(self):
+        """
+        Số yêu cầu tối đa trong một lô
+        """
+        return self._max_batch if self._max_batch is not None else get_settings().embedding_batch_max_size
+
+    def submit(self, query=None, vector=None, k=None):
+        """
+        Gửi một yêu cầu vào lô kế tiếp
+
+        Args:
+            query (str, optional): Câu hỏi cần encode (bỏ qua nếu đã có vector)
+            vector (list, optional): Vector câu hỏi đã encode sẵn
+            k (int, optional): Số document cần tìm; None nếu chỉ cần encode
+
+        Returns:
+            Future: Kết quả dạng (docs, vector), docs là None khi chỉ encode
+        """
+        if self._stopped:
+            raise RuntimeError("QueryBatcher đã dừng")
+        future = Future()
+        self._queue.put((query, vector, k, future, time.perf_counter()))
+        return future
+
+    def ping(self):
+        """
+        Phiên bản vector store đang được phục vụ (cùng giao diện với EmbeddingClient)
+
+        Returns:
+            str: Phiên bản vector store
+        """
+        return self.embedding_system.current_version
+
+    def embed(self, query):
+        """
+        Encode một câu hỏi qua lô
+
+        Returns:
+            np.ndarray: Vector câu hỏi
+        """
+        return self.submit(query=query).result()[1]
+
+    def search(self, query=None, vector=None, k=3):
+        """
+        Encode (nếu cần) và tìm kiếm một câu hỏi qua lô
+
+        Returns:
+            tuple: (docs, vector câu hỏi)
+        """
+        return self.submit(query=query, vector=vector, k=k).result()
+
+    def search_batch(self, queries, k=3):
+        """
+        Tìm kiếm cho nhiều câu hỏi qua lô
+
+        Returns:
+            list: Danh sách (theo thứ tự câu hỏi) các danh sách document
+        """
+        futures = [self.submit(query=query, k=k) for query in queries]
+        return [future.result()[0] for future in futures]
+
+    def get_stats(self):
+        """
+        Thống kê độ trễ và thông lượng theo kích thước lô
+
+        Returns:
+            dict: Số lô, số yêu cầu, phân phối kích thước lô, thời gian chờ gom lô và
+                độ trễ / thông lượng theo từng nhóm kích thước lô
+        """
+        stats = {
+            "batches": metrics.get_counter("embedding_batch.batches"),
+            "requests": metrics.get_counter("embedding_batch.requests"),
+            "size": metrics.summary("embedding_batch.size"),
+            "wait_ms": metrics.summary("embedding_batch.wait_ms"),
+        }
+        bucket = 1
+        while bucket <= batch_size_bucket(self.max_batch):
+            latency = metrics.summary(f"embedding_batch.latency_ms.size_{bucket}")
+            if latency.get("count"):
+                stats[f"size_{bucket}"] = {
+                    "latency_ms": latency,
+                    "throughput_qps": metrics.summary(f"embedding_batch.throughput_qps.size_{bucket}"),
+                }
+            bucket *= 2
+        return stats
+
+    def close(self):
+        """
+        Dừng luồng gom lô sau khi xử lý hết các yêu cầu đang chờ
+        """
+        if self._stopped:
+            return
+        self._stopped = True
+        self._queue.put(None)
+        self._thread.join(timeout=5)
+
+    def _collect(self):
+        """
+        Chờ yêu cầu đầu tiên rồi gom thêm cho tới khi hết cửa sổ thời gian hoặc đủ lô
+
+        Returns:
+            list: Các yêu cầu trong lô, None nếu nhận tín hiệu dừng
+        """
+        first = self._queue.get()
+        if first is None:
+            return None
+        batch = [first]
+        deadline = time.monotonic() + self.window
+        max_batch = self.max_batch
+        while len(batch) < max_batch:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                item = self._queue.get(timeout=remaining)
+            except queue.Empty:
+                break
+            if item is None:
+                # Xử lý nốt lô hiện tại rồi mới dừng
+                self._queue.put(None)
+                break
+            batch.append(item)
+        return batch
+
+    def _run(self):
+        """
+        Vòng lặp của luồng gom lô
+        """
+        while True:
+            batch = self._collect()
+            if batch is None:
+                return
+            try:
+                self._process(batch)
+            except Exception as e:
+                logger.error(f"Lỗi khi xử lý lô {len(batch)} yêu cầu: {e}")
+                for _, _, _, future, _ in batch:
+                    if not future.done():
+                        future.set_exception(e)
+
+    def _process(self, batch):
+        """
+        Encode các câu hỏi chưa có vector trong một lần gọi mô hình, rồi tìm kiếm theo
+        từng nhóm k bằng một lần gọi FAISS mỗi nhóm
+
+        Args:
+            batch (list): Các yêu cầu (query, vector, k, future, thời điểm gửi)
+        """
+        start = time.perf_counter()
+        for *_, submitted in batch:
+            metrics.observe("embedding_batch.wait_ms", (start - submitted) * 1000)
+
+        vectors = [None if vector is None else np.asarray(vector, dtype=np.float32)
+                   for _, vector, _, _, _ in batch]
+
+        to_encode = [i for i, vector in enumerate(vectors) if vector is None]
+        if to_encode:
+            encoded = self.embedding_system.embed_documents([batch[i][0] for i in to_encode])
+            for i, vector in zip(to_encode, encoded):
+                vectors[i] = np.asarray(vector, dtype=np.float32)
+
+        groups = {}
+        for i, (_, _, k, _, _) in enumerate(batch):
+            groups.setdefault(k, []).append(i)
+
+        for k, indices in groups.items():
+            if k is None:
+                results = [None] * len(indices)
+            else:
+                results = self.embedding_system.search_by_vectors(
+                    np.stack([vectors[i] for i in indices]), k=k
+                )
+            for i, docs in zip(indices, results):
+                batch[i][3].set_result((docs, vectors[i]))
+
+        elapsed = time.perf_counter() - start
+        bucket = batch_size_bucket(len(batch))
+        metrics.increment("embedding_batch.batches")
+        metrics.increment("embedding_batch.requests", len(batch))
+        metrics.observe("embedding_batch.size", len(batch))
+        metrics.observe(f"embedding_batch.latency_ms.size_{bucket}", elapsed * 1000)
+        if elapsed > 0:
+            metrics.observe(f"embedding_batch.throughput_qps.size_{bucket}", len(batch) / elapsed)
+
+
+def benchmark_batching(embedding_system, questions, concurrency=16, k=3):
+    """
+    So sánh thông lượng khi mỗi luồng tự encode + tìm kiếm với khi đi qua bộ gom lô
+
+    Args:
+        embedding_system (EmbeddingSystem): Hệ thống embedding đã tải vector store
+        questions (list): Danh sách câu hỏi
+        concurrency (int): Số luồng gửi câu hỏi đồng thời
+        k (int): Số document cần tìm
+
+    Returns:
+        dict: Thông lượng (câu/giây) của hai cách và thống kê theo kích thước lô
+    """
+    from concurrent.futures import ThreadPoolExecutor
+
+    def run(search):
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            list(executor.map(search, questions))
+        elapsed = time.perf_counter() - start
+        return len(questions) / elapsed if elapsed > 0 else 0.0
+
+    unbatched_qps = run(lambda question: embedding_system.search_by_vectors(
+        [embedding_system.embed_query(question)], k=k
+    ))
+
+    batcher = QueryBatcher(embedding_system)
+    try:
+        batched_qps = run(lambda question: batcher.search(query=question, k=k))
+        stats = batcher.get_stats()
+    finally:
+        batcher.close()
+
+    return {
+        "questions": len(questions),
+        "concurrency": concurrency,
+        "unbatched_qps": round(unbatched_qps, 2),
+        "batched_qps": round(batched_qps, 2),
+        "batch_stats": stats,
+    }
+
+
+if __name__ == "__main__":
+    from src.logger import setup_logger
+    from src.data_processor import DataProcessor
+    from src.embedding_system import EmbeddingSystem
+
+    setup_logger()
+
+    embedding_system = EmbeddingSystem(server_socket="", batching=False)
+    if embedding_system.load_vector_store() is None:
+        print("Cần khởi tạo vector database trước (python main.py --setup-db)")
+    else:
+        # Lặp lại bộ câu hỏi để có đủ tải đồng thời
+        questions = DataProcessor().preprocess_data()["question"].tolist() * 10
+        result = benchmark_batching(embedding_system, questions)
+        logger.info(f"Kết quả benchmark gom lô: {result}")
+        for key, value in result.items():
+            print(f"{key}: {value}")
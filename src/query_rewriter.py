@@ -0,0 +1,254 @@
+"""
+Module viết lại câu hỏi theo ngữ cảnh hội thoại bằng cách trộn vector (không gọi LLM)
+"""
+import re
+import sys
+import time
+from collections import deque
+
+import numpy as np
+from loguru import logger
+
+from src.config import (
+    QUERY_REWRITE_ALPHA, QUERY_REWRITE_HISTORY_TURNS, QUERY_REWRITE_MAX_WORDS, TOP_K
+)
+
+# Các cụm từ tham chiếu tới lượt trước, thường gặp trong câu hỏi nối tiếp. Chỉ dùng cụm từ,
+# không dùng từ đơn phổ biến (vd: "còn", "nó", "thêm") vì chúng xuất hiện cả trong câu hỏi mới
+FOLLOW_UP_CUES = (
+    "cách nào khác", "cách khác", "khác không", "nữa không", "còn gì", "còn cách", "thêm gì",
+    "thêm cách", "vậy thì", "như vậy", "điều đó", "việc đó", "chuyện đó", "cái đó", "thế thì",
+    "thế còn", "tại sao vậy", "ý bạn là", "nghĩa là sao", "cụ thể hơn", "cho ví dụ", "ví dụ cụ thể",
+    "tiếp theo",
+)
+_CUE_PATTERN = re.compile(r"\b(" + "|".join(re.escape(cue) for cue in FOLLOW_UP_CUES) + r")\b")
+
+
+def is_follow_up(query, max_words=QUERY_REWRITE_MAX_WORDS):
+    """
+    Nhận diện câu hỏi nối tiếp: câu hỏi ngắn và có cụm từ tham chiếu tới lượt trước
+
+    Câu hỏi ngắn nhưng không tham chiếu lượt trước (vd: "tôi bị mất ngủ") được coi là đổi chủ đề.
+
+    Args:
+        query (str): Câu hỏi
+        max_words (int): Số từ tối đa của câu hỏi nối tiếp
+
+    Returns:
+        bool: True nếu là câu hỏi nối tiếp
+    """
+    text = query.lower().strip()
+    return len(text.split()) <= max_words and bool(_CUE_PATTERN.search(text))
+
+
+class QueryRewriter:
+    """
+    Kết hợp vector của câu hỏi mới nhất với vector (đã lưu sẵn) của các câu hỏi trước trong
+    phiên, giúp câu hỏi nối tiếp như "còn cách nào khác không?" tìm được đúng tài liệu
+    """
+
+    def __init__(self, alpha=QUERY_REWRITE_ALPHA, history_turns=QUERY_REWRITE_HISTORY_TURNS,
+                 max_words=QUERY_REWRITE_MAX_WORDS):
+        """
+        Khởi tạo QueryRewriter
+
+        Args:
+            alpha (float): Trọng số của vector lịch sử khi trộn
+            history_turns (int): Số câu hỏi trước được giữ lại
+            max_words (int): Ngưỡng số từ để coi là câu hỏi nối tiếp
+        """
+        self.alpha = alpha
+        self.max_words = max_words
+        self.history_vectors = deque(maxlen=history_turns)
+
+    def reset(self):
+        """
+        Xóa vector lịch sử (khi chuyển sang session khác)
+        """
+        self.history_vectors.clear()
+
+    def remember(self, query_vector):
+        """
+        Lưu vector của câu hỏi vừa được xử lý để dùng cho các lượt sau
+
+        Args:
+            query_vector (list): Vector câu hỏi (đã encode trong bước tìm kiếm)
+        """
+        self.history_vectors.append(np.asarray(query_vector, dtype=np.float32))
+
+    def warm_from_history(self, user_messages, embed_fn):
+        """
+        Khởi tạo vector lịch sử từ các câu hỏi cũ (vd: sau khi tiếp tục session)
+
+        Args:
+            user_messages (list): Các câu hỏi trước của người dùng, cũ đến mới
+            embed_fn (callable): Hàm encode một câu hỏi
+        """
+        for message in user_messages[-self.history_vectors.maxlen:]:
+            self.remember(embed_fn(message))
+
+    def should_rewrite(self, query):
+        """
+        Câu hỏi có cần trộn với các câu hỏi trước không (quyết định trước khi tìm kiếm)
+
+        Args:
+            query (str): Câu hỏi
+
+        Returns:
+            bool: True nếu đã có lịch sử và câu hỏi là câu hỏi nối tiếp
+        """
+        return bool(self.history_vectors) and is_follow_up(query, self.max_words)
+
+    def rewrite(self, query, query_vector):
+        """
+        Trộn vector câu hỏi với vector lịch sử nếu là câu hỏi nối tiếp
+
+        Các câu hỏi gần hơn có trọng số lớn hơn (giảm dần theo cấp số nhân).
+
+        Args:
+            query (str): Câu hỏi
+            query_vector (list): Vector của câu hỏi
+
+        Returns:
+            np.ndarray: Vector đã trộn và chuẩn hóa, None nếu không cần viết lại
+        """
+        if not self.should_rewrite(query):
+            return None
+
+        weights = np.array([0.5 ** i for i in range(len(self.history_vectors))][::-1], dtype=np.float32)
+        history = np.average(np.stack(self.history_vectors), axis=0, weights=weights)
+
+        blended = np.asarray(query_vector, dtype=np.float32) + self.alpha * history
+        norm = np.linalg.norm(blended)
+        if norm == 0:
+            return None
+        return blended / norm
+
+
+def build_follow_up_transcripts(questions, follow_ups=None):
+    """
+    Tạo các đoạn hội thoại hai lượt từ bộ dữ liệu: lượt đầu là câu hỏi gốc, lượt sau là
+    câu hỏi nối tiếp chung chung; tài liệu đúng cho lượt sau vẫn là dòng gốc
+
+    Args:
+        questions (list): Danh sách câu hỏi trong bộ dữ liệu
+        follow_ups (list, optional): Các câu hỏi nối tiếp mẫu
+
+    Returns:
+        list: Danh sách tuple (câu hỏi đầu, câu hỏi nối tiếp, chỉ số dòng đúng)
+    """
+    follow_ups = follow_ups or [
+        "còn cách nào khác không?",
+        "vậy tôi nên làm gì tiếp theo?",
+        "điều đó có bình thường không?",
+        "bạn có thể nói cụ thể hơn không?",
+    ]
+    return [
+        (question, follow_ups[i % len(follow_ups)], i)
+        for i, question in enumerate(questions)
+    ]
+
+
+def build_topic_switch_transcripts(questions):
+    """
+    Tạo các đoạn hội thoại hai lượt đổi chủ đề: lượt sau là một câu hỏi khác trong bộ dữ liệu
+    (đầy đủ hoặc chỉ vế đầu, thường ngắn), tài liệu đúng là dòng của câu hỏi mới
+
+    Args:
+        questions (list): Danh sách câu hỏi trong bộ dữ liệu
+
+    Returns:
+        list: Danh sách tuple (câu hỏi đầu, câu hỏi đổi chủ đề, chỉ số dòng đúng)
+    """
+    transcripts = []
+    for i, question in enumerate(questions):
+        j = (i + 1) % len(questions)
+        if j == i:
+            continue
+        transcripts.append((question, questions[j], j))
+        first_clause = questions[j].split(",")[0].strip()
+        if first_clause != questions[j]:
+            transcripts.append((question, first_clause, j))
+    return transcripts
+
+
+def benchmark_rewrite(embedding_system, questions, k=TOP_K):
+    """
+    Đo chất lượng tìm kiếm (hit@k) và độ trễ của bước viết lại trên hội thoại nhiều lượt
+
+    Gồm hai nhóm: câu hỏi nối tiếp (viết lại phải giúp tìm đúng dòng của lượt trước) và câu hỏi
+    đổi chủ đề (viết lại không được làm giảm hit@k so với tìm bằng câu hỏi gốc).
+
+    Args:
+        embedding_system (EmbeddingSystem): Hệ thống embedding đã tải vector store
+        questions (list): Danh sách câu hỏi theo đúng thứ tự dòng trong vector store
+        k (int): Số kết quả tìm kiếm
+
+    Returns:
+        dict: hit@k khi dùng câu hỏi gốc và khi viết lại cho từng nhóm, tỉ lệ câu đổi chủ đề
+            bị viết lại nhầm và độ trễ viết lại
+    """
+    rewrite_ms = []
+
+    def run(transcripts):
+        raw_hits = 0
+        rewritten_hits = 0
+        rewritten = 0
+        for first, second, expected in transcripts:
+            rewriter = QueryRewriter()
+            rewriter.remember(embedding_system.embed_query(first))
+            second_vector = embedding_system.embed_query(second)
+            expected_question = questions[expected]
+
+            raw_docs = embedding_system.similarity_search_by_vector(second_vector, k=k)
+            raw_hits += any(doc.metadata.get("question") == expected_question for doc in raw_docs)
+
+            start = time.perf_counter()
+            blended = rewriter.rewrite(second, second_vector)
+            rewrite_ms.append((time.perf_counter() - start) * 1000)
+            rewritten += blended is not None
+
+            docs = embedding_system.similarity_search_by_vector(
+                blended if blended is not None else second_vector, k=k
+            )
+            rewritten_hits += any(doc.metadata.get("question") == expected_question for doc in docs)
+        total = len(transcripts) or 1
+        return raw_hits / total, rewritten_hits / total, rewritten / total
+
+    follow_raw, follow_blended, _ = run(build_follow_up_transcripts(questions))
+    switch_transcripts = build_topic_switch_transcripts(questions)
+    switch_raw, switch_rewritten, switch_rate = run(switch_transcripts)
+
+    return {
+        "transcripts": len(questions),
+        f"raw_hit@{k}": follow_raw,
+        f"blended_hit@{k}": follow_blended,
+        "topic_switch_transcripts": len(switch_transcripts),
+        f"topic_switch_raw_hit@{k}": switch_raw,
+        f"topic_switch_rewritten_hit@{k}": switch_rewritten,
+        "topic_switch_rewrite_rate": switch_rate,
+        "rewrite_ms_mean": sum(rewrite_ms) / len(rewrite_ms) if rewrite_ms else 0.0,
+        "rewrite_ms_max": max(rewrite_ms) if rewrite_ms else 0.0,
+    }
+
+
+if __name__ == "__main__":
+    from src.logger import setup_logger
+    from src.data_processor import DataProcessor
+    from src.embedding_system import EmbeddingSystem
+
+    setup_logger()
+
+    embedding_system = EmbeddingSystem()
+    if embedding_system.load_vector_store() is None:
+        print("Cần khởi tạo vector database trước (python main.py --setup-db)")
+    else:
+        questions = DataProcessor().preprocess_data()["question"].tolist()
+        result = benchmark_rewrite(embedding_system, questions)
+        logger.info(f"Kết quả benchmark viết lại câu hỏi: {result}")
+        for key, value in result.items():
+            print(f"{key}: {value}")
+        # Viết lại không được làm giảm chất lượng khi người dùng đổi chủ đề
+        if result[f"topic_switch_rewritten_hit@{TOP_K}"] < result[f"topic_switch_raw_hit@{TOP_K}"]:
+            logger.error("Viết lại câu hỏi làm giảm hit@k của câu hỏi đổi chủ đề")
+            sys.exit(1)
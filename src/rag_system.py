@@ -1,13 +1,92 @@
 """
 Module xử lý hệ thống RAG (Retrieval Augmented Generation)
 """
+import re
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
 from loguru import logger
-from langchain_core.runnables import RunnablePassthrough
+from langchain_core.runnables import RunnableLambda, RunnablePassthrough
 from langchain_core.output_parsers import StrOutputParser
 
 from src.embedding_system import EmbeddingSystem
-from src.llm_system import LLMSystem
-from src.config import TOP_K
+from src.llm_system import LLMSystem, ERROR_RESPONSE
+from src.logger import hot_logger, redact_query
+from src.metrics import metrics
+from src.query_rewriter import QueryRewriter
+from src.faq_matcher import FAQMatcher
+from src.context_selector import ContextSelector
+from src.crisis_detector import get_crisis_detector
+from src.stream_buffer import ResponseBuffer
+from src.settings import get_settings
+from src.config import (
+    VECTOR_DB_SHARDS_DIR, RETRIEVAL_PIPELINING, RETRIEVAL_WORKERS, PREFETCH_WORKERS, QUERY_REWRITE,
+    FAQ_FAST_PATH, CONTEXT_COMPRESSION, STREAM_PREAMBLE, STREAM_PREAMBLE_TEXT, CRISIS_DETECTION,
+    CRISIS_SEMANTIC
+)
+
+# Câu trả lời khi không tìm thấy tài liệu liên quan và khi xử lý câu hỏi bị lỗi
+NO_CONTEXT_RESPONSE = "Xin lỗi, tôi không có đủ thông tin để trả lời câu hỏi của bạn."
+PROCESSING_ERROR_RESPONSE = "Xin lỗi, đã xảy ra lỗi khi xử lý câu hỏi của bạn. Vui lòng thử lại sau."
+
+_retrieval_executor = None
+_retrieval_executor_lock = threading.Lock()
+
+
+def get_retrieval_executor():
+    """
+    Lấy thread pool dùng chung để chạy tìm kiếm song song với các bước khác
+
+    Returns:
+        ThreadPoolExecutor: Thread pool dùng chung cho toàn bộ tiến trình
+    """
+    global _retrieval_executor
+    if _retrieval_executor is None:
+        with _retrieval_executor_lock:
+            if _retrieval_executor is None:
+                _retrieval_executor = ThreadPoolExecutor(
+                    max_workers=RETRIEVAL_WORKERS,
+                    thread_name_prefix="retrieval"
+                )
+    return _retrieval_executor
+
+
+_prefetch_executor = None
+
+
+def get_prefetch_executor():
+    """
+    Lấy thread pool dùng chung cho tìm kiếm suy đoán (prefetch)
+
+    Tách khỏi thread pool tìm kiếm vì tìm kiếm chính (chạy trên thread pool tìm kiếm) chờ kết quả
+    prefetch; nếu cùng một pool, các luồng có thể cùng chờ những tác vụ chưa được chạy.
+
+    Returns:
+        ThreadPoolExecutor: Thread pool prefetch của tiến trình
+    """
+    global _prefetch_executor
+    if _prefetch_executor is None:
+        with _retrieval_executor_lock:
+            if _prefetch_executor is None:
+                _prefetch_executor = ThreadPoolExecutor(
+                    max_workers=PREFETCH_WORKERS,
+                    thread_name_prefix="prefetch"
+                )
+    return _prefetch_executor
+
+
+def normalize_query(query):
+    """
+    Chuẩn hóa câu hỏi để so khớp bản nháp với câu hỏi cuối cùng
+
+    Args:
+        query (str): Câu hỏi
+
+    Returns:
+        str: Câu hỏi viết thường, gộp khoảng trắng và bỏ dấu câu ở cuối
+    """
+    return re.sub(r"\s+", " ", query or "").strip().rstrip("?.!…").strip().lower()
 
 
 class RAGSystem:
@@ -15,17 +94,49 @@ class RAGSystem:
     Hệ thống RAG kết hợp retrieval và generation
     """
     
-    def __init__(self):
+    def __init__(self, llm_system=None):
         """
         Khởi tạo RAGSystem
+        
+        Args:
+            llm_system (LLMSystem, optional): Hệ thống LLM thay thế (vd: LLM giả lập khi đo tải)
         """
         self.embedding_system = EmbeddingSystem()
-        self.llm_system = LLMSystem()
+        self.llm_system = llm_system or LLMSystem()
         self.chain = None
         
+        # Cấu hình runtime dùng cho lượt xử lý hiện tại (lấy lại ở đầu mỗi lượt)
+        self.settings = get_settings()
+        
         # Thêm memory system
         from src.memory_system import MemorySystem
-        self.memory_system = MemorySystem(k=5)  # Lưu 5 tin nhắn gần nhất
+        self.memory_system = MemorySystem(k=self.settings.memory_k)  # Lưu memory_k tin nhắn gần nhất
+        
+        # Viết lại câu hỏi nối tiếp bằng cách trộn với vector các câu hỏi trước
+        self.query_rewriter = QueryRewriter() if QUERY_REWRITE else None
+        
+        # Trả lời trực tiếp bằng câu trả lời mẫu khi câu hỏi trùng câu hỏi trong dữ liệu
+        self.faq_matcher = FAQMatcher() if FAQ_FAST_PATH else None
+        
+        # Chọn số document và các câu liên quan nhất để giảm số token ngữ cảnh
+        self.context_selector = ContextSelector(
+            max_k=self.settings.top_k,
+            score_gap=self.settings.context_score_gap,
+            max_sentences=self.settings.context_max_sentences
+        ) if CONTEXT_COMPRESSION else None
+        
+        # Phát hiện tin nhắn khủng hoảng trước khi tìm kiếm và gọi LLM
+        self.crisis_detector = get_crisis_detector() if CRISIS_DETECTION else None
+        
+        # Câu hỏi của các document đã dùng cho câu trả lời gần nhất (ghi vào lịch sử)
+        self.last_sources = []
+        
+        # Thời gian (ms) của từng bước trong lượt streaming gần nhất
+        self.last_timings = {}
+        
+        # Kết quả tìm kiếm suy đoán (prefetch) cho bản nháp câu hỏi
+        self._prefetch = None
+        self._prefetch_lock = threading.Lock()
         
         logger.info("Khởi tạo RAGSystem")
     
@@ -33,14 +144,22 @@ class RAGSystem:
         """
         Thiết lập hệ thống RAG
         """
+        # Tải các shard nếu được cấu hình, khi đó tìm kiếm sẽ chạy song song trên mọi shard
+        if VECTOR_DB_SHARDS_DIR and self.embedding_system.load_shards() is not None:
+            logger.info("Đã thiết lập RAG với vector database phân mảnh")
+            return True
+        
         # Tải vector store
         vector_store = self.embedding_system.load_vector_store()
         if vector_store is None:
             logger.error("Không thể thiết lập RAG vì vector store chưa được tạo")
             return False
         
-        # Tạo retriever
-        retriever = vector_store.as_retriever(search_kwargs={"k": TOP_K})
+        # Theo dõi phiên bản vector store mới để tải lại khi --setup-db chạy xong
+        self.embedding_system.start_watcher()
+        
+        # Tạo retriever, luôn đi qua embedding_system để dùng vector store hiện hành
+        retriever = RunnableLambda(lambda query: self.embedding_system.similarity_search(query, k=self.settings.top_k))
         
         # Tạo prompt template
         prompt_template = self.llm_system.create_prompt_template()
@@ -59,6 +178,343 @@ class RAGSystem:
         logger.info("Đã thiết lập RAG thành công")
         return True
     
+    def close(self):
+        """
+        Dừng các luồng nền và bỏ phiên khỏi bộ nhớ đệm để tài nguyên được giải phóng
+        """
+        self.cancel_prefetch()
+        self.embedding_system.close()
+        if self.memory_system.session_id is not None:
+            self.memory_system.store.evict(self.memory_system.session_id)
+        self.memory_system.chat_history.clear()
+    
+    def prefetch(self, draft_query):
+        """
+        Bắt đầu tìm kiếm suy đoán cho bản nháp câu hỏi (khi người dùng đang gõ)
+        
+        Nếu câu hỏi cuối cùng khớp với bản nháp (sau khi chuẩn hóa), kết quả được dùng lại;
+        nếu không, kết quả bị bỏ. Gọi lại với bản nháp mới sẽ hủy lần prefetch trước.
+        
+        Args:
+            draft_query (str): Bản nháp câu hỏi
+        """
+        key = normalize_query(draft_query)
+        if not key:
+            return
+        
+        with self._prefetch_lock:
+            current = self._prefetch
+            if current is not None and current["key"] == key:
+                return
+            if current is not None:
+                current["future"].cancel()
+                metrics.increment("prefetch.cancelled")
+            self._prefetch = {
+                "key": key,
+                "future": get_prefetch_executor().submit(self._timed_search, draft_query),
+            }
+    
+    def cancel_prefetch(self):
+        """
+        Hủy lần tìm kiếm suy đoán đang chờ (nếu có)
+        """
+        with self._prefetch_lock:
+            current, self._prefetch = self._prefetch, None
+        if current is not None:
+            current["future"].cancel()
+            metrics.increment("prefetch.cancelled")
+    
+    def _search(self, query):
+        """
+        Encode câu hỏi và tìm kiếm, trả về cả vector để dùng lại cho bước viết lại câu hỏi, nén ngữ cảnh
+        và phát hiện khủng hoảng
+        
+        Returns:
+            tuple: (docs, vector câu hỏi)
+        """
+        needs_vector = (
+            self.query_rewriter is not None
+            or self.context_selector is not None
+            or (self.crisis_detector is not None and CRISIS_SEMANTIC)
+        )
+        if not needs_vector:
+            return self.embedding_system.similarity_search(query, k=self.settings.top_k), None
+        
+        try:
+            return self.embedding_system.search_with_vector(query, k=self.settings.top_k)
+        except Exception as e:
+            logger.error(f"Lỗi khi encode câu hỏi: {e}")
+            return [], None
+    
+    def _timed_search(self, query):
+        """
+        Tìm kiếm và ghi lại thời điểm bắt đầu / kết thúc
+        
+        Returns:
+            tuple: (docs, vector câu hỏi, thời điểm bắt đầu, thời điểm kết thúc)
+        """
+        start = time.perf_counter()
+        docs, query_vector = self._search(query)
+        return docs, query_vector, start, time.perf_counter()
+    
+    def _take_prefetch(self, query):
+        """
+        Lấy kết quả prefetch nếu khớp với câu hỏi cuối cùng
+        
+        Args:
+            query (str): Câu hỏi cuối cùng
+        
+        Returns:
+            tuple: (docs, vector câu hỏi), None nếu không có prefetch phù hợp
+        """
+        with self._prefetch_lock:
+            prefetch, self._prefetch = self._prefetch, None
+        if prefetch is None:
+            return None
+        
+        if prefetch["key"] != normalize_query(query):
+            prefetch["future"].cancel()
+            metrics.increment("prefetch.misses")
+            return None
+        
+        arrival = time.perf_counter()
+        docs, query_vector, start, end = prefetch["future"].result()
+        # Thời gian tiết kiệm là phần tìm kiếm đã chạy trước khi câu hỏi cuối cùng tới
+        saved_ms = max(0.0, min(end, arrival) - start) * 1000
+        metrics.increment("prefetch.hits")
+        metrics.observe("prefetch.saved_ms", saved_ms)
+        hot_logger.debug(f"Dùng lại kết quả prefetch, tiết kiệm {saved_ms:.1f}ms trước token đầu tiên")
+        return docs, query_vector
+    
+    def retrieve(self, query):
+        """
+        Tìm kiếm documents cho câu hỏi, dùng lại kết quả prefetch nếu khớp
+        
+        Với câu hỏi nối tiếp, vector câu hỏi được trộn với vector các câu hỏi trước
+        (đã lưu từ các lượt trước nên không cần encode lại) trước khi tìm kiếm, nên mỗi
+        câu hỏi chỉ tìm kiếm một lần.
+        
+        Args:
+            query (str): Câu hỏi của người dùng
+        
+        Returns:
+            list: Danh sách các document tương tự
+        """
+        docs, _, _ = self._retrieve(query)
+        return docs
+    
+    def _retrieve(self, query):
+        """
+        Tìm kiếm documents cho câu hỏi
+        
+        Returns:
+            tuple: (docs, vector đã dùng để tìm kiếm, vector gốc của câu hỏi), các vector
+                là None nếu không encode riêng
+        """
+        prefetched = self._take_prefetch(query)
+        
+        rewriter = self.query_rewriter
+        if rewriter is not None and not rewriter.history_vectors:
+            self._warm_query_rewriter()
+        if rewriter is None or not rewriter.should_rewrite(query):
+            docs, query_vector = prefetched if prefetched is not None else self._search(query)
+            if rewriter is not None and query_vector is not None:
+                rewriter.remember(query_vector)
+            return docs, query_vector, query_vector
+        
+        # Câu hỏi nối tiếp: trộn vector trước rồi chỉ tìm kiếm một lần với vector đã trộn
+        # (nếu có prefetch thì chỉ dùng lại vector, kết quả tìm kiếm theo câu hỏi gốc bị bỏ)
+        try:
+            query_vector = prefetched[1] if prefetched is not None and prefetched[1] is not None \
+                else self.embedding_system.embed_query(query)
+        except Exception as e:
+            logger.error(f"Lỗi khi encode câu hỏi: {e}")
+            return [], None, None
+        start = time.perf_counter()
+        blended = rewriter.rewrite(query, query_vector)
+        rewriter.remember(query_vector)
+        if blended is None:
+            return self.embedding_system.similarity_search_by_vector(query_vector, k=self.settings.top_k), \
+                query_vector, query_vector
+        metrics.increment("query_rewrite.blended")
+        metrics.observe("query_rewrite.ms", (time.perf_counter() - start) * 1000)
+        docs = self.embedding_system.similarity_search_by_vector(blended, k=self.settings.top_k)
+        return docs, blended, query_vector
+    
+    def build_context(self, docs, query_vector):
+        """
+        Tạo ngữ cảnh cho LLM từ các document tìm được
+        
+        Khi bật CONTEXT_COMPRESSION, chỉ giữ các document có điểm gần với document tốt nhất
+        và các câu liên quan nhất trong mỗi câu trả lời.
+        
+        Args:
+            docs (list): Danh sách document tìm được
+            query_vector (list): Vector đã dùng để tìm kiếm, None nếu không có
+        
+        Returns:
+            tuple: (ngữ cảnh, danh sách document đã đưa vào ngữ cảnh)
+        """
+        if self.context_selector is None:
+            return "\n\n".join([doc.page_content for doc in docs]), list(docs)
+        return self.context_selector.select_context(docs, query_vector, self.embedding_system.get_sentence_store())
+    
+    def _warm_query_rewriter(self):
+        """
+        Khởi tạo vector lịch sử từ memory khi tiếp tục một session đã có
+        """
+        user_messages = [
+            message.content for message in self.memory_system.chat_history.messages
+            if message.type == "human"
+        ]
+        if user_messages:
+            self.query_rewriter.warm_from_history(user_messages, self.embedding_system.embed_query)
+    
+    def refresh_settings(self):
+        """
+        Lấy cấu hình runtime hiện hành cho lượt xử lý mới và áp dụng cho memory, bộ chọn ngữ cảnh
+        
+        Returns:
+            RuntimeSettings: Cấu hình dùng cho lượt xử lý
+        """
+        settings = get_settings()
+        if settings is not self.settings:
+            self.settings = settings
+            self.memory_system.set_window(settings.memory_k)
+            if self.context_selector is not None:
+                self.context_selector.max_k = settings.top_k
+                self.context_selector.score_gap = settings.context_score_gap
+                self.context_selector.max_sentences = settings.context_max_sentences
+        return settings
+    
+    def reset_context(self):
+        """
+        Xóa ngữ cảnh tìm kiếm của session hiện tại (khi chuyển sang session khác)
+        """
+        self.cancel_prefetch()
+        if self.query_rewriter is not None:
+            self.query_rewriter.reset()
+    
+    def _timed_retrieve(self, query, timings):
+        """
+        Tìm kiếm documents và ghi thời gian tìm kiếm vào `timings`
+        """
+        start = time.perf_counter()
+        result = self._retrieve(query)
+        timings["retrieval_ms"] = (time.perf_counter() - start) * 1000
+        return result
+    
+    def _prepare(self, query, timings=None):
+        """
+        Lấy lịch sử hội thoại và tìm kiếm documents cho câu hỏi
+        
+        Khi bật RETRIEVAL_PIPELINING, tìm kiếm chạy trên thread pool song song với việc
+        tải lịch sử hội thoại từ memory store.
+        
+        Args:
+            query (str): Câu hỏi của người dùng
+            timings (dict, optional): Nơi ghi thời gian (ms) của bước tải lịch sử, tìm kiếm
+                và thời gian chờ tìm kiếm sau khi đã có lịch sử
+        
+        Returns:
+            tuple: (chat_history, docs, vector đã dùng để tìm kiếm, vector gốc của câu hỏi)
+        """
+        timings = {} if timings is None else timings
+        if RETRIEVAL_PIPELINING:
+            retrieval = get_retrieval_executor().submit(self._timed_retrieve, query, timings)
+            start = time.perf_counter()
+            chat_history = self.memory_system.get_chat_history()
+            loaded = time.perf_counter()
+            timings["history_ms"] = (loaded - start) * 1000
+            result = retrieval.result()
+            timings["retrieval_wait_ms"] = (time.perf_counter() - loaded) * 1000
+            return (chat_history, *result)
+        
+        start = time.perf_counter()
+        chat_history = self.memory_system.get_chat_history()
+        timings["history_ms"] = (time.perf_counter() - start) * 1000
+        return (chat_history, *self._timed_retrieve(query, timings))
+    
+    def get_prefetch_stats(self):
+        """
+        Thống kê hiệu quả của tìm kiếm suy đoán
+        
+        Returns:
+            dict: Số lần dùng lại, bỏ, hủy và thời gian tiết kiệm trước token đầu tiên
+        """
+        return {
+            "hits": metrics.get_counter("prefetch.hits"),
+            "misses": metrics.get_counter("prefetch.misses"),
+            "cancelled": metrics.get_counter("prefetch.cancelled"),
+            "saved_ms": metrics.summary("prefetch.saved_ms"),
+        }
+    
+    def match_crisis_keywords(self, query):
+        """
+        So khớp tin nhắn với từ điển khủng hoảng (chạy trước mọi bước khác)
+        
+        Args:
+            query (str): Câu hỏi của người dùng
+        
+        Returns:
+            str: Câu trả lời hướng dẫn hỗ trợ khẩn cấp, None nếu không phát hiện
+        """
+        if self.crisis_detector is None:
+            return None
+        term = self.crisis_detector.match_keywords(query)
+        if term is None:
+            return None
+        self.crisis_detector.flag(query, "keyword", term)
+        return self.crisis_detector.response
+    
+    def match_crisis_semantic(self, query, query_vector):
+        """
+        So sánh vector câu hỏi với các câu mẫu khủng hoảng (dùng lại vector của bước tìm kiếm)
+        
+        Args:
+            query (str): Câu hỏi của người dùng
+            query_vector (list): Vector gốc của câu hỏi, None để encode lại
+        
+        Returns:
+            str: Câu trả lời hướng dẫn hỗ trợ khẩn cấp, None nếu không phát hiện
+        """
+        if self.crisis_detector is None or not CRISIS_SEMANTIC:
+            return None
+        if query_vector is None:
+            query_vector = self.embedding_system.embed_query(query)
+        score = self.crisis_detector.match_vector(query_vector, self.embedding_system.embed_documents)
+        if score is None:
+            return None
+        self.crisis_detector.flag(query, "semantic", f"{score:.3f}")
+        return self.crisis_detector.response
+    
+    def match_faq(self, query, docs, chat_history):
+        """
+        Tìm câu trả lời mẫu cho câu hỏi trùng câu hỏi trong dữ liệu (bỏ qua LLM)
+        
+        Chỉ áp dụng cho lượt đầu tiên của phiên (chưa có lịch sử hội thoại), vì câu trả lời
+        mẫu không tính tới ngữ cảnh của các lượt trước.
+        
+        Args:
+            query (str): Câu hỏi của người dùng
+            docs (list): Danh sách document tìm được
+            chat_history (str): Lịch sử hội thoại
+        
+        Returns:
+            str: Câu trả lời mẫu, None nếu không dùng được fast path
+        """
+        if self.faq_matcher is None or chat_history:
+            return None
+        
+        answer, score = self.faq_matcher.match(query, docs)
+        if answer is None:
+            metrics.increment("faq.misses")
+            return None
+        
+        metrics.increment("faq.hits")
+        hot_logger.info(f"Trả lời bằng câu trả lời mẫu (độ tương đồng {score:.3f}), bỏ qua LLM")
+        return answer
+    
     def process_query(self, query):
         """
         Xử lý câu hỏi từ người dùng
@@ -70,72 +526,197 @@ class RAGSystem:
             str: Câu trả lời
         """
         try:
-            logger.info(f"Xử lý câu hỏi: {query}")
+            settings = self.refresh_settings()
+            # Không lấy mẫu: mọi lượt đều ghi phiên bản cấu hình đã dùng
+            logger.bind(settings_version=settings.version).info(
+                f"Xử lý câu hỏi (cấu hình v{settings.version}): {redact_query(query)}"
+            )
+            self.last_sources = []
             
-            # Lấy lịch sử hội thoại từ memory
-            chat_history = self.memory_system.get_chat_history()
+            # Tin nhắn khủng hoảng: trả ngay hướng dẫn hỗ trợ khẩn cấp, không tìm kiếm
+            response = self.match_crisis_keywords(query)
+            if response is not None:
+                self.memory_system.add_user_message(query)
+                self.memory_system.add_ai_message(response)
+                return response
+            
+            # Lấy lịch sử hội thoại từ memory và tìm kiếm documents tương tự
+            chat_history, docs, query_vector, raw_vector = self._prepare(query)
             
-            # Tìm kiếm documents tương tự
-            docs = self.embedding_system.similarity_search(query, k=TOP_K)
+            response = self.match_crisis_semantic(query, raw_vector)
+            if response is not None:
+                self.memory_system.add_user_message(query)
+                self.memory_system.add_ai_message(response)
+                return response
             
             if not docs:
                 logger.warning("Không tìm thấy documents tương tự")
-                return "Xin lỗi, tôi không có đủ thông tin để trả lời câu hỏi của bạn."
+                return NO_CONTEXT_RESPONSE
             
-            # Format context
-            context = "\n\n".join([doc.page_content for doc in docs])
+            # Câu hỏi trùng câu hỏi mẫu: dùng câu trả lời đã được kiểm duyệt
+            response = self.match_faq(query, docs, chat_history)
             
-            # Tạo câu trả lời với lịch sử hội thoại
-            response = self.llm_system.generate_response(query, context, chat_history)
+            if response is not None:
+                self.last_sources = [docs[0].metadata.get("question")]
+            else:
+                # Format context
+                context, used_docs = self.build_context(docs, query_vector)
+                self.last_sources = [doc.metadata.get("question") for doc in used_docs]
+                
+                # Tạo câu trả lời với lịch sử hội thoại
+                response = self.llm_system.generate_response(query, context, chat_history)
             
             # Cập nhật memory
             self.memory_system.add_user_message(query)
             self.memory_system.add_ai_message(response)
             
-            logger.info("Đã xử lý câu hỏi thành công")
+            hot_logger.info("Đã xử lý câu hỏi thành công")
             return response
         except Exception as e:
             logger.error(f"Lỗi khi xử lý câu hỏi: {e}")
-            return "Xin lỗi, đã xảy ra lỗi khi xử lý câu hỏi của bạn. Vui lòng thử lại sau."
+            return PROCESSING_ERROR_RESPONSE
             
-    def process_query_stream(self, query):
+    def process_query_stream(self, query, buffer=None, submitted=None):
         """
         Xử lý câu hỏi từ người dùng và trả về kết quả theo kiểu streaming
         
+        Thời gian từ lúc gửi tin nhắn tới phần trả lời đầu tiên được ghi vào metrics
+        `first_chunk.ms`, thời gian từng bước (tải lịch sử, tìm kiếm, tạo ngữ cảnh,
+        token đầu tiên của LLM) vào `stream_stage.*`.
+        
+        Args:
+            query (str): Câu hỏi của người dùng
+            buffer (ResponseBuffer, optional): Bộ đệm dùng chung, mỗi phần được thêm vào
+                trước khi yield để các tầng gọi không cần tự nối chuỗi
+            submitted (float, optional): Thời điểm (time.perf_counter) người dùng gửi tin nhắn
+        
+        Returns:
+            generator: Generator trả về từng phần của câu trả lời
+        """
+        if buffer is None:
+            buffer = ResponseBuffer()
+        submitted = submitted or time.perf_counter()
+        timings = {"queue_ms": (time.perf_counter() - submitted) * 1000}
+        self.last_timings = timings
+        
+        first_chunk = True
+        for chunk in self._stream_parts(query, buffer, timings):
+            if first_chunk:
+                first_chunk = False
+                timings["first_chunk_ms"] = (time.perf_counter() - submitted) * 1000
+                metrics.observe("first_chunk.ms", timings["first_chunk_ms"])
+            buffer.append(chunk)
+            yield chunk
+        
+        timings["total_ms"] = (time.perf_counter() - submitted) * 1000
+        for stage, value in timings.items():
+            # Thời gian tới phần đầu tiên đã được ghi vào first_chunk.ms
+            if stage != "first_chunk_ms":
+                metrics.observe(f"stream_stage.{stage}", value)
+        hot_logger.debug(f"Thời gian các bước của lượt streaming: {timings}")
+    
+    def _stream_parts(self, query, buffer, timings):
+        """
+        Các phần của câu trả lời streaming; process_query_stream thêm từng phần vào bộ đệm
+        trước khi yield tiếp nên `buffer` luôn chứa mọi phần đã sinh
+        
         Args:
             query (str): Câu hỏi của người dùng
+            buffer (ResponseBuffer): Bộ đệm câu trả lời
+            timings (dict): Nơi ghi thời gian (ms) của từng bước
         
         Returns:
             generator: Generator trả về từng phần của câu trả lời
         """
         try:
-            logger.info(f"Xử lý câu hỏi streaming: {query}")
+            settings = self.refresh_settings()
+            # Không lấy mẫu: mọi lượt đều ghi phiên bản cấu hình đã dùng
+            logger.bind(settings_version=settings.version).info(
+                f"Xử lý câu hỏi streaming (cấu hình v{settings.version}): {redact_query(query)}"
+            )
+            self.last_sources = []
             
-            # Lấy lịch sử hội thoại từ memory
-            chat_history = self.memory_system.get_chat_history()
+            # Tin nhắn khủng hoảng: trả ngay hướng dẫn hỗ trợ khẩn cấp, không tìm kiếm
+            escalation = self.match_crisis_keywords(query)
+            if escalation is not None:
+                yield escalation
+                self.memory_system.add_user_message(query)
+                self.memory_system.add_ai_message(buffer.text())
+                return
             
-            # Tìm kiếm documents tương tự
-            docs = self.embedding_system.similarity_search(query, k=TOP_K)
+            # Câu mở đầu được gửi ngay, trước khi tìm kiếm. Câu trả lời cuối cùng không do LLM viết
+            # (khủng hoảng, không có tài liệu, câu trả lời mẫu, lỗi) thay thế câu mở đầu trong bộ
+            # đệm, nên không hiển thị và không được lưu kèm câu mở đầu
+            preamble = STREAM_PREAMBLE_TEXT if STREAM_PREAMBLE else ""
+            if preamble:
+                yield preamble
+            
+            # Lấy lịch sử hội thoại từ memory và tìm kiếm documents tương tự
+            chat_history, docs, query_vector, raw_vector = self._prepare(query, timings)
+            
+            escalation = self.match_crisis_semantic(query, raw_vector)
+            if escalation is not None:
+                buffer.reset()
+                yield escalation
+                self.memory_system.add_user_message(query)
+                self.memory_system.add_ai_message(buffer.text())
+                return
             
             if not docs:
                 logger.warning("Không tìm thấy documents tương tự")
-                yield "Xin lỗi, tôi không có đủ thông tin để trả lời câu hỏi của bạn."
+                buffer.reset()
+                yield NO_CONTEXT_RESPONSE
                 return
             
-            # Format context
-            context = "\n\n".join([doc.page_content for doc in docs])
+            # Câu hỏi trùng câu hỏi mẫu: trả ngay câu trả lời đã được kiểm duyệt
+            faq_answer = self.match_faq(query, docs, chat_history)
             
-            # Tạo câu trả lời streaming với lịch sử hội thoại
-            full_response = ""
-            for chunk in self.llm_system.generate_response_stream(query, context, chat_history):
-                full_response += chunk
-                yield chunk
+            if faq_answer is not None:
+                self.last_sources = [docs[0].metadata.get("question")]
+                buffer.reset()
+                yield faq_answer
+            else:
+                # Format context
+                start = time.perf_counter()
+                context, used_docs = self.build_context(docs, query_vector)
+                self.last_sources = [doc.metadata.get("question") for doc in used_docs]
+                requested = time.perf_counter()
+                timings["context_ms"] = (requested - start) * 1000
+                
+                # Tạo câu trả lời streaming với lịch sử hội thoại, LLM viết tiếp từ câu mở đầu
+                first_token = True
+                for chunk in self.llm_system.generate_response_stream(
+                    query, context, chat_history, answer_prefix=preamble
+                ):
+                    if first_token:
+                        first_token = False
+                        timings["llm_first_token_ms"] = (time.perf_counter() - requested) * 1000
+                    if chunk == ERROR_RESPONSE:
+                        # Lỗi khi gọi LLM: thông báo lỗi thay cho câu mở đầu và phần đã sinh
+                        buffer.reset()
+                    yield chunk
             
             # Cập nhật memory sau khi hoàn thành
             self.memory_system.add_user_message(query)
-            self.memory_system.add_ai_message(full_response)
+            self.memory_system.add_ai_message(buffer.text())
             
-            logger.info("Đã xử lý câu hỏi streaming thành công")
+            hot_logger.info("Đã xử lý câu hỏi streaming thành công")
         except Exception as e:
             logger.error(f"Lỗi khi xử lý câu hỏi streaming: {e}")
-            yield "Xin lỗi, đã xảy ra lỗi khi xử lý câu hỏi của bạn. Vui lòng thử lại sau."
+            buffer.reset()
+            yield PROCESSING_ERROR_RESPONSE
+    
+    def get_first_chunk_stats(self):
+        """
+        Thống kê thời gian tới phần trả lời đầu tiên và thời gian từng bước
+        
+        Returns:
+            dict: Phân phối first_chunk.ms và stream_stage.* (ms)
+        """
+        stats = {"first_chunk_ms": metrics.summary("first_chunk.ms")}
+        for stage in ("queue_ms", "history_ms", "retrieval_ms", "retrieval_wait_ms",
+                      "context_ms", "llm_first_token_ms", "total_ms"):
+            summary = metrics.summary(f"stream_stage.{stage}")
+            if summary:
+                stats[stage] = summary
+        return stats
@@ -0,0 +1,411 @@
+"""
+Module đánh giá tìm kiếm: tạo bộ câu hỏi có nhãn (câu hỏi -> dòng đúng) từ bộ dữ liệu, đo
+recall@k, MRR, nDCG, độ trễ p50/p95 và bộ nhớ index cho từng cấu hình (mô hình embedding,
+loại index, k), so sánh với baseline và báo lỗi khi suy giảm quá ngưỡng
+"""
+import argparse
+import json
+import math
+import os
+import random
+import re
+import sys
+import time
+
+import faiss
+import numpy as np
+import pandas as pd
+from loguru import logger
+
+from src.config import (
+    EMBEDDING_MODEL, TOP_K, RETRIEVAL_EVAL_BASELINE_PATH, RETRIEVAL_EVAL_HOLDOUT,
+    RETRIEVAL_EVAL_MIN_RECALL, RETRIEVAL_EVAL_MAX_QUALITY_DROP, RETRIEVAL_EVAL_MAX_LATENCY_INCREASE,
+    RETRIEVAL_EVAL_MAX_MEMORY_INCREASE
+)
+from src.crisis_detector import fold_diacritics
+from src.metrics import percentile
+
+INDEX_TYPES = ("flat", "hnsw", "ivf", "sq8")
+QUALITY_METRICS = ("recall", "mrr", "ndcg")
+
+# Cách diễn đạt khác thường gặp trong câu hỏi của quân nhân (thay một lượt, không thay nối tiếp)
+PARAPHRASES = {
+    "làm thế nào để": "cách nào để",
+    "làm sao để": "có cách gì để",
+    "tôi nên làm gì": "tôi phải làm thế nào",
+    "tôi phải làm sao": "tôi nên xử lý ra sao",
+    "có cách nào": "có biện pháp nào",
+    "cảm thấy": "thấy",
+    "rất ": "",
+    "căng thẳng": "stress",
+    "lo lắng": "lo âu",
+    "mất ngủ": "khó ngủ",
+    "đồng đội": "anh em trong đơn vị",
+    "cấp trên": "chỉ huy",
+    "gia đình": "người thân",
+    "huấn luyện": "tập luyện",
+    "tập trung": "chú ý",
+    "mệt mỏi": "kiệt sức",
+    "tức giận": "bực tức",
+    "nhiệm vụ": "công tác",
+}
+_PARAPHRASE_PATTERN = re.compile("|".join(re.escape(key) for key in PARAPHRASES), re.IGNORECASE)
+
+# Từ chức năng bị bỏ khi tạo câu hỏi dạng từ khóa
+STOPWORDS = {
+    "tôi", "mình", "có", "thể", "làm", "thế", "nào", "sao", "để", "được", "này", "không", "nên",
+    "gì", "phải", "và", "khi", "trong", "với", "của", "những", "các", "rất", "điều", "đó", "là",
+    "bị", "hay", "thường", "mỗi", "một", "như", "ra", "cách", "rằng", "sẽ", "mà",
+}
+
+
+def paraphrase(question):
+    """
+    Diễn đạt lại câu hỏi: thay cụm từ đồng nghĩa và đảo vế hỏi lên trước
+
+    Args:
+        question (str): Câu hỏi gốc
+
+    Returns:
+        str: Câu hỏi diễn đạt lại, None nếu không khác câu gốc
+    """
+    text = _PARAPHRASE_PATTERN.sub(lambda m: PARAPHRASES[m.group(0).lower()], question)
+    clauses = [clause.strip() for clause in text.split(",") if clause.strip()]
+    if len(clauses) > 1:
+        text = ", ".join(clauses[1:]).rstrip("?") + ", " + clauses[0][0].lower() + clauses[0][1:]
+    text = re.sub(r"\s+", " ", text).strip()
+    return text if text.lower() != question.lower() else None
+
+
+def keyword_query(question):
+    """
+    Rút gọn câu hỏi thành các từ khóa (như khi người dùng gõ vội)
+
+    Args:
+        question (str): Câu hỏi gốc
+
+    Returns:
+        str: Chuỗi từ khóa, None nếu còn ít hơn 2 từ
+    """
+    words = [word for word in re.findall(r"\w+", question.lower()) if word not in STOPWORDS]
+    return " ".join(words) if len(words) >= 2 else None
+
+
+def build_eval_set(df, holdout=RETRIEVAL_EVAL_HOLDOUT, seed=0, labeled_path=None):
+    """
+    Tạo nội dung index và bộ câu hỏi có nhãn từ bộ dữ liệu
+
+    Một phần `holdout` số dòng được giữ lại: document của các dòng này chỉ chứa câu trả lời,
+    câu hỏi gốc của chúng được dùng làm câu hỏi chưa từng xuất hiện trong index. Các dòng còn lại
+    sinh câu hỏi diễn đạt lại, không dấu và dạng từ khóa.
+
+    Args:
+        df (pd.DataFrame): Dữ liệu đã tiền xử lý (question, answer, context)
+        holdout (float): Tỉ lệ số dòng giữ lại
+        seed (int): Hạt giống ngẫu nhiên chọn dòng giữ lại
+        labeled_path (str, optional): File CSV câu hỏi viết tay (cột query, expected_question)
+
+    Returns:
+        tuple: (nội dung document theo thứ tự dòng, danh sách câu hỏi dạng
+            {"query", "row_id", "kind"})
+    """
+    questions = df["question"].tolist()
+    answers = df["answer"].tolist()
+    held_out = set(random.Random(seed).sample(range(len(df)), int(round(len(df) * holdout))))
+
+    contents = [
+        f"Câu trả lời: {answer}" if row_id in held_out else context
+        for row_id, (context, answer) in enumerate(zip(df["context"].tolist(), answers))
+    ]
+
+    queries = []
+    for row_id, question in enumerate(questions):
+        if row_id in held_out:
+            queries.append({"query": question, "row_id": row_id, "kind": "held_out"})
+            continue
+        variants = (
+            ("paraphrase", paraphrase(question)),
+            ("no_diacritics", fold_diacritics(question).strip()),
+            ("keywords", keyword_query(question)),
+        )
+        queries.extend(
+            {"query": query, "row_id": row_id, "kind": kind}
+            for kind, query in variants if query
+        )
+
+    if labeled_path:
+        row_ids = {question: row_id for row_id, question in enumerate(questions)}
+        labeled = pd.read_csv(labeled_path, dtype=str, keep_default_na=False)
+        for query, expected in zip(labeled["query"], labeled["expected_question"]):
+            row_id = row_ids.get(expected.strip())
+            if row_id is None:
+                logger.warning(f"Bỏ qua câu hỏi có nhãn vì không tìm thấy câu hỏi đúng trong dữ liệu: {expected[:50]}")
+                continue
+            queries.append({"query": query, "row_id": row_id, "kind": "labeled"})
+
+    logger.info(f"Đã tạo {len(queries)} câu hỏi đánh giá ({len(held_out)} dòng giữ lại)")
+    return contents, queries
+
+
+def build_index(vectors, index_type):
+    """
+    Tạo FAISS index (tích vô hướng trên vector đã chuẩn hóa) theo loại
+
+    Args:
+        vectors (np.ndarray): Ma trận vector document
+        index_type (str): flat, hnsw, ivf hoặc sq8
+
+    Returns:
+        faiss.Index: Index đã thêm vector
+    """
+    n, dim = vectors.shape
+    if index_type == "flat":
+        index = faiss.IndexFlatIP(dim)
+    elif index_type == "hnsw":
+        index = faiss.IndexHNSWFlat(dim, 32, faiss.METRIC_INNER_PRODUCT)
+        index.hnsw.efSearch = 64
+    elif index_type == "ivf":
+        nlist = max(1, int(math.sqrt(n)))
+        index = faiss.IndexIVFFlat(faiss.IndexFlatIP(dim), dim, nlist, faiss.METRIC_INNER_PRODUCT)
+        index.train(vectors)
+        # Dò 1/4 số cụm: đánh đổi recall lấy tốc độ như khi dùng thật với dữ liệu lớn
+        index.nprobe = max(1, nlist // 4)
+    elif index_type == "sq8":
+        index = faiss.IndexScalarQuantizer(dim, faiss.ScalarQuantizer.QT_8bit, faiss.METRIC_INNER_PRODUCT)
+        index.train(vectors)
+    else:
+        raise ValueError(f"Loại index không hợp lệ: {index_type} (chọn trong {', '.join(INDEX_TYPES)})")
+    index.add(vectors)
+    return index
+
+
+def index_memory_bytes(index):
+    """
+    Dung lượng của index khi tuần tự hóa (xấp xỉ bộ nhớ index chiếm khi tải)
+
+    Returns:
+        int: Số byte
+    """
+    return int(faiss.serialize_index(index).nbytes)
+
+
+def score_ranks(ranks, k):
+    """
+    Tính recall@k, MRR@k và nDCG@k khi mỗi câu hỏi có đúng một document đúng
+
+    Args:
+        ranks (list): Hạng (bắt đầu từ 1) của document đúng với mỗi câu hỏi, None nếu không tìm thấy
+        k (int): Số kết quả được xét
+
+    Returns:
+        dict: recall, mrr, ndcg
+    """
+    hits = [rank for rank in ranks if rank is not None and rank <= k]
+    total = len(ranks) or 1
+    return {
+        "recall": round(len(hits) / total, 4),
+        "mrr": round(sum(1 / rank for rank in hits) / total, 4),
+        "ndcg": round(sum(1 / math.log2(rank + 1) for rank in hits) / total, 4),
+    }
+
+
+def evaluate_model(model_name, contents, queries, index_types=("flat",), ks=(TOP_K,)):
+    """
+    Đánh giá một mô hình embedding với các loại index và giá trị k
+
+    Câu hỏi được encode và tìm kiếm lần lượt từng câu như khi phục vụ; độ trễ encode và tìm kiếm
+    được đo riêng để thấy thay đổi đến từ mô hình hay từ index.
+
+    Args:
+        model_name (str): Tên mô hình embedding
+        contents (list): Nội dung document (theo thứ tự dòng)
+        queries (list): Câu hỏi có nhãn (kết quả của build_eval_set)
+        index_types (tuple): Các loại index
+        ks (tuple): Các giá trị k
+
+    Returns:
+        list: Báo cáo của từng cấu hình (mô hình, index, k)
+    """
+    from src.embedding_system import EmbeddingSystem
+
+    embedding_system = EmbeddingSystem(model_name=model_name, server_socket="", batching=False)
+    embedding_system.load_embeddings()
+    vectors = np.asarray(embedding_system.embed_documents(contents), dtype=np.float32)
+
+    query_vectors = []
+    encode_ms = []
+    for query in queries:
+        start = time.perf_counter()
+        query_vectors.append(embedding_system.embed_query(query["query"]))
+        encode_ms.append((time.perf_counter() - start) * 1000)
+    query_vectors = np.asarray(query_vectors, dtype=np.float32)
+
+    max_k = max(ks)
+    reports = []
+    for index_type in index_types:
+        index = build_index(vectors, index_type)
+        ranks = []
+        search_ms = []
+        for query, vector in zip(queries, query_vectors):
+            start = time.perf_counter()
+            _, ids = index.search(vector.reshape(1, -1), max_k)
+            search_ms.append((time.perf_counter() - start) * 1000)
+            found = ids[0].tolist()
+            ranks.append(found.index(query["row_id"]) + 1 if query["row_id"] in found else None)
+
+        total_ms = sorted(encode + search for encode, search in zip(encode_ms, search_ms))
+        latency = {
+            "encode_p50_ms": round(percentile(sorted(encode_ms), 50) or 0, 2),
+            "encode_p95_ms": round(percentile(sorted(encode_ms), 95) or 0, 2),
+            "search_p50_ms": round(percentile(sorted(search_ms), 50) or 0, 3),
+            "search_p95_ms": round(percentile(sorted(search_ms), 95) or 0, 3),
+            "latency_p50_ms": round(percentile(total_ms, 50) or 0, 2),
+            "latency_p95_ms": round(percentile(total_ms, 95) or 0, 2),
+        }
+        memory = index_memory_bytes(index)
+
+        for k in ks:
+            by_kind = {}
+            for kind in dict.fromkeys(query["kind"] for query in queries):
+                kind_ranks = [rank for rank, query in zip(ranks, queries) if query["kind"] == kind]
+                by_kind[kind] = score_ranks(kind_ranks, k)["recall"]
+            report = {
+                "config": f"{model_name}|{index_type}|k={k}",
+                "model": model_name,
+                "index": index_type,
+                "k": k,
+                "queries": len(queries),
+                **score_ranks(ranks, k),
+                "recall_by_kind": by_kind,
+                **latency,
+                "index_bytes": memory,
+            }
+            logger.info(f"Kết quả đánh giá tìm kiếm {report['config']}: {report}")
+            reports.append(report)
+
+    embedding_system.close()
+    return reports
+
+
+def load_baseline(path=RETRIEVAL_EVAL_BASELINE_PATH):
+    """
+    Đọc baseline (báo cáo của lần đo được chấp nhận trước đó, theo cấu hình)
+
+    Returns:
+        dict: Ánh xạ cấu hình -> báo cáo, rỗng nếu chưa có baseline
+    """
+    if not os.path.exists(path):
+        return {}
+    with open(path, encoding="utf-8") as f:
+        return json.load(f)
+
+
+def save_baseline(reports, path=RETRIEVAL_EVAL_BASELINE_PATH):
+    """
+    Ghi các báo cáo làm baseline mới (giữ baseline của các cấu hình không được đo lại)
+    """
+    baseline = load_baseline(path)
+    baseline.update({report["config"]: report for report in reports})
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(baseline, f, ensure_ascii=False, indent=2, sort_keys=True)
+    logger.info(f"Đã cập nhật baseline đánh giá tìm kiếm tại {path}")
+
+
+def find_regressions(reports, baseline, min_recall=RETRIEVAL_EVAL_MIN_RECALL,
+                     max_quality_drop=RETRIEVAL_EVAL_MAX_QUALITY_DROP,
+                     max_latency_increase=RETRIEVAL_EVAL_MAX_LATENCY_INCREASE,
+                     max_memory_increase=RETRIEVAL_EVAL_MAX_MEMORY_INCREASE):
+    """
+    So sánh báo cáo với baseline và ngưỡng tuyệt đối
+
+    Args:
+        reports (list): Báo cáo của lần đo hiện tại
+        baseline (dict): Baseline theo cấu hình
+        min_recall (float): Recall tối thiểu của mọi cấu hình
+        max_quality_drop (float): Mức giảm tuyệt đối cho phép của recall, MRR và nDCG
+        max_latency_increase (float): Tỉ lệ tăng cho phép của độ trễ p95
+        max_memory_increase (float): Tỉ lệ tăng cho phép của bộ nhớ index
+
+    Returns:
+        list: Mô tả các suy giảm, rỗng nếu đạt
+    """
+    regressions = []
+    for report in reports:
+        config = report["config"]
+        if report["recall"] < min_recall:
+            regressions.append(f"{config}: recall {report['recall']} thấp hơn ngưỡng {min_recall}")
+
+        base = baseline.get(config)
+        if base is None:
+            logger.warning(f"Chưa có baseline cho cấu hình {config}")
+            continue
+        for name in QUALITY_METRICS:
+            if report[name] < base[name] - max_quality_drop:
+                regressions.append(f"{config}: {name} giảm từ {base[name]} xuống {report[name]}")
+        if report["latency_p95_ms"] > base["latency_p95_ms"] * (1 + max_latency_increase):
+            regressions.append(
+                f"{config}: độ trễ p95 tăng từ {base['latency_p95_ms']}ms lên {report['latency_p95_ms']}ms"
+            )
+        if report["index_bytes"] > base["index_bytes"] * (1 + max_memory_increase):
+            regressions.append(
+                f"{config}: bộ nhớ index tăng từ {base['index_bytes']} lên {report['index_bytes']} byte"
+            )
+    return regressions
+
+
+def print_report(reports):
+    """
+    In bảng kết quả đánh giá tìm kiếm
+    """
+    columns = [
+        ("index", "index"), ("k", "k"), ("recall", "recall@k"), ("mrr", "MRR"), ("ndcg", "nDCG"),
+        ("encode_p95_ms", "encode p95"), ("search_p50_ms", "search p50"), ("search_p95_ms", "search p95"),
+        ("latency_p95_ms", "trễ p95"), ("index_bytes", "index byte"),
+    ]
+    for model in dict.fromkeys(report["model"] for report in reports):
+        print(model)
+        print("  ".join(f"{title:>10}" for _, title in columns))
+        for report in reports:
+            if report["model"] == model:
+                print("  ".join(f"{report[key]:>10}" for key, _ in columns))
+
+
+if __name__ == "__main__":
+    from src.logger import setup_logger
+    from src.data_processor import DataProcessor
+
+    parser = argparse.ArgumentParser(description="Đánh giá chất lượng và độ trễ tìm kiếm, báo lỗi khi suy giảm")
+    parser.add_argument("--models", default=EMBEDDING_MODEL, help="Các mô hình embedding, cách nhau bởi dấu phẩy")
+    parser.add_argument("--index-types", default="flat", help=f"Các loại index ({', '.join(INDEX_TYPES)})")
+    parser.add_argument("--k", default=str(TOP_K), help="Các giá trị k, cách nhau bởi dấu phẩy")
+    parser.add_argument("--holdout", type=float, default=RETRIEVAL_EVAL_HOLDOUT, help="Tỉ lệ số dòng giữ lại")
+    parser.add_argument("--seed", type=int, default=0, help="Hạt giống ngẫu nhiên chọn dòng giữ lại")
+    parser.add_argument("--queries", help="File CSV câu hỏi viết tay (cột query, expected_question)")
+    parser.add_argument("--baseline", default=RETRIEVAL_EVAL_BASELINE_PATH, help="File baseline JSON")
+    parser.add_argument("--update-baseline", action="store_true", help="Ghi kết quả lần đo này làm baseline")
+    parser.add_argument("--output", help="Ghi kết quả ra file JSON")
+    args = parser.parse_args()
+
+    setup_logger()
+
+    contents, queries = build_eval_set(DataProcessor().preprocess_data(), args.holdout, args.seed, args.queries)
+    index_types = tuple(name.strip() for name in args.index_types.split(",") if name.strip())
+    ks = tuple(int(k) for k in args.k.split(",") if k.strip())
+    reports = []
+    for model in (name.strip() for name in args.models.split(",") if name.strip()):
+        reports.extend(evaluate_model(model, contents, queries, index_types, ks))
+    print_report(reports)
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(reports, f, ensure_ascii=False, indent=2)
+
+    if args.update_baseline:
+        save_baseline(reports, args.baseline)
+        sys.exit(0)
+
+    regressions = find_regressions(reports, load_baseline(args.baseline))
+    for regression in regressions:
+        logger.error(f"Suy giảm tìm kiếm: {regression}")
+        print(f"SUY GIẢM: {regression}")
+    sys.exit(1 if regressions else 0)
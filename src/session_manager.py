@@ -0,0 +1,341 @@
+"""
+Module quản lý vòng đời các phiên chatbot trong tiến trình (thu hồi phiên rảnh, giới hạn số phiên)
+"""
+import hashlib
+import secrets
+import sys
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+
+from loguru import logger
+
+from src.config import SESSION_IDLE_TTL, SESSION_REAP_INTERVAL
+from src.memory_backends import get_memory_store
+from src.metrics import metrics
+from src.settings import get_settings
+
+# Tiền tố key (trong backend bộ nhớ) của mã tiếp tục phiên
+RESUME_TOKEN_PREFIX = "resume:"
+# Chỉ cảnh báo một lần khi mã tiếp tục phiên lưu trong backend không dùng chung
+_warned_local_resume = False
+
+
+def _resume_key(token):
+    """
+    Key lưu mã tiếp tục phiên trong backend, chỉ lưu băm của mã
+    """
+    return RESUME_TOKEN_PREFIX + hashlib.sha256(token.encode("utf-8")).hexdigest()
+
+
+def issue_resume_token(session_id):
+    """
+    Tạo mã bí mật để tiếp tục một session sau khi khởi động lại hoặc chuyển worker
+
+    Mã ngẫu nhiên 256 bit được giữ phía trình duyệt (cookie), phía máy chủ chỉ lưu băm của mã
+    trong backend bộ nhớ hội thoại (hết hạn theo MEMORY_TTL_SECONDS). ID session công khai
+    (ghi trong lịch sử) không đủ để tiếp tục session. Chỉ tiếp tục được sau khi khởi động lại
+    hoặc trên worker khác khi MEMORY_BACKEND là sqlite hoặc redis.
+
+    Args:
+        session_id (str): ID session
+
+    Returns:
+        str: Mã tiếp tục phiên
+    """
+    global _warned_local_resume
+    store = get_memory_store()
+    if not getattr(store.backend, "shared", False) and not _warned_local_resume:
+        _warned_local_resume = True
+        logger.warning(
+            "MEMORY_BACKEND lưu trong tiến trình: mã tiếp tục phiên mất khi khởi động lại và không "
+            "dùng được ở worker khác, cần dùng backend sqlite hoặc redis"
+        )
+    token = secrets.token_urlsafe(32)
+    store.set_value(_resume_key(token), session_id)
+    return token
+
+
+def resolve_resume_token(token):
+    """
+    Lấy ID session ứng với mã tiếp tục phiên
+
+    Args:
+        token (str): Mã tiếp tục phiên
+
+    Returns:
+        str: ID session, None nếu mã không hợp lệ hoặc đã hết hạn
+    """
+    if not token:
+        return None
+    return get_memory_store().get_value(_resume_key(token))
+
+
+def revoke_resume_token(token):
+    """
+    Thu hồi mã tiếp tục phiên (vd: khi người dùng xóa cuộc trò chuyện)
+    """
+    if token:
+        get_memory_store().delete_value(_resume_key(token))
+
+
+def estimate_session_bytes(chatbot):
+    """
+    Ước lượng dung lượng bộ nhớ riêng của một phiên
+
+    Gồm trạng thái hội thoại (conversation_history và memory hội thoại) và, khi phiên tự tải
+    mô hình embedding và vector store (EMBEDDING_BATCHING=false, không dùng embedding server),
+    cả tham số mô hình và các FAISS index của phiên. Khi dùng bộ gom lô hoặc embedding server,
+    mô hình và index được dùng chung nên không tính cho từng phiên.
+
+    Args:
+        chatbot (Chatbot): Chatbot của phiên
+
+    Returns:
+        int: Số byte ước lượng
+    """
+    total = chatbot.rag_system.embedding_system.memory_bytes()
+    for message in chatbot.conversation_history:
+        total += sys.getsizeof(message)
+        total += sum(sys.getsizeof(value) for value in message.values())
+
+    for message in chatbot.rag_system.memory_system.chat_history.messages:
+        total += sys.getsizeof(message) + sys.getsizeof(message.content)
+
+    return total
+
+
+class SessionManager:
+    """
+    Giữ Chatbot của từng phiên, thu hồi phiên rảnh sau TTL và giới hạn tổng số phiên theo LRU
+    """
+
+    def __init__(self, chatbot_factory, idle_ttl=SESSION_IDLE_TTL, max_sessions=None,
+                 reap_interval=SESSION_REAP_INTERVAL):
+        """
+        Khởi tạo SessionManager
+
+        Args:
+            chatbot_factory (callable): Hàm tạo Chatbot mới đã được thiết lập
+            idle_ttl (float): Thời gian (giây) phiên không hoạt động trước khi bị thu hồi
+            max_sessions (int, optional): Số phiên tối đa được giữ cùng lúc, mặc định lấy từ
+                cấu hình runtime (session_max_active)
+            reap_interval (float): Chu kỳ (giây) của luồng nền thu hồi phiên rảnh
+        """
+        self.chatbot_factory = chatbot_factory
+        self.idle_ttl = idle_ttl
+        self.max_sessions = max_sessions
+        self.reap_interval = reap_interval
+        self._sessions = OrderedDict()
+        self._lock = threading.RLock()
+        self._reaper = None
+
+        logger.info(f"Khởi tạo SessionManager (ttl={idle_ttl}s, tối đa {max_sessions or get_settings().session_max_active} phiên)")
+
+    def get_or_create(self, key, resume_session_id=None):
+        """
+        Lấy Chatbot của phiên, tạo mới nếu chưa có hoặc đã bị thu hồi
+
+        Args:
+            key (str): Khóa của phiên giao diện (vd: Streamlit session)
+            resume_session_id (str, optional): ID session hội thoại cần tiếp tục khi phải tạo lại Chatbot
+
+        Returns:
+            Chatbot: Chatbot của phiên
+        """
+        return self._get(key, resume_session_id, acquire=False)
+
+    @contextmanager
+    def use(self, key, resume_session_id=None):
+        """
+        Lấy Chatbot của phiên và đánh dấu phiên đang được dùng trong khối `with` (vd: khi đang
+        streaming câu trả lời): phiên đang dùng không bị thu hồi vì rảnh hay vượt giới hạn số phiên,
+        việc thu hồi được hoãn tới khi khối `with` kết thúc
+
+        Args:
+            key (str): Khóa của phiên giao diện
+            resume_session_id (str, optional): ID session hội thoại cần tiếp tục khi phải tạo lại Chatbot
+
+        Yields:
+            Chatbot: Chatbot của phiên
+        """
+        chatbot = self._get(key, resume_session_id, acquire=True)
+        try:
+            yield chatbot
+        finally:
+            with self._lock:
+                entry = self._sessions.get(key)
+                if entry is not None and entry["chatbot"] is chatbot:
+                    entry["in_use"] -= 1
+                    entry["last_access"] = time.time()
+            self._trim()
+
+    def _get(self, key, resume_session_id, acquire):
+        """
+        Lấy (hoặc tạo) Chatbot của phiên; Chatbot được tạo ngoài khóa nên khi hai luồng cùng tạo
+        cho một phiên, bản tạo sau bị đóng và cả hai dùng bản đã được lưu trước
+        """
+        self._start_reaper()
+
+        with self._lock:
+            entry = self._sessions.get(key)
+            if entry is not None:
+                return self._touch(key, entry, acquire)
+
+        chatbot = self.chatbot_factory()
+        if resume_session_id:
+            chatbot.resume_session(resume_session_id)
+
+        with self._lock:
+            entry = self._sessions.get(key)
+            if entry is None:
+                entry = self._sessions[key] = {"chatbot": chatbot, "last_access": time.time(), "in_use": 0}
+            current = self._touch(key, entry, acquire)
+
+        if current is not chatbot:
+            metrics.increment("sessions.duplicate_created")
+            try:
+                chatbot.close()
+            except Exception as e:
+                logger.error(f"Lỗi khi đóng Chatbot tạo trùng của phiên {key}: {e}")
+            return current
+
+        self._trim(keep=key)
+        return chatbot
+
+    def _touch(self, key, entry, acquire):
+        """
+        Cập nhật thời điểm truy cập (và số lượt đang dùng) của phiên, gọi khi đang giữ khóa
+        """
+        entry["last_access"] = time.time()
+        if acquire:
+            entry["in_use"] += 1
+        self._sessions.move_to_end(key)
+        return entry["chatbot"]
+
+    def _trim(self, keep=None):
+        """
+        Thu hồi các phiên ít dùng nhất khi vượt giới hạn số phiên, bỏ qua phiên đang dùng
+
+        Args:
+            keep (str, optional): Khóa của phiên không được thu hồi (vd: phiên vừa tạo)
+        """
+        with self._lock:
+            max_sessions = self.max_sessions or get_settings().session_max_active
+            excess = len(self._sessions) - max_sessions
+            overflow = []
+            for old_key, entry in self._sessions.items():
+                if len(overflow) >= excess:
+                    break
+                if old_key != keep and not entry["in_use"]:
+                    overflow.append((old_key, entry))
+            for old_key, _ in overflow:
+                del self._sessions[old_key]
+
+        for old_key, entry in overflow:
+            self._release(old_key, entry, reason="vượt giới hạn số phiên")
+
+        if overflow or keep is not None:
+            self._update_metrics()
+
+    def evict(self, key):
+        """
+        Thu hồi một phiên
+
+        Args:
+            key (str): Khóa của phiên
+
+        Returns:
+            bool: True nếu phiên tồn tại
+        """
+        with self._lock:
+            entry = self._sessions.pop(key, None)
+        if entry is None:
+            return False
+        self._release(key, entry, reason="yêu cầu thu hồi")
+        self._update_metrics()
+        return True
+
+    def evict_idle(self):
+        """
+        Thu hồi các phiên không hoạt động quá TTL (trừ phiên đang dùng)
+
+        Returns:
+            int: Số phiên đã thu hồi
+        """
+        cutoff = time.time() - self.idle_ttl
+        with self._lock:
+            expired = [
+                (key, entry) for key, entry in self._sessions.items()
+                if entry["last_access"] < cutoff and not entry["in_use"]
+            ]
+            for key, _ in expired:
+                del self._sessions[key]
+
+        for key, entry in expired:
+            self._release(key, entry, reason="không hoạt động")
+
+        self._update_metrics()
+        return len(expired)
+
+    def stats(self):
+        """
+        Thống kê các phiên đang sống
+
+        Returns:
+            dict: Số phiên và tổng dung lượng riêng của các phiên (byte, xem estimate_session_bytes)
+        """
+        with self._lock:
+            chatbots = [entry["chatbot"] for entry in self._sessions.values()]
+
+        return {
+            "live_sessions": len(chatbots),
+            "session_bytes": sum(estimate_session_bytes(chatbot) for chatbot in chatbots),
+        }
+
+    def _release(self, key, entry, reason):
+        """
+        Lưu những gì cần thiết rồi giải phóng Chatbot của phiên
+
+        Memory hội thoại đã được ghi xuyên xuống store, nên chỉ cần ghi nốt lịch sử
+        đang chờ trong hàng đợi trước khi bỏ tham chiếu.
+        """
+        chatbot = entry["chatbot"]
+        try:
+            chatbot.close()
+        except Exception as e:
+            logger.error(f"Lỗi khi giải phóng phiên {key}: {e}")
+        metrics.increment("sessions.evicted")
+        logger.info(f"Đã thu hồi phiên {key} ({reason})")
+
+    def _update_metrics(self):
+        """
+        Cập nhật gauge số phiên và dung lượng
+        """
+        stats = self.stats()
+        metrics.set_gauge("sessions.live", stats["live_sessions"])
+        metrics.set_gauge("sessions.bytes", stats["session_bytes"])
+
+    def _start_reaper(self):
+        """
+        Khởi động luồng nền thu hồi phiên rảnh (chỉ một lần)
+        """
+        if self._reaper is not None or self.reap_interval <= 0:
+            return
+        with self._lock:
+            if self._reaper is not None:
+                return
+            self._reaper = threading.Thread(target=self._reap_loop, name="session-reaper", daemon=True)
+            self._reaper.start()
+
+    def _reap_loop(self):
+        """
+        Vòng lặp của luồng nền thu hồi phiên rảnh
+        """
+        while True:
+            time.sleep(self.reap_interval)
+            try:
+                self.evict_idle()
+            except Exception as e:
+                logger.error(f"Lỗi khi thu hồi phiên rảnh: {e}")
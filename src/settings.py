@@ -0,0 +1,175 @@
+"""
+Module cấu hình runtime có kiểu dữ liệu và kiểm tra giá trị, có thể tải lại khi ứng dụng đang chạy
+(đổi file RUNTIME_SETTINGS_PATH hoặc gửi SIGHUP) để tinh chỉnh tham số tìm kiếm / LLM mà không cần triển khai lại
+"""
+import json
+import os
+import signal
+import threading
+import time
+
+from loguru import logger
+from pydantic import BaseModel, ConfigDict, Field, ValidationError
+
+from src.config import (
+    TOP_K, MEMORY_WINDOW_K, LLM_TEMPERATURE, LLM_MAX_TOKENS, FAQ_MATCH_THRESHOLD,
+    CONTEXT_SCORE_GAP, CONTEXT_MAX_SENTENCES, EMBEDDING_BATCH_WINDOW_MS, EMBEDDING_BATCH_MAX_SIZE,
+    SESSION_MAX_ACTIVE, RUNTIME_SETTINGS_PATH, RUNTIME_SETTINGS_CHECK_INTERVAL
+)
+
+
+class RuntimeSettings(BaseModel):
+    """
+    Các tham số có thể tinh chỉnh khi đang chạy; giá trị mặc định lấy từ biến môi trường (src/config.py)
+    """
+
+    model_config = ConfigDict(frozen=True, extra="forbid")
+
+    version: int = Field(default=1, ge=1, description="Phiên bản cấu hình, tăng mỗi lần tải lại có thay đổi")
+    top_k: int = Field(default=TOP_K, ge=1, le=50, description="Số document tìm kiếm cho mỗi câu hỏi")
+    memory_k: int = Field(default=MEMORY_WINDOW_K, ge=0, le=100, description="Số lượt hội thoại gần nhất đưa vào prompt")
+    llm_temperature: float = Field(default=LLM_TEMPERATURE, ge=0.0, le=2.0)
+    llm_max_tokens: int = Field(default=LLM_MAX_TOKENS, ge=1, le=32768)
+    faq_match_threshold: float = Field(default=FAQ_MATCH_THRESHOLD, ge=0.0, le=1.0)
+    context_score_gap: float = Field(default=CONTEXT_SCORE_GAP, ge=0.0)
+    context_max_sentences: int = Field(default=CONTEXT_MAX_SENTENCES, ge=1)
+    embedding_batch_window_ms: float = Field(default=EMBEDDING_BATCH_WINDOW_MS, ge=0.0)
+    embedding_batch_max_size: int = Field(default=EMBEDDING_BATCH_MAX_SIZE, ge=1)
+    session_max_active: int = Field(default=SESSION_MAX_ACTIVE, ge=1)
+
+    def tunables(self):
+        """
+        Các tham số (không gồm version), dùng để so sánh hai lần tải
+
+        Returns:
+            dict: Tên tham số -> giá trị
+        """
+        return self.model_dump(exclude={"version"})
+
+
+class SettingsManager:
+    """
+    Giữ RuntimeSettings hiện hành của tiến trình và tải lại từ file khi file thay đổi
+    """
+
+    def __init__(self, path=RUNTIME_SETTINGS_PATH, check_interval=RUNTIME_SETTINGS_CHECK_INTERVAL):
+        """
+        Khởi tạo SettingsManager
+
+        Args:
+            path (str): File JSON ghi đè các tham số, để trống nếu chỉ dùng biến môi trường
+            check_interval (float): Chu kỳ (giây) kiểm tra file thay đổi, 0 để chỉ tải lại khi được yêu cầu
+        """
+        self.path = path
+        self.check_interval = check_interval
+        # RLock: trình xử lý tín hiệu có thể chạy khi luồng chính đang giữ khóa
+        self._lock = threading.RLock()
+        self._mtime = None
+        self._next_check = 0.0
+        self._settings = RuntimeSettings()
+        self.reload()
+
+    def _file_mtime(self):
+        try:
+            return os.path.getmtime(self.path) if self.path else None
+        except OSError:
+            return None
+
+    def get(self):
+        """
+        Lấy cấu hình hiện hành, tải lại nếu file đã thay đổi (kiểm tra tối đa mỗi `check_interval` giây)
+
+        Returns:
+            RuntimeSettings: Cấu hình hiện hành (bất biến)
+        """
+        if self.path and self.check_interval > 0:
+            now = time.monotonic()
+            if now >= self._next_check:
+                self._next_check = now + self.check_interval
+                if self._file_mtime() != self._mtime:
+                    self.reload()
+        return self._settings
+
+    def reload(self):
+        """
+        Đọc lại file cấu hình; giá trị không hợp lệ bị bỏ qua và cấu hình cũ được giữ nguyên
+
+        Returns:
+            RuntimeSettings: Cấu hình hiện hành sau khi tải lại
+        """
+        with self._lock:
+            mtime = self._file_mtime()
+            overrides = {}
+            if mtime is not None:
+                try:
+                    with open(self.path, encoding="utf-8") as f:
+                        overrides = json.load(f)
+                except (OSError, ValueError) as e:
+                    logger.error(f"Không đọc được file cấu hình {self.path}: {e}")
+                    return self._settings
+            self._mtime = mtime
+
+            current = self._settings
+            try:
+                candidate = RuntimeSettings(**{**overrides, "version": current.version})
+            except ValidationError as e:
+                logger.error(f"Cấu hình trong {self.path} không hợp lệ, giữ phiên bản v{current.version}: {e}")
+                return current
+
+            if candidate.tunables() != current.tunables():
+                changed = {
+                    key: value for key, value in candidate.tunables().items()
+                    if current.tunables()[key] != value
+                }
+                self._settings = candidate.model_copy(update={"version": current.version + 1})
+                logger.info(f"Đã tải cấu hình runtime v{self._settings.version}, thay đổi: {changed}")
+            return self._settings
+
+
+_manager = None
+_manager_lock = threading.Lock()
+
+
+def get_settings_manager():
+    """
+    Lấy SettingsManager dùng chung cho toàn bộ tiến trình
+
+    Returns:
+        SettingsManager: Manager dùng chung
+    """
+    global _manager
+    if _manager is None:
+        with _manager_lock:
+            if _manager is None:
+                _manager = SettingsManager()
+    return _manager
+
+
+def get_settings():
+    """
+    Lấy cấu hình runtime hiện hành
+
+    Returns:
+        RuntimeSettings: Cấu hình hiện hành
+    """
+    return get_settings_manager().get()
+
+
+def install_reload_signal(signum=getattr(signal, "SIGHUP", None)):
+    """
+    Tải lại cấu hình khi tiến trình nhận tín hiệu (mặc định SIGHUP)
+
+    Chỉ đăng ký được từ luồng chính; ở luồng khác (vd: script Streamlit) cấu hình vẫn được
+    tải lại theo thay đổi của file.
+
+    Returns:
+        bool: True nếu đã đăng ký
+    """
+    if signum is None:
+        return False
+    try:
+        signal.signal(signum, lambda *_: get_settings_manager().reload())
+        return True
+    except ValueError:
+        logger.debug("Không đăng ký được tín hiệu tải lại cấu hình ngoài luồng chính")
+        return False
@@ -0,0 +1,239 @@
+"""
+Module quản lý vector database phân mảnh (shard) theo lĩnh vực / khu vực
+"""
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from loguru import logger
+from langchain_community.vectorstores import FAISS as LangchainFAISS
+
+from src.embedding_system import read_current_version, resolve_vector_db_path
+from src.config import VECTOR_DB_SHARDS_DIR, SHARD_SEARCH_WORKERS
+
+
+class ShardedIndexManager:
+    """
+    Quản lý nhiều vector store (shard) và tìm kiếm song song trên tất cả các shard
+    """
+
+    def __init__(self, embeddings, shards_dir=VECTOR_DB_SHARDS_DIR, max_workers=SHARD_SEARCH_WORKERS):
+        """
+        Khởi tạo ShardedIndexManager
+
+        Args:
+            embeddings: Đối tượng embedding dùng chung cho tất cả các shard
+            shards_dir (str): Thư mục chứa các shard, mỗi thư mục con là một shard
+            max_workers (int): Số luồng tối đa dùng để tìm kiếm song song
+        """
+        self.embeddings = embeddings
+        self.shards_dir = shards_dir
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="shard-search")
+
+        # Dict shard được thay thế nguyên khối (copy-on-write) nên luồng tìm kiếm
+        # luôn thấy một snapshot nhất quán mà không cần giữ lock
+        self.shards = {}
+        self._lock = threading.Lock()
+        # Chỉ một lần đồng bộ chạy tại một thời điểm để không tải cùng một shard hai lần
+        self._sync_lock = threading.Lock()
+        # Thư mục shard chưa phiên bản hóa đã được cảnh báo
+        self._unversioned = set()
+
+        logger.info(f"Khởi tạo ShardedIndexManager với thư mục shard {shards_dir or '(không có)'}")
+
+    def add_shard(self, name, path):
+        """
+        Tải và thêm một shard mới (hoặc thay thế shard cùng tên) mà không cần khởi động lại
+
+        Args:
+            name (str): Tên shard
+            path (str): Đường dẫn thư mục chứa vector store của shard
+
+        Returns:
+            bool: True nếu thêm thành công
+        """
+        current_path = resolve_vector_db_path(path)
+        if not os.path.exists(os.path.join(current_path, "index.faiss")):
+            logger.warning(f"Không tìm thấy index.faiss cho shard {name} tại {path}")
+            return False
+
+        try:
+            logger.info(f"Đang tải shard {name} từ {current_path}")
+            vector_store = LangchainFAISS.load_local(
+                current_path,
+                self.embeddings,
+                allow_dangerous_deserialization=True
+            )
+        except Exception as e:
+            logger.error(f"Lỗi khi tải shard {name}: {e}")
+            return False
+
+        with self._lock:
+            shards = dict(self.shards)
+            shards[name] = {"path": path, "vector_store": vector_store, "version": read_current_version(path)}
+            self.shards = shards
+
+        logger.info(f"Đã thêm shard {name}, tổng số shard: {len(shards)}")
+        return True
+
+    def drop_shard(self, name):
+        """
+        Gỡ một shard khỏi danh sách tìm kiếm
+
+        Args:
+            name (str): Tên shard
+
+        Returns:
+            bool: True nếu shard tồn tại và đã được gỡ
+        """
+        with self._lock:
+            if name not in self.shards:
+                logger.warning(f"Không tìm thấy shard {name} để gỡ")
+                return False
+            shards = dict(self.shards)
+            del shards[name]
+            self.shards = shards
+
+        logger.info(f"Đã gỡ shard {name}, tổng số shard: {len(shards)}")
+        return True
+
+    def list_shards(self):
+        """
+        Lấy danh sách tên các shard đang được phục vụ
+
+        Returns:
+            list: Danh sách tên shard
+        """
+        return sorted(self.shards.keys())
+
+    def sync_with_directory(self):
+        """
+        Đồng bộ danh sách shard với thư mục shard: thêm shard mới, tải lại shard có phiên bản mới
+        và gỡ shard đã bị xóa
+
+        Được gọi từ luồng theo dõi nền (không chạy trên luồng trả lời). Chỉ shard đã có con trỏ
+        CURRENT mới được tải: con trỏ được chuyển nguyên tử sau khi phiên bản ghi xong, nên không
+        bao giờ đọc phải index đang ghi dở.
+        """
+        with self._sync_lock:
+            found = {}
+            if self.shards_dir and os.path.isdir(self.shards_dir):
+                entries = list(os.scandir(self.shards_dir))
+            else:
+                entries = []
+            for entry in entries:
+                if not entry.is_dir():
+                    continue
+                if read_current_version(entry.path) is not None:
+                    found[entry.name] = entry.path
+                elif os.path.exists(os.path.join(entry.path, "index.faiss")) and entry.name not in self._unversioned:
+                    self._unversioned.add(entry.name)
+                    logger.warning(f"Bỏ qua shard {entry.name} chưa phiên bản hóa, cần khởi tạo lại bằng --setup-db --shard")
+
+            for name, path in found.items():
+                shard = self.shards.get(name)
+                if shard is None or shard["version"] != read_current_version(path):
+                    self.add_shard(name, path)
+
+            # Gỡ các shard được nạp từ thư mục shard nhưng đã bị xóa, shard thêm thủ công
+            # (vd: vector store mặc định) chỉ được tải lại khi có phiên bản mới
+            shards_dir = os.path.abspath(self.shards_dir) if self.shards_dir else None
+            for name in set(self.shards) - set(found):
+                shard = self.shards[name]
+                version = read_current_version(shard["path"])
+                if os.path.dirname(os.path.abspath(shard["path"])) == shards_dir:
+                    self.drop_shard(name)
+                elif version is not None and shard["version"] != version:
+                    self.add_shard(name, shard["path"])
+
+    def similarity_search(self, query, k=3):
+        """
+        Tìm kiếm song song trên tất cả các shard và gộp top-k theo điểm
+
+        Args:
+            query (str): Câu hỏi cần tìm
+            k (int): Số lượng kết quả trả về
+
+        Returns:
+            list: Danh sách các document tương tự, metadata có thêm trường 'shard'
+        """
+        return [doc for doc, _ in self.similarity_search_with_score(query, k=k)]
+
+    def similarity_search_with_score(self, query, k=3):
+        """
+        Tìm kiếm song song trên tất cả các shard, trả về kèm khoảng cách
+
+        Args:
+            query (str): Câu hỏi cần tìm
+            k (int): Số lượng kết quả trả về
+
+        Returns:
+            list: Danh sách tuple (document, score), score càng nhỏ càng gần
+        """
+        try:
+            # Chỉ encode câu hỏi một lần rồi dùng chung vector cho mọi shard
+            query_vector = self.embeddings.embed_query(query)
+        except Exception as e:
+            logger.error(f"Lỗi khi encode câu hỏi: {e}")
+            return []
+        return self.similarity_search_with_score_by_vector(query_vector, k=k)
+
+    def similarity_search_by_vector(self, query_vector, k=3):
+        """
+        Tìm kiếm song song trên tất cả các shard bằng vector đã encode sẵn
+
+        Args:
+            query_vector (list): Vector câu hỏi
+            k (int): Số lượng kết quả trả về
+
+        Returns:
+            list: Danh sách các document tương tự
+        """
+        return [doc for doc, _ in self.similarity_search_with_score_by_vector(query_vector, k=k)]
+
+    def similarity_search_with_score_by_vector(self, query_vector, k=3):
+        """
+        Tìm kiếm song song trên tất cả các shard bằng vector, trả về kèm khoảng cách
+
+        Args:
+            query_vector (list): Vector câu hỏi
+            k (int): Số lượng kết quả trả về
+
+        Returns:
+            list: Danh sách tuple (document, score), score càng nhỏ càng gần
+        """
+        shards = self.shards
+        if not shards:
+            logger.error("Không có shard nào để tìm kiếm")
+            return []
+
+        try:
+            # FAISS nhả GIL khi tìm kiếm nên các shard chạy song song thực sự
+            futures = {
+                name: self.executor.submit(
+                    shard["vector_store"].similarity_search_with_score_by_vector, query_vector, k
+                )
+                for name, shard in shards.items()
+            }
+
+            results = []
+            for name, future in futures.items():
+                try:
+                    for doc, score in future.result():
+                        doc.metadata["shard"] = name
+                        results.append((doc, float(score)))
+                except Exception as e:
+                    logger.error(f"Lỗi khi tìm kiếm trên shard {name}: {e}")
+
+            results.sort(key=lambda item: item[1])
+            logger.debug(f"Đã gộp {len(results)} kết quả từ {len(shards)} shard")
+            return results[:k]
+        except Exception as e:
+            logger.error(f"Lỗi khi tìm kiếm trên các shard: {e}")
+            return []
+
+    def close(self):
+        """
+        Giải phóng thread pool
+        """
+        self.executor.shutdown(wait=False)
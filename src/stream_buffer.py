@@ -0,0 +1,125 @@
+"""
+Module gom các phần câu trả lời streaming và điều tiết số lần cập nhật giao diện
+"""
+import time
+
+from src.config import STREAM_RENDER_INTERVAL_MS, STREAM_RENDER_CHARS
+from src.metrics import metrics
+
+
+class ResponseBuffer:
+    """
+    Bộ đệm câu trả lời streaming dùng chung giữa các tầng (RAG, Chatbot, giao diện)
+
+    Các phần được thêm vào danh sách và chỉ được nối khi cần đọc toàn bộ nội dung,
+    tránh việc mỗi tầng tự nối chuỗi bằng `+=` sau mỗi phần.
+    """
+
+    def __init__(self):
+        """
+        Khởi tạo ResponseBuffer
+        """
+        self._parts = []
+        self._text = ""
+        self._joined = 0
+        self.chars = 0
+
+    def append(self, chunk):
+        """
+        Thêm một phần câu trả lời
+
+        Args:
+            chunk (str): Phần câu trả lời
+        """
+        self._parts.append(chunk)
+        self.chars += len(chunk)
+
+    def reset(self):
+        """
+        Bỏ toàn bộ nội dung đã có (vd: câu mở đầu khi câu trả lời cuối cùng không do LLM viết)
+        """
+        self._parts = []
+        self._text = ""
+        self._joined = 0
+        self.chars = 0
+
+    def text(self):
+        """
+        Lấy toàn bộ nội dung hiện có (các phần mới được nối một lần rồi lưu lại)
+
+        Returns:
+            str: Nội dung câu trả lời
+        """
+        if self._joined < len(self._parts):
+            self._text += "".join(self._parts[self._joined:])
+            self._joined = len(self._parts)
+        return self._text
+
+    def __len__(self):
+        return self.chars
+
+
+class StreamRenderer:
+    """
+    Điều tiết việc hiển thị câu trả lời streaming: chỉ vẽ lại khi đã qua một khoảng thời gian
+    hoặc đã có đủ số ký tự mới, và ghi lại số lần vẽ / thời gian CPU của mỗi câu trả lời
+    """
+
+    def __init__(self, render, buffer=None, interval_ms=STREAM_RENDER_INTERVAL_MS,
+                 min_chars=STREAM_RENDER_CHARS, cursor="▌"):
+        """
+        Khởi tạo StreamRenderer
+
+        Args:
+            render (callable): Hàm hiển thị nội dung (vd: placeholder.markdown)
+            buffer (ResponseBuffer, optional): Bộ đệm câu trả lời dùng chung
+            interval_ms (float): Khoảng thời gian tối thiểu giữa hai lần vẽ (ms)
+            min_chars (int): Vẽ ngay khi có ít nhất số ký tự mới này, kể cả chưa hết khoảng thời gian
+            cursor (str): Ký tự con trỏ hiển thị khi câu trả lời chưa xong
+        """
+        self.render = render
+        self.buffer = buffer if buffer is not None else ResponseBuffer()
+        self.interval = interval_ms / 1000.0
+        self.min_chars = min_chars
+        self.cursor = cursor
+        self.renders = 0
+        self.chunks = 0
+        self._last_render = 0.0
+        self._rendered_chars = 0
+        self._cpu_start = time.thread_time()
+
+    def update(self):
+        """
+        Được gọi sau mỗi phần mới trong bộ đệm; vẽ lại nếu đến lượt
+        """
+        self.chunks += 1
+        now = time.monotonic()
+        if (now - self._last_render >= self.interval
+                or self.buffer.chars - self._rendered_chars >= self.min_chars
+                or self.buffer.chars < self._rendered_chars):
+            self._draw(self.buffer.text() + self.cursor)
+            self._last_render = now
+
+    def finish(self, text=None):
+        """
+        Vẽ nội dung cuối cùng (không có con trỏ) và ghi metrics của câu trả lời
+
+        Args:
+            text (str, optional): Nội dung thay thế (vd: thông báo lỗi)
+
+        Returns:
+            str: Nội dung đã hiển thị
+        """
+        text = self.buffer.text() if text is None else text
+        self._draw(text)
+
+        metrics.observe("stream.renders", self.renders)
+        metrics.observe("stream.chunks", self.chunks)
+        metrics.observe("stream.reply_chars", len(text))
+        metrics.observe("stream.reply_cpu_ms", (time.thread_time() - self._cpu_start) * 1000)
+        return text
+
+    def _draw(self, text):
+        self.render(text)
+        self.renders += 1
+        self._rendered_chars = self.buffer.chars
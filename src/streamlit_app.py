@@ -2,37 +2,103 @@
 Giao diện người dùng Streamlit cho chatbot (giống ChatGPT UI)
 """
 import streamlit as st
+import streamlit.components.v1 as components
 from loguru import logger
 import sys
 import os
+import uuid
 from datetime import datetime
 
 # Thêm thư mục gốc vào sys.path
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
-from src.logger import setup_logger
+from src.logger import setup_logger, hot_logger, redact_query
 from src.chatbot import Chatbot
-from src.config import STREAMLIT_TITLE, STREAMLIT_DESCRIPTION
+from src.session_manager import (
+    SessionManager, issue_resume_token, resolve_resume_token, revoke_resume_token
+)
+from src.stream_buffer import StreamRenderer
+from src.config import STREAMLIT_TITLE, STREAMLIT_DESCRIPTION, MEMORY_TTL_SECONDS
+
+# Cookie giữ mã tiếp tục phiên (không đưa lên URL để không lộ khi chia sẻ đường dẫn)
+RESUME_COOKIE = "mpc_resume"
+
+
+def create_chatbot():
+    """Tạo và thiết lập một Chatbot mới cho phiên"""
+    logger.info("Khởi tạo chatbot cho phiên mới")
+    chatbot = Chatbot()
+    if not chatbot.setup():
+        logger.error("Không thể thiết lập chatbot")
+    return chatbot
+
+
+@st.cache_resource
+def get_session_manager():
+    """Lấy SessionManager dùng chung cho mọi phiên Streamlit trong tiến trình"""
+    return SessionManager(create_chatbot)
+
+
+def get_chatbot():
+    """Lấy Chatbot của phiên hiện tại, tạo lại (và tiếp tục session) nếu đã bị thu hồi"""
+    return get_session_manager().get_or_create(
+        st.session_state.session_key,
+        resume_session_id=st.session_state.get("session_id")
+    )
+
+
+def set_resume_cookie(token):
+    """
+    Ghi mã tiếp tục phiên vào cookie của trình duyệt (SameSite=Strict, Secure khi dùng HTTPS)
+
+    Streamlit không cho script đặt header Set-Cookie nên cookie được ghi bằng JavaScript và
+    không thể là HttpOnly: script khác chạy trên trang đọc được mã. Cần reverse proxy đặt cookie
+    HttpOnly nếu yêu cầu bảo mật cao hơn.
+    """
+    components.html(
+        f"""<script>
+        const doc = window.parent.document;
+        doc.cookie = "{RESUME_COOKIE}={token}; Max-Age={MEMORY_TTL_SECONDS}; Path=/; SameSite=Strict"
+            + (window.parent.location.protocol === "https:" ? "; Secure" : "");
+        </script>""",
+        height=0
+    )
 
 
 def initialize_session_state():
     """Khởi tạo session state"""
-    if "chatbot" not in st.session_state:
-        logger.info("Khởi tạo chatbot trong session state")
-        st.session_state.chatbot = Chatbot()
-        setup_success = st.session_state.chatbot.setup()
-        if not setup_success:
+    if "session_key" not in st.session_state:
+        # Chatbot được giữ trong SessionManager, session state chỉ giữ khóa để có thể thu hồi phiên rảnh
+        st.session_state.session_key = str(uuid.uuid4())
+    
+    if "session_id" not in st.session_state:
+        # ID session công khai trên URL (phiên bản cũ) không được dùng để tiếp tục session
+        if "session" in st.query_params:
+            del st.query_params["session"]
+        
+        # Tiếp tục session cũ nếu cookie có mã tiếp tục phiên hợp lệ (sau khi khởi động lại / đổi worker)
+        resume_token = st.context.cookies.get(RESUME_COOKIE)
+        resume_id = resolve_resume_token(resume_token)
+        if resume_id:
+            st.session_state.session_id = resume_id
+            st.session_state.resume_token = resume_token
+        
+        chatbot = get_chatbot()
+        if not chatbot.ready:
             st.error("Không thể khởi tạo chatbot. Vui lòng kiểm tra logs để biết thêm chi tiết.")
-            logger.error("Không thể khởi tạo chatbot trong session state")
+        if resume_id:
+            st.session_state.messages = list(chatbot.get_conversation_history())
+        else:
+            st.session_state.resume_token = issue_resume_token(chatbot.history_manager.session_id)
+            st.session_state.pending_resume_cookie = st.session_state.resume_token
+        
+        # Lấy session_id từ chatbot
+        st.session_state.session_id = chatbot.history_manager.session_id
+        logger.info(f"Session ID: {st.session_state.session_id}")
     
     if "messages" not in st.session_state:
         logger.info("Khởi tạo lịch sử tin nhắn trong session state")
         st.session_state.messages = []
-        
-    if "session_id" not in st.session_state:
-        # Lấy session_id từ chatbot
-        st.session_state.session_id = st.session_state.chatbot.history_manager.session_id
-        logger.info(f"Session ID: {st.session_state.session_id}")
 
 
 def display_chat_history():
@@ -54,6 +120,8 @@ def main():
 
     # Khởi tạo session
     initialize_session_state()
+    if "pending_resume_cookie" in st.session_state:
+        set_resume_cookie(st.session_state.pop("pending_resume_cookie"))
     
     # Sidebar giữ nguyên
     with st.sidebar:
@@ -76,8 +144,11 @@ def main():
         # Nút tạo phiên chat mới (ẩn)
         if st.button("Xóa cuộc trò chuyện", key="clear_chat"):
             # Tạo session mới (ẩn)
-            new_session_id = st.session_state.chatbot.history_manager.create_new_session()
+            new_session_id = get_chatbot().new_session()
             st.session_state.session_id = new_session_id
+            revoke_resume_token(st.session_state.get("resume_token"))
+            st.session_state.resume_token = issue_resume_token(new_session_id)
+            st.session_state.pending_resume_cookie = st.session_state.resume_token
             # Xóa lịch sử chat trong UI
             st.session_state.messages = []
             st.rerun()
@@ -91,7 +162,7 @@ def main():
 
     # Ô nhập liệu chat nằm dưới cùng (Streamlit mặc định đặt ở đó)
     if prompt := st.chat_input("Nhập câu hỏi của bạn..."):
-        logger.info(f"Người dùng nhập: {prompt}")
+        hot_logger.info(f"Người dùng nhập: {redact_query(prompt)}")
 
         # Hiển thị tin nhắn người dùng
         st.session_state.messages.append({"role": "user", "content": prompt})
@@ -101,18 +172,23 @@ def main():
         # Trả lời của chatbot
         with st.chat_message("assistant"):
             message_placeholder = st.empty()
-            full_response = ""
+            # Gom các phần câu trả lời, chỉ vẽ lại theo chu kỳ thời gian / số ký tự
+            renderer = StreamRenderer(message_placeholder.markdown)
             try:
-                for chunk in st.session_state.chatbot.process_message_stream(prompt):
-                    full_response += chunk
-                    message_placeholder.markdown(full_response + "▌")
-                message_placeholder.markdown(full_response)
+                # Phiên không bị thu hồi trong lúc đang streaming câu trả lời
+                with get_session_manager().use(
+                    st.session_state.session_key,
+                    resume_session_id=st.session_state.get("session_id")
+                ) as chatbot:
+                    for _ in chatbot.process_message_stream(prompt, renderer.buffer):
+                        renderer.update()
+                full_response = renderer.finish()
 
                 st.session_state.messages.append({"role": "assistant", "content": full_response})
-                logger.info("Đã hiển thị câu trả lời streaming")
+                hot_logger.info("Đã hiển thị câu trả lời streaming")
             except Exception as e:
                 error_message = "Xin lỗi, đã xảy ra lỗi khi xử lý câu hỏi của bạn. Vui lòng thử lại sau."
-                message_placeholder.markdown(error_message)
+                renderer.finish(error_message)
                 st.session_state.messages.append({"role": "assistant", "content": error_message})
                 logger.error(f"Lỗi khi xử lý câu trả lời streaming: {e}")
 
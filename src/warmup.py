@@ -0,0 +1,224 @@
+"""
+Module khởi động mô hình embedding: giới hạn số luồng torch / OpenMP theo số worker trên máy và
+encode thử một lô câu mẫu trước khi phục vụ để câu hỏi đầu tiên không chịu độ trễ khởi động
+"""
+import os
+import threading
+import time
+
+from loguru import logger
+
+from src.config import (
+    EMBEDDING_WORKERS, EMBEDDING_NUM_THREADS, EMBEDDING_INTEROP_THREADS,
+    EMBEDDING_WARMUP_BATCH, EMBEDDING_WARMUP_ROUNDS
+)
+from src.metrics import metrics, percentile
+
+# Câu mẫu với nhiều độ dài khác nhau để khởi tạo kernel cho các kích thước đầu vào thường gặp
+WARMUP_TEXTS = [
+    "tôi bị mất ngủ",
+    "làm sao để bớt căng thẳng trước khi hành quân?",
+    "tôi nhớ nhà và cảm thấy cô đơn khi ở đơn vị, tôi nên làm gì?",
+    "mối quan hệ với đồng đội không tốt khiến tôi chán nản, không muốn tham gia sinh hoạt chung",
+    "sau đợt diễn tập tôi thường gặp ác mộng, giật mình giữa đêm và khó tập trung khi huấn luyện",
+    "gia đình gặp khó khăn về kinh tế trong khi tôi đang làm nhiệm vụ xa nhà, tôi lo lắng "
+    "không biết phải xoay xở thế nào và có nên báo cáo với chỉ huy hay không",
+    "tôi là chiến sĩ mới nhập ngũ",
+    "áp lực kỷ luật và lịch sinh hoạt dày đặc làm tôi mệt mỏi, đôi khi cáu gắt với mọi người",
+]
+# Đoạn dài gần với độ dài document trong vector store
+WARMUP_TEXTS.append(" ".join(WARMUP_TEXTS))
+
+# Số luồng đã cấu hình cho tiến trình (chỉ cấu hình một lần)
+_thread_plan = None
+_thread_lock = threading.Lock()
+# Kết quả khởi động mô hình của tiến trình (mô hình chỉ cần khởi động một lần)
+_warmup_report = None
+_warmup_done = False
+_warmup_lock = threading.Lock()
+
+
+def available_cpus():
+    """
+    Số CPU tiến trình được phép chạy (tôn trọng CPU affinity / cpuset của container)
+
+    Returns:
+        int: Số CPU khả dụng
+    """
+    try:
+        return len(os.sched_getaffinity(0))
+    except (AttributeError, OSError):
+        return os.cpu_count() or 1
+
+
+def thread_plan(workers=EMBEDDING_WORKERS, num_threads=EMBEDDING_NUM_THREADS,
+                interop_threads=EMBEDDING_INTEROP_THREADS):
+    """
+    Tính số luồng intra-op / inter-op cho mỗi tiến trình
+
+    Args:
+        workers (int): Số tiến trình cùng chạy mô hình trên máy
+        num_threads (int): Số luồng intra-op, 0 để chia đều số CPU khả dụng cho các worker
+        interop_threads (int): Số luồng inter-op
+
+    Returns:
+        dict: Số CPU khả dụng, số worker, số luồng intra-op và inter-op
+    """
+    cpus = available_cpus()
+    workers = max(1, workers)
+    return {
+        "cpus": cpus,
+        "workers": workers,
+        "intra_op_threads": num_threads if num_threads > 0 else max(1, cpus // workers),
+        "inter_op_threads": max(1, interop_threads),
+    }
+
+
+def configure_threads(workers=EMBEDDING_WORKERS, num_threads=EMBEDDING_NUM_THREADS,
+                      interop_threads=EMBEDDING_INTEROP_THREADS):
+    """
+    Giới hạn số luồng của torch, OpenMP / MKL và FAISS cho tiến trình, để các worker cùng máy
+    và luồng phục vụ (vd: Streamlit) không tranh nhau CPU
+
+    Chỉ có hiệu lực ở lần gọi đầu tiên; số luồng inter-op của torch chỉ đặt được trước khi
+    torch chạy tác vụ song song đầu tiên.
+
+    Returns:
+        dict: Số luồng đã áp dụng (xem thread_plan)
+    """
+    global _thread_plan
+    if _thread_plan is not None:
+        return _thread_plan
+
+    with _thread_lock:
+        if _thread_plan is not None:
+            return _thread_plan
+
+        plan = thread_plan(workers, num_threads, interop_threads)
+        intra = str(plan["intra_op_threads"])
+        # Thư viện nạp sau (và tiến trình con) đọc số luồng OpenMP / MKL từ biến môi trường
+        for name in ("OMP_NUM_THREADS", "MKL_NUM_THREADS"):
+            os.environ.setdefault(name, intra)
+
+        import torch
+        torch.set_num_threads(plan["intra_op_threads"])
+        try:
+            torch.set_num_interop_threads(plan["inter_op_threads"])
+        except RuntimeError:
+            logger.debug("Torch đã khởi tạo luồng inter-op, giữ nguyên số luồng inter-op")
+        plan["inter_op_threads"] = torch.get_num_interop_threads()
+
+        try:
+            import faiss
+            faiss.omp_set_num_threads(plan["intra_op_threads"])
+        except (ImportError, AttributeError):
+            pass
+
+        metrics.set_gauge("embedding.threads.intra_op", plan["intra_op_threads"])
+        metrics.set_gauge("embedding.threads.inter_op", plan["inter_op_threads"])
+        logger.info(
+            f"Cấu hình luồng embedding: {plan['intra_op_threads']} intra-op, {plan['inter_op_threads']} inter-op "
+            f"({plan['cpus']} CPU khả dụng, {plan['workers']} worker)"
+        )
+        _thread_plan = plan
+        return plan
+
+
+def _timed_ms(fn, *args):
+    start = time.perf_counter()
+    fn(*args)
+    return (time.perf_counter() - start) * 1000
+
+
+def warm_up(embeddings, batch_size=EMBEDDING_WARMUP_BATCH, rounds=EMBEDDING_WARMUP_ROUNDS, samples=5):
+    """
+    Encode thử các câu mẫu: một câu hỏi (đo độ trễ lạnh), các lô kích thước 1, 2, 4, ... tới
+    `batch_size` (như các lô của bộ gom lô) trong `rounds` vòng, rồi đo lại độ trễ câu hỏi khi đã nóng
+
+    Args:
+        embeddings: Mô hình embedding (có embed_query và embed_documents)
+        batch_size (int): Kích thước lô lớn nhất khi khởi động
+        rounds (int): Số vòng encode các lô
+        samples (int): Số lần đo độ trễ sau khi khởi động
+
+    Returns:
+        dict: Độ trễ lạnh, độ trễ nóng (trung vị), tổng thời gian khởi động (ms) và tỉ lệ chênh lệch
+    """
+    start = time.perf_counter()
+    cold_ms = _timed_ms(embeddings.embed_query, WARMUP_TEXTS[1])
+
+    sizes = []
+    size = 1
+    while size <= max(1, batch_size):
+        sizes.append(size)
+        size *= 2
+    for round_index in range(rounds):
+        for size in sizes:
+            offset = round_index + size
+            batch = [WARMUP_TEXTS[(offset + i) % len(WARMUP_TEXTS)] for i in range(size)]
+            embeddings.embed_documents(batch)
+
+    warm = sorted(
+        _timed_ms(embeddings.embed_query, WARMUP_TEXTS[i % len(WARMUP_TEXTS)])
+        for i in range(1, samples + 1)
+    )
+    warm_ms = percentile(warm, 50)
+    report = {
+        "cold_ms": round(cold_ms, 1),
+        "warm_ms": round(warm_ms, 1),
+        "warmup_ms": round((time.perf_counter() - start) * 1000, 1),
+        "speedup": round(cold_ms / warm_ms, 1) if warm_ms > 0 else 0.0,
+    }
+
+    metrics.observe("embedding.warmup.cold_ms", cold_ms)
+    metrics.observe("embedding.warmup.warm_ms", warm_ms)
+    logger.info(
+        f"Đã khởi động mô hình embedding trong {report['warmup_ms']}ms: câu hỏi đầu tiên {report['cold_ms']}ms, "
+        f"sau khởi động {report['warm_ms']}ms (nhanh hơn {report['speedup']} lần)"
+    )
+    return report
+
+
+def warm_up_once(embeddings):
+    """
+    Khởi động mô hình embedding một lần cho mỗi tiến trình: các phiên tải mô hình riêng (tắt
+    EMBEDDING_BATCHING) không lặp lại bước khởi động. Lỗi khi khởi động chỉ được ghi log,
+    không làm hỏng mô hình đã tải thành công.
+
+    Args:
+        embeddings: Mô hình embedding (có embed_query và embed_documents)
+
+    Returns:
+        dict: Kết quả của lần khởi động đầu tiên (xem warm_up), None nếu lỗi
+    """
+    global _warmup_report, _warmup_done
+    if _warmup_done:
+        return _warmup_report
+
+    with _warmup_lock:
+        if _warmup_done:
+            return _warmup_report
+        try:
+            _warmup_report = warm_up(embeddings)
+        except Exception as e:
+            metrics.increment("embedding.warmup.errors")
+            logger.warning(f"Lỗi khi khởi động mô hình embedding, bỏ qua bước khởi động: {e}")
+        _warmup_done = True
+        return _warmup_report
+
+
+if __name__ == "__main__":
+    from src.logger import setup_logger
+    from src.embedding_system import EmbeddingSystem
+
+    setup_logger()
+
+    embedding_system = EmbeddingSystem(server_socket="", batching=False)
+    load_start = time.perf_counter()
+    embedding_system.load_embeddings(warmup=False)
+    load_ms = (time.perf_counter() - load_start) * 1000
+
+    result = {"load_ms": round(load_ms, 1), **configure_threads(), **warm_up(embedding_system.embeddings)}
+    logger.info(f"Kết quả khởi động mô hình embedding: {result}")
+    for key, value in result.items():
+        print(f"{key}: {value}")
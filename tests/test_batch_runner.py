@@ -0,0 +1,22 @@
+"""
+Kiểm thử checkpoint của chế độ batch
+"""
+import json
+
+from src.batch_runner import BatchRunner
+
+
+def test_checkpoint_retries_only_llm_errors(tmp_path):
+    output = tmp_path / "answers.jsonl"
+    rows = [
+        {"id": "1", "answer": "ok"},
+        {"id": "2", "error": "no_context"},
+        {"id": "3", "error": "llm_error"},
+        {"id": "4", "error": "llm_error"},
+        {"id": "4", "answer": "ok"},
+        {"id": "5", "answer": "ok"},
+        {"id": "5", "error": "llm_error"},
+    ]
+    output.write_text("".join(json.dumps(row) + "\n" for row in rows) + '{"id": "6", "ans', encoding="utf-8")
+
+    assert BatchRunner.load_checkpoint(str(output)) == {"1", "2", "4"}
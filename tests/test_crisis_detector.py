@@ -0,0 +1,35 @@
+"""
+Kiểm thử so khớp từ điển của bộ phát hiện khủng hoảng
+"""
+import pytest
+
+from src.crisis_detector import CrisisDetector
+
+
+@pytest.fixture
+def detector():
+    return CrisisDetector(semantic=False)
+
+
+@pytest.mark.parametrize("message", [
+    "tôi cần tư vấn",
+    "Tôi cần tư vấn về chuyện gia đình",
+    "chủ nghĩa tư bản là gì",
+    "có nên uống thuốc ngủ không",
+    "Tôi mất ngủ, có nên uống thuốc ngủ để dễ ngủ hơn không?",
+    "cứ từ từ rồi mọi chuyện sẽ ổn",
+])
+def test_ordinary_messages_do_not_flag(detector, message):
+    assert detector.match_keywords(message) is None
+
+
+@pytest.mark.parametrize("message, term", [
+    ("Tôi đã nghĩ tới chuyện tự vẫn", "tự vẫn"),
+    ("tôi muốn tự bắn mình", "tự bắn"),
+    ("Tôi chỉ muốn TỰ TỬ cho xong", "tự tử"),
+    ("tối nay tôi sẽ uống hết thuốc ngủ", "uống hết thuốc ngủ"),
+    ("toi khong muon song nua", "không muốn sống"),
+    ("toi muon chet", "muốn chết"),
+])
+def test_crisis_messages_flag(detector, message, term):
+    assert detector.match_keywords(message) == term
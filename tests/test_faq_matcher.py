@@ -0,0 +1,45 @@
+"""
+Kiểm thử so khớp câu hỏi mẫu (FAQ fast path)
+"""
+import pytest
+
+from src.faq_matcher import FAQMatcher
+
+QUESTION = (
+    "Tôi thường mất ngủ trước khi có nhiệm vụ quan trọng, tôi có nên uống thuốc ngủ "
+    "để ngủ được không hay nên tìm cách khác?"
+)
+
+
+@pytest.fixture
+def matcher():
+    return FAQMatcher(threshold=0.92)
+
+
+def test_same_question_matches(matcher):
+    assert matcher.similarity(QUESTION, QUESTION) == 1.0
+    assert matcher.similarity(QUESTION.upper() + "  ", QUESTION) == 1.0
+
+
+def test_filler_words_still_match(matcher):
+    query = QUESTION.replace("Tôi thường", "Cho tôi hỏi, tôi thường")
+    assert matcher.similarity(query, QUESTION) >= 0.92
+
+
+@pytest.mark.parametrize("query", [
+    QUESTION.replace("tôi có nên", "tôi không nên"),
+    QUESTION.replace("tôi có nên", "tôi đừng"),
+    QUESTION.replace("có nên", "có"),
+    QUESTION.replace("hay nên", "hay chưa nên"),
+])
+def test_negated_question_does_not_match(matcher, query):
+    assert matcher.similarity(query, QUESTION) == 0.0
+
+
+@pytest.mark.parametrize("query", [
+    QUESTION.replace("trước khi", "sau khi"),
+    QUESTION.replace("mất ngủ", "mất tập trung"),
+    QUESTION.replace("nhiệm vụ", "kỳ thi"),
+])
+def test_near_miss_question_does_not_match(matcher, query):
+    assert matcher.similarity(query, QUESTION) < 0.92
@@ -0,0 +1,61 @@
+"""
+Kiểm thử ghi lịch sử ở luồng nền (HistoryWriter)
+"""
+import pandas as pd
+import pytest
+
+import src.history_writer as history_writer
+from src.history_writer import HistoryWriter
+
+
+def make_row(session_id, content):
+    return {
+        "timestamp": "2024-01-01 00:00:00",
+        "session_id": session_id,
+        "role": "user",
+        "content": content,
+        "sources": "",
+        "body_id": "",
+    }
+
+
+@pytest.fixture
+def writer(monkeypatch):
+    monkeypatch.setattr(history_writer, "HISTORY_DEDUP", False)
+    writer = HistoryWriter(max_queue_size=10, batch_size=10, flush_interval=0.05, write_retries=1)
+    yield writer
+    writer.close()
+
+
+def test_flush_writes_rows_in_order(writer, tmp_path):
+    history_file = str(tmp_path / "history.csv")
+    for i in range(5):
+        writer.submit(history_file, make_row("s1", f"tin nhắn {i}"))
+
+    assert writer.flush(history_file, timeout=5)
+    assert pd.read_csv(history_file)["content"].tolist() == [f"tin nhắn {i}" for i in range(5)]
+
+
+def test_failed_file_does_not_lose_other_files(writer, tmp_path):
+    missing_file = str(tmp_path / "missing" / "history.csv")
+    history_file = str(tmp_path / "history.csv")
+    writer.submit(missing_file, make_row("s1", "không ghi được"))
+    writer.submit(history_file, make_row("s2", "ghi được"))
+
+    assert not writer.flush(timeout=5)
+    assert not writer.flush(missing_file, timeout=5)
+    assert writer.flush(history_file, timeout=5)
+    assert pd.read_csv(history_file)["content"].tolist() == ["ghi được"]
+
+
+def test_full_queue_writes_synchronously(writer, tmp_path, monkeypatch):
+    history_file = str(tmp_path / "history.csv")
+    writer.submit(history_file, make_row("s1", "qua hàng đợi"))
+
+    def full(*args, **kwargs):
+        raise history_writer.queue.Full
+
+    monkeypatch.setattr(writer.queue, "put", full)
+    writer.submit(history_file, make_row("s1", "ghi trực tiếp"))
+
+    assert pd.read_csv(history_file)["content"].tolist() == ["qua hàng đợi", "ghi trực tiếp"]
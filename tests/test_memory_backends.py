@@ -0,0 +1,43 @@
+"""
+Kiểm thử các backend bộ nhớ hội thoại
+"""
+import time
+
+import pytest
+
+from src.memory_backends import FakeRedis, InMemoryBackend, RedisBackend, SQLiteBackend
+
+
+@pytest.fixture(params=["memory", "sqlite", "fakeredis"])
+def backend(request, tmp_path):
+    if request.param == "sqlite":
+        return SQLiteBackend(str(tmp_path / "memory.sqlite3"))
+    if request.param == "fakeredis":
+        return RedisBackend(FakeRedis())
+    return InMemoryBackend()
+
+
+def test_append_keeps_last_messages(backend):
+    for i in range(5):
+        backend.append("s1", "user", f"tin nhắn {i}", max_messages=3)
+
+    assert [m["content"] for m in backend.load("s1")] == ["tin nhắn 2", "tin nhắn 3", "tin nhắn 4"]
+    backend.clear("s1")
+    assert backend.load("s1") == []
+
+
+def test_values_are_separate_from_sessions(backend):
+    backend.set_value("resume:abc", "s1", ttl=60)
+
+    assert backend.get_value("resume:abc") == "s1"
+    assert backend.load("resume:abc") == []
+
+    backend.delete_value("resume:abc")
+    assert backend.get_value("resume:abc") is None
+
+
+def test_values_expire(backend):
+    backend.set_value("resume:abc", "s1", ttl=1)
+    time.sleep(1.1)
+
+    assert backend.get_value("resume:abc") is None
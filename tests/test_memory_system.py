@@ -0,0 +1,32 @@
+"""
+Kiểm thử cửa sổ lịch sử hội thoại của MemorySystem
+"""
+from src.memory_backends import InMemoryBackend, SessionMemoryStore
+from src.memory_system import MemorySystem
+
+
+def make_memory(k, turns):
+    memory = MemorySystem(k=k, session_id="s1", store=SessionMemoryStore(InMemoryBackend()))
+    for i in range(turns):
+        memory.add_user_message(f"câu hỏi {i}")
+        memory.add_ai_message(f"câu trả lời {i}")
+    return memory
+
+
+def test_chat_history_keeps_last_k_turns():
+    history = make_memory(k=1, turns=4).get_chat_history()
+
+    assert "câu hỏi 3" in history and "câu trả lời 3" in history
+    assert "câu hỏi 2" not in history
+
+
+def test_set_window_changes_prompt_history():
+    memory = make_memory(k=1, turns=4)
+    memory.set_window(3)
+    history = memory.get_chat_history()
+
+    assert "câu hỏi 1" in history and "câu trả lời 3" in history
+    assert "câu hỏi 0" not in history
+
+    memory.set_window(0)
+    assert memory.get_chat_history() == ""
@@ -0,0 +1,71 @@
+"""
+Kiểm thử vòng đời phiên trong SessionManager
+"""
+import threading
+from types import SimpleNamespace
+
+from src.session_manager import SessionManager
+
+
+class FakeChatbot:
+    def __init__(self):
+        self.closed = False
+        self.conversation_history = []
+        self.rag_system = SimpleNamespace(
+            embedding_system=SimpleNamespace(memory_bytes=lambda: 0),
+            memory_system=SimpleNamespace(chat_history=SimpleNamespace(messages=[])),
+        )
+
+    def resume_session(self, session_id):
+        pass
+
+    def close(self):
+        self.closed = True
+
+
+def test_concurrent_create_keeps_one_chatbot():
+    created = []
+    barrier = threading.Barrier(2)
+
+    def factory():
+        chatbot = FakeChatbot()
+        created.append(chatbot)
+        barrier.wait(timeout=5)
+        return chatbot
+
+    manager = SessionManager(factory, max_sessions=10, reap_interval=0)
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(manager.get_or_create("a"))) for _ in range(2)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert len(created) == 2
+    assert results[0] is results[1]
+    assert [chatbot.closed for chatbot in created].count(True) == 1
+    assert not results[0].closed
+
+
+def test_session_in_use_is_not_evicted():
+    manager = SessionManager(FakeChatbot, max_sessions=1, reap_interval=0)
+
+    with manager.use("a") as first:
+        second = manager.get_or_create("b")
+        assert not first.closed
+        assert manager.stats()["live_sessions"] == 2
+
+    assert first.closed
+    assert not second.closed
+    assert manager.stats()["live_sessions"] == 1
+
+
+def test_idle_session_in_use_is_not_reaped():
+    manager = SessionManager(FakeChatbot, idle_ttl=0, max_sessions=10, reap_interval=0)
+
+    with manager.use("a") as chatbot:
+        assert manager.evict_idle() == 0
+        assert not chatbot.closed
+
+    assert manager.evict_idle() == 1
+    assert chatbot.closed